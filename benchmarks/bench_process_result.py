@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Benchmark results/s and job size of master_tasks.process_result.
+
+Compares the pooled session factory and compact payloads against building
+an engine, checking the schema, opening a connection and merging a pickled
+Monitor for every result, as before. Results which leave the state unchanged
+are answered from the state cache without the database, so results which
+miss the state cache and read the database are measured separately.
+
+The state cache is kept in an in-process stand-in for Redis, unless
+`--redis` is given, in which case that Redis must be running.
+
+Usage: python benchmarks/bench_process_result.py [-n RESULTS] [--redis]
+
+The script runs from any directory, against the gefion package of this
+checkout.
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import yaml
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)  # Checkout, not an installed gefion.
+
+from gefion import database, master_tasks, state  # noqa: E402
+from gefion.models import Base, Monitor  # noqa: E402
+from tests.test_state import FakeRedis  # noqa: E402
+
+
+def process_result_unpooled(monitor, result_dict, config):
+    """Process result with per-call engine setup, as before pooling."""
+    engine = create_engine(config['database'].get('uri', ':memory:'))
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    monitor = session.merge(monitor)
+    monitor.last_availability = result_dict.get('availability')
+    monitor.last_message = result_dict.get('message')
+    session.commit()
+    session.close()
+    engine.dispose()
+
+
+def measure(process, make_arguments, count, before_each=None,
+            alternate=False):
+    """Return results/s and pickled job size of a processing function.
+
+    Arguments are pickled and unpickled for every result, as rq does for
+        every job.
+
+    Arguments:
+        before_each (callable): Called before every result, untimed.
+        alternate (bool): Alternate availability, so that every result
+            changes the state.
+    """
+    size = 0
+    elapsed = 0.0
+    for index in range(count):
+        if before_each:
+            before_each()
+        result_dict = {'availability': not (alternate and index % 2),
+                       'runtime': 0.1, 'message': '',
+                       'timestamp': time.time()}
+        start_time = time.perf_counter()
+        job_data = pickle.dumps(make_arguments(result_dict))
+        size = len(job_data)
+        process(*pickle.loads(job_data))
+        elapsed += time.perf_counter() - start_time
+    return count / elapsed, size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--results', type=int, default=500,
+                        help='Results processed per variant.')
+    parser.add_argument('--redis', action='store_true',
+                        help='Keep the state cache in the configured Redis.')
+    args = parser.parse_args()
+    count = args.results
+
+    handle, path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(handle)
+    with open(os.path.join(ROOT, 'config_master.example.yml')) as \
+            config_file:
+        config = yaml.safe_load(config_file)
+    config['database'] = {'uri': 'sqlite:///' + path}
+    handle, config_path = tempfile.mkstemp(suffix='.yml')
+    with os.fdopen(handle, 'w') as config_file:
+        yaml.safe_dump(config, config_file)
+    state.WRITE_BEHIND.set()  # As in run_master_worker.py.
+    state_cache = state.get_state_cache(config) if args.redis else \
+        state.StateCache(FakeRedis())
+    with state.caches_lock:
+        state.STATE_CACHES[(config['rq'].get('host', 'localhost'),
+                            int(config['rq'].get('port', 6379)))] = \
+            state_cache
+    session = database.get_session_factory(config)()
+    monitor = Monitor(name='bench', unique_id='bench', check='port',
+                      arguments='{"host": "127.0.0.1", "port": 22}',
+                      worker='bench', frequency=1, last_availability=True)
+    session.add(monitor)
+    session.commit()
+    session.refresh(monitor)
+    session.expunge(monitor)
+    session.close()
+
+    try:
+        before = measure(process_result_unpooled,
+                         lambda result: (monitor, result, config), count)
+
+        def make_payload(result):
+            return (master_tasks.make_payload(monitor.id, result,
+                                              config_path), )
+
+        after = measure(master_tasks.process_result, make_payload, count)
+        database_path = measure(
+            master_tasks.process_result, make_payload, count,
+            before_each=lambda: state_cache.redis.delete(
+                state_cache.state_key(monitor.id)),
+            alternate=True)
+    finally:
+        state.close_writers()
+        database.dispose()
+        os.remove(path)
+        os.remove(config_path)
+    print('Before:            {:9.1f} results/s, {:5d} bytes/job'.format(
+        *before))
+    for name, measured in (('After, cached:', after),
+                           ('After, database:', database_path)):
+        print('{:18s} {:9.1f} results/s, {:5d} bytes/job ({:.1f}x faster, '
+              '{:.1f}x smaller)'.format(name, measured[0], measured[1],
+                                        measured[0] / before[0],
+                                        before[1] / measured[1]))
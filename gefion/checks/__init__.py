@@ -2,5 +2,5 @@
 """Contains different Check implementations."""
 
 from .base import Check, Result  # noqa: F401
-from .http import HTTPCheck  # noqa; F401
-from .port import PortCheck  # noqa: F401
+from .http import AsyncHTTPCheck, HTTPCheck  # noqa; F401
+from .port import AsyncPortCheck, PortCheck, PortScanner  # noqa: F401
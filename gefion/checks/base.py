@@ -12,26 +12,39 @@ class Result(object):
         runtime (float): Time consumed running the check, in seconds.
         message (string): Additional explainations for the result.
         timestamp (int): UTC timestamp of the check.
+        attempts (int): Number of attempts made to reach this result.
+        timings (dict): Durations of the phases of the check in seconds, ex.
+            `dns` or `connect`. None unless the check records them.
     """
 
-    def __init__(self, availability, runtime, message, timestamp=time.time()):
+    def __init__(self, availability, runtime, message, timestamp=None,
+                 attempts=1, timings=None):
         """Initialise Result.
 
         Args:
-            See class attributes.
+            See class attributes. Timestamp defaults to the current time.
         """
         self.availability = availability
         self.runtime = runtime
         self.message = message
-        self.timestamp = timestamp
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.attempts = attempts
+        self.timings = timings
 
     @property
     def api_serialised(self):
-        """Return serialisable data for API result submissions."""
-        return {'availability': self.availability,
-                'runtime': self.runtime,
-                'message': self.message,
-                'timestamp': self.timestamp}
+        """Return serialisable data for API result submissions.
+
+        Timings are only included if recorded.
+        """
+        serialised = {'availability': self.availability,
+                      'runtime': self.runtime,
+                      'message': self.message,
+                      'timestamp': self.timestamp,
+                      'attempts': self.attempts}
+        if self.timings is not None:
+            serialised['timings'] = self.timings
+        return serialised
 
 
 class Check(object):
@@ -1,18 +1,30 @@
 # -*- coding: utf-8 -*-
 """Contains HTTPCheck, the web checker."""
 
+import asyncio
 import logging
+import socket
+import threading
 import time
+from collections import namedtuple
+from urllib.parse import urlsplit
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import (ConnectTimeoutError, NameResolutionError,
+                                NewConnectionError)
 
 from gefion.checks import Check, Result
+from gefion.checks.resolver import DNS_CACHE, CachedResolver, fresh_resolution
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 REQUESTS_METHOD_MAP = {'GET': requests.get,
-                       'OPTONS': requests.options,
+                       'OPTIONS': requests.options,
                        'HEAD': requests.head,
                        'POST': requests.post,
                        'PUT': requests.put,
@@ -20,6 +32,208 @@ REQUESTS_METHOD_MAP = {'GET': requests.get,
                        'DELETE': requests.delete}
 
 
+ResponseSummary = namedtuple('ResponseSummary', 'status_code text headers')
+
+CHUNK_SIZE = 16384  # Bytes read at a time when streaming bodies.
+
+# Most bytes of an unread body read and discarded to keep its connection
+# alive. Longer bodies close the connection instead.
+DRAIN_BYTES = 65536
+
+# Phase timings of the check running in the current thread, if recorded.
+phase_recorder = threading.local()
+
+
+def record_phase(phase, duration):
+    """Add duration to a phase of the check running in this thread.
+
+    Does nothing unless the check records timings.
+
+    Arguments:
+        phase (str): Name of the phase, ex. `dns`.
+        duration (float): Duration in seconds.
+    """
+    timings = getattr(phase_recorder, 'timings', None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + duration
+
+
+class TimedConnectionMixin(object):
+    """Resolves through DNS_CACHE and times phases of urllib3 connections.
+
+    DNS, TCP connect and TLS phases are timed while the current thread
+        records them, see record_phase.
+    """
+
+    def _new_conn(self):
+        """Resolve and connect as separately timed phases."""
+        start_time = time.perf_counter()
+        try:
+            addresses = DNS_CACHE.resolve(self._dns_host)
+        except socket.gaierror as err:
+            raise NameResolutionError(self.host, self, err) from err
+        resolved_time = time.perf_counter()
+        record_phase('dns', resolved_time - start_time)
+
+        dns_host = self._dns_host  # TLS still verifies against self.host.
+        try:
+            for index, (_, address) in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if index == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+        record_phase('connect', time.perf_counter() - resolved_time)
+        return sock
+
+    def connect(self):
+        """Connect, attributing time not spent in _new_conn to TLS."""
+        timings = getattr(phase_recorder, 'timings', None)
+        if timings is None or not isinstance(self, HTTPSConnection):
+            return super().connect()
+        before = timings.get('dns', 0.0) + timings.get('connect', 0.0)
+        start_time = time.perf_counter()
+        super().connect()
+        elapsed = time.perf_counter() - start_time
+        record_phase('tls', elapsed - (timings.get('dns', 0.0) +
+                                       timings.get('connect', 0.0) - before))
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    """HTTPConnection with phase timings."""
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    """HTTPSConnection with phase timings."""
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    """HTTPConnectionPool of TimedHTTPConnection."""
+
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    """HTTPSConnectionPool of TimedHTTPSConnection."""
+
+    ConnectionCls = TimedHTTPSConnection
+
+
+class CheckAdapter(HTTPAdapter):
+    """Transport adapter resolving through DNS_CACHE, with phase timings."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Initialise pool manager with timed connection pools."""
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool}
+
+
+def make_session(maxsize=10):
+    """Make a requests session using CheckAdapter.
+
+    Arguments:
+        maxsize (int): Connections kept alive per origin.
+
+    Returns:
+        requests.Session
+    """
+    session = requests.Session()
+    adapter = CheckAdapter(pool_connections=1, pool_maxsize=maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class SessionPool(object):
+    """Keep-alive sessions shared by HTTPChecks, one per origin.
+
+    Checks against the same origin reuse established TCP and TLS connections
+        instead of handshaking every time. Origins unused for idle_timeout
+        seconds are evicted along with their connections.
+
+    Attributes:
+        maxsize (int): Connections kept alive per origin.
+        idle_timeout (float): Seconds before an unused origin is evicted.
+        sessions (dict): Session and last use time, keyed by origin.
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=300):
+        """Initialise SessionPool.
+
+        Arguments:
+            See class attributes.
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.sessions = dict()
+        self.last_eviction = time.monotonic()
+        self.lock = threading.Lock()
+
+    def configure(self, maxsize=None, idle_timeout=None):
+        """Change limits of the pool, closing existing sessions.
+
+        Arguments:
+            See class attributes. Unchanged if not given.
+        """
+        self.close()
+        self.maxsize = maxsize or self.maxsize
+        self.idle_timeout = idle_timeout or self.idle_timeout
+
+    def get(self, url):
+        """Return the session of an URL's origin, creating it if needed.
+
+        Arguments:
+            url (str): HTTP/HTTPS URL of the resource.
+
+        Returns:
+            requests.Session
+        """
+        split_url = urlsplit(url)
+        origin = '{}://{}'.format(split_url.scheme, split_url.netloc).lower()
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_eviction >= self.idle_timeout / 2:
+                self.evict(now)
+            if origin in self.sessions:
+                session = self.sessions[origin][0]
+            else:
+                session = make_session(self.maxsize)
+                logger.debug('Opened session for %s.', origin)
+            self.sessions[origin] = (session, now)
+        return session
+
+    def evict(self, now):
+        """Close sessions of origins idle for longer than idle_timeout.
+
+        Must be called with the lock held.
+
+        Arguments:
+            now (float): Current monotonic time.
+        """
+        for origin, (session, last_used) in list(self.sessions.items()):
+            if now - last_used >= self.idle_timeout:
+                del self.sessions[origin]
+                session.close()
+                logger.debug('Evicted idle session for %s.', origin)
+        self.last_eviction = now
+
+    def close(self):
+        """Close all sessions."""
+        with self.lock:
+            for session, _ in self.sessions.values():
+                session.close()
+            self.sessions = dict()
+
+
+SESSION_POOL = SessionPool()
+
+
 class ResponseError(Exception):
     """Bad response."""
 
@@ -52,7 +266,7 @@ def assert_response(response,
         raise StatusCodeResponseError('Status code {}, expected {}.'.format(
             response.status_code, status_code))
 
-    if response.text and text_contain not in response.text:
+    if text_contain and text_contain not in response.text:
         raise ContainResponseError('Text {} not in body.'.format(text_contain))
 
     if response.headers and headers_contain:
@@ -63,6 +277,150 @@ def assert_response(response,
                     key, expected_value, response_header_key))
 
 
+class BodySearch(object):
+    """Searches a streamed body for a string, chunk by chunk.
+
+    Matches spanning chunk boundaries are found by carrying over the tail of
+        the previous chunk. Reading stops once the string is found or the
+        byte budget is spent.
+
+    Attributes:
+        text_contain (str): String that the body is expected to contain.
+        needle (bytes): Encoded text_contain.
+        max_bytes (int): Most bytes of the body to read.
+        read (int): Bytes read so far.
+        found (bool): Whether text_contain was found.
+    """
+
+    def __init__(self, text_contain, max_bytes, encoding=None):
+        """Initialise BodySearch.
+
+        Arguments:
+            text_contain (str): String that the body is expected to contain.
+            max_bytes (int): Most bytes of the body to read.
+            encoding (str): Encoding of the body. Defaults to UTF-8.
+        """
+        self.text_contain = text_contain
+        try:
+            self.needle = text_contain.encode(encoding or 'utf-8')
+        except (LookupError, UnicodeEncodeError):
+            self.needle = text_contain.encode('utf-8')
+        self.max_bytes = max_bytes
+        self.read = 0
+        self.found = False
+        self.tail = bytes()
+
+    def feed(self, chunk):
+        """Search the next chunk of the body.
+
+        Arguments:
+            chunk (bytes): Next chunk of the body.
+
+        Returns:
+            bool: True if no more chunks are needed.
+        """
+        chunk = chunk[:self.max_bytes - self.read]
+        self.read += len(chunk)
+        window = self.tail + chunk
+        if self.needle in window:
+            self.found = True
+            return True
+        self.tail = window[len(window) - len(self.needle) + 1:] \
+            if len(self.needle) > 1 else bytes()
+        return self.read >= self.max_bytes
+
+    def assert_found(self):
+        """Assert the body contained text_contain.
+
+        Raises:
+            ContainResponseError
+        """
+        if self.found:
+            return
+        if self.read >= self.max_bytes:
+            raise ContainResponseError(
+                'Text {} not in first {} bytes of body.'.format(
+                    self.text_contain, self.max_bytes))
+        raise ContainResponseError('Text {} not in body.'.format(
+            self.text_contain))
+
+
+def assert_body_contains(response, text_contain, max_bytes):
+    """Assert streamed Response body contains a string.
+
+    The body is only read up to the match or max_bytes, and not at all if
+        text_contain is blank.
+
+    Arguments:
+        response (requests.Response): Response requested with `stream=True`.
+        text_contain (str): String that the body is expected to contain.
+        max_bytes (int): Most bytes of the body to read.
+
+    Raises:
+        ContainResponseError
+    """
+    if not text_contain:
+        return
+    search = BodySearch(text_contain, max_bytes, response.encoding)
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if search.feed(chunk):
+            break
+    search.assert_found()
+
+
+def release_response(response, max_drain):
+    """Release the connection of a streamed Response.
+
+    The rest of the body is drained, so that the connection returns to its
+        pool, if it is at most max_drain bytes. Otherwise the connection is
+        closed.
+
+    Arguments:
+        response (requests.Response): Response requested with `stream=True`.
+        max_drain (int): Most bytes of the body to drain, 0 to close the
+            connection right away.
+    """
+    raw = response.raw
+    try:
+        length = int(response.headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        length = None
+    if max_drain and (length is None or length - raw.tell() <= max_drain):
+        try:
+            drained = 0
+            while drained <= max_drain:
+                chunk = raw.read(CHUNK_SIZE, decode_content=False)
+                if not chunk:
+                    raw.release_conn()
+                    return
+                drained += len(chunk)
+        except Exception:
+            pass
+    response.close()
+
+
+async def release_async_response(response, max_drain):
+    """Release the connection of an aiohttp response, see release_response.
+
+    Arguments:
+        response (aiohttp.ClientResponse): Response, partly read at most.
+        max_drain (int): Most bytes of the body to drain.
+    """
+    length = response.content_length
+    if max_drain and (length is None or length <= max_drain):
+        try:
+            drained = 0
+            while drained <= max_drain:
+                chunk = await response.content.read(CHUNK_SIZE)
+                if not chunk:
+                    response.release()
+                    return
+                drained += len(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+    response.close()
+
+
 class HTTPCheck(Check):
     """Checks and validates HTTP responses."""
 
@@ -74,6 +432,10 @@ class HTTPCheck(Check):
                  status_code=None,
                  text_contain=str(),
                  headers_contain=dict(),
+                 reuse_connection=False,
+                 max_body_bytes=1048576,
+                 timings=False,
+                 fresh_dns=False,
                  **kwargs):
         """Initialise HTTPCheck.
 
@@ -88,6 +450,17 @@ class HTTPCheck(Check):
                 contain. By default blank.
             headers_contain (dict): Key is response header, value is the string
                 expected to contain. By default not checked.
+            reuse_connection (bool): Reuse keep-alive connections from the
+                shared SESSION_POOL. By default every check connects anew,
+                so that handshakes are part of the measured runtime.
+            max_body_bytes (int): Most bytes of the body searched for
+                text_contain. By default 1 MiB. If text_contain is blank,
+                the body is only read to keep a reused connection alive, up
+                to DRAIN_BYTES.
+            timings (bool): Record durations of the DNS, connect, TLS,
+                time-to-first-byte and transfer phases in Result.timings.
+            fresh_dns (bool): Resolve the hostname anew instead of using the
+                shared DNS_CACHE.
         """
         self.url = url
         self.data = data
@@ -95,10 +468,15 @@ class HTTPCheck(Check):
         self.status_code = status_code
         self.text_contain = text_contain
         self.headers_contain = headers_contain
+        self.reuse_connection = reuse_connection
+        self.max_body_bytes = max_body_bytes
+        self.timings = timings
+        self.fresh_dns = fresh_dns
 
         # Call different requests depneding on HTTP verb.
-        self.requests_method = REQUESTS_METHOD_MAP.get(verb.upper(),
-                                                       requests.get)
+        self.verb = verb.upper() if verb.upper() in REQUESTS_METHOD_MAP \
+            else 'GET'
+        self.requests_method = REQUESTS_METHOD_MAP[self.verb]
 
         super().__init__(**kwargs)
 
@@ -108,16 +486,38 @@ class HTTPCheck(Check):
         Returns:
             gefion.checks.Result
         """
+        cold_session = None
+        if self.reuse_connection:
+            session = SESSION_POOL.get(self.url)
+        else:
+            session = cold_session = make_session(1)
+        timings = dict() if self.timings else None
+        phase_recorder.timings = timings
+        fresh_token = fresh_resolution.set(self.fresh_dns)
         try:
             start_time = time.perf_counter()
-            response = self.requests_method(url=self.url,
-                                            data=self.data,
-                                            headers=self.req_headers,
-                                            allow_redirects=False,
-                                            timeout=15)
+            response = session.request(self.verb,
+                                       url=self.url,
+                                       data=self.data,
+                                       headers=self.req_headers,
+                                       allow_redirects=False,
+                                       timeout=15,
+                                       stream=True)
             runtime = response.elapsed.total_seconds()
-            assert_response(response, self.status_code, self.text_contain,
-                            self.headers_contain)
+            if timings is not None:
+                headers_time = time.perf_counter() - start_time
+                timings['ttfb'] = headers_time - sum(timings.values())
+            try:
+                assert_response(response, self.status_code,
+                                headers_contain=self.headers_contain)
+                assert_body_contains(response, self.text_contain,
+                                     self.max_body_bytes)
+            finally:
+                release_response(response, DRAIN_BYTES
+                                 if self.reuse_connection else 0)
+            if timings is not None:
+                timings['total'] = time.perf_counter() - start_time
+                timings['transfer'] = timings['total'] - headers_time
             error = None
         except requests.exceptions.RequestException as err:
             end_time = time.perf_counter()
@@ -125,9 +525,126 @@ class HTTPCheck(Check):
             error = err
         except ResponseError as err:
             error = err
+        finally:
+            phase_recorder.timings = None
+            fresh_resolution.reset(fresh_token)
+            if cold_session:
+                cold_session.close()
+
+        availability = False if error else True
+        message = str(error) if error else ''
+        logger.info('Tested %s in %fs w/ message "%s".', availability,
+                    runtime, message)
+        return Result(availability, runtime, message, timings=timings)
+
+
+def phase_trace_config():
+    """Make an aiohttp TraceConfig recording phase timings.
+
+    Requests record into the dict passed as their trace_request_ctx, if any.
+        The connect phase includes the TLS handshake, which aiohttp does not
+        trace separately.
+
+    Returns:
+        aiohttp.TraceConfig
+    """
+    async def on_start(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.started = time.perf_counter()
+
+    def ender(phase):
+        async def on_end(session, context, params):
+            timings = context.trace_request_ctx
+            if timings is not None:
+                timings[phase] = timings.get(phase, 0.0) + \
+                    time.perf_counter() - context.started
+        return on_end
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(on_start)
+    trace_config.on_dns_resolvehost_end.append(ender('dns'))
+    trace_config.on_connection_create_start.append(on_start)
+    trace_config.on_connection_create_end.append(ender('connect'))
+    return trace_config
+
+
+class AsyncHTTPCheck(HTTPCheck):
+    """Checks and validates HTTP responses on an asyncio event loop.
+
+    Takes the same arguments as HTTPCheck.
+    """
+
+    async def check(self, session=None):
+        """Check HTTP site with aiohttp.
+
+        Arguments:
+            session (aiohttp.ClientSession): Keep-alive session shared by the
+                engine, tracing with phase_trace_config. A one-off session is
+                opened when not given, or when connections are not to be
+                reused.
+
+        Returns:
+            gefion.checks.Result
+        """
+        own_session = session is None or not self.reuse_connection
+        if own_session:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(force_close=True,
+                                               use_dns_cache=False,
+                                               resolver=CachedResolver()),
+                trace_configs=[phase_trace_config()])
+        timings = dict() if self.timings else None
+        fresh_token = fresh_resolution.set(self.fresh_dns)
+        start_time = time.perf_counter()
+        try:
+            async with session.request(
+                    self.verb,
+                    self.url,
+                    data=self.data,
+                    headers=self.req_headers,
+                    allow_redirects=False,
+                    timeout=aiohttp.ClientTimeout(total=15),
+                    trace_request_ctx=timings) as response:
+                runtime = time.perf_counter() - start_time
+                if timings is not None:
+                    timings['ttfb'] = runtime - sum(timings.values())
+                try:
+                    assert_response(
+                        ResponseSummary(response.status, '',
+                                        response.headers),
+                        self.status_code,
+                        headers_contain=self.headers_contain)
+                    if self.text_contain:
+                        search = BodySearch(self.text_contain,
+                                            self.max_body_bytes,
+                                            response.charset)
+                        async for chunk in response.content.iter_chunked(
+                                CHUNK_SIZE):
+                            if search.feed(chunk):
+                                break
+                        search.assert_found()
+                finally:
+                    await release_async_response(
+                        response, 0 if own_session else DRAIN_BYTES)
+            if timings is not None:
+                timings['total'] = time.perf_counter() - start_time
+                timings['transfer'] = timings['total'] - runtime
+            error = None
+        except asyncio.TimeoutError:
+            runtime = time.perf_counter() - start_time
+            error = 'Timed out after 15s.'
+        except aiohttp.ClientError as err:
+            runtime = time.perf_counter() - start_time
+            error = err
+        except ResponseError as err:
+            error = err
+        finally:
+            fresh_resolution.reset(fresh_token)
+            if own_session:
+                await session.close()
 
         availability = False if error else True
         message = str(error) if error else ''
         logger.info('Tested %s in %fs w/ message "%s".', availability,
                     runtime, message)
-        return Result(availability, runtime, message)
+        return Result(availability, runtime, message, timings=timings)
@@ -1,32 +1,76 @@
 # -*- coding: utf-8 -*-
 """Contains PortCheck, the TCP port checker."""
 
+import asyncio
+import errno
+import heapq
 import logging
+import os
+import selectors
 import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from gefion.checks import Check, Result
+from gefion.checks.resolver import DNS_CACHE
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+class SocketBudget(object):
+    """Sockets open at once across all PortScanners of the process.
+
+    Concurrent scans stay within the file descriptor limit together.
+
+    Attributes:
+        size (int): Most sockets open at once.
+        slots (threading.BoundedSemaphore): Free sockets. Scans keep the
+            slots they started with, so resizing does not disturb them.
+    """
+
+    def __init__(self, size=512):
+        """Initialise SocketBudget.
+
+        Arguments:
+            See class attributes.
+        """
+        self.configure(size)
+
+    def configure(self, size):
+        """Change the size of the budget for scans started from now.
+
+        Arguments:
+            See class attributes.
+        """
+        self.size = size
+        self.slots = threading.BoundedSemaphore(size)
+
+
 class PortCheck(Check):
     """Checks if TCP ports are open."""
 
-    def __init__(self, host, port, timeout=7, **kwargs):
+    def __init__(self, host, port, timeout=7, timings=False, fresh_dns=False,
+                 **kwargs):
         """Initialise PortCheck.
 
         Arguments:
             host (str): IP address or hostname.
             port (int): Port number.
             timeout (int): Connection timeout in seconds.
+            timings (bool): Record durations of the DNS and connect phases in
+                Result.timings.
+            fresh_dns (bool): Resolve the hostname anew instead of using the
+                shared DNS_CACHE.
         """
         logger.debug('Initialising with %s:%d, timeout %ds.', host, port,
                      timeout)
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.timings = timings
+        self.fresh_dns = fresh_dns
 
         super().__init__(**kwargs)
 
@@ -38,9 +82,14 @@ class PortCheck(Check):
         """
         sock = socket.socket(socket.AF_INET, type=socket.SOCK_STREAM)
         sock.settimeout(self.timeout)
+        timings = dict() if self.timings else None
         try:
             start_time = time.perf_counter()
-            sock.connect((self.host, self.port))
+            host = DNS_CACHE.resolve(self.host, socket.AF_INET,
+                                     self.fresh_dns)[0][1]
+            if timings is not None:
+                timings['dns'] = time.perf_counter() - start_time
+            sock.connect((host, self.port))
             end_time = time.perf_counter()
             sock.close()
             error = None
@@ -53,6 +102,245 @@ class PortCheck(Check):
         availability = False if error else True
         runtime = end_time - start_time
         message = str(error) if error else ''
+        if timings is not None:
+            timings['total'] = runtime
+            if not error:
+                timings['connect'] = runtime - timings['dns']
+        logger.info('Tested %s in %fs w/ message "%s".', availability,
+                    runtime, message)
+        return Result(availability, runtime, message, timings=timings)
+
+
+class AsyncPortCheck(PortCheck):
+    """Checks if TCP ports are open on an asyncio event loop.
+
+    Takes the same arguments as PortCheck.
+    """
+
+    async def check(self, session=None):
+        """Check if port is open without blocking the event loop.
+
+        Arguments:
+            session: Unused, accepted for interface parity with
+                AsyncHTTPCheck.
+
+        Returns:
+            gefion.checks.Result
+        """
+        timings = dict() if self.timings else None
+        start_time = time.perf_counter()
+        try:
+            addresses = await asyncio.wait_for(DNS_CACHE.resolve_async(
+                self.host, socket.AF_INET, self.fresh_dns), self.timeout)
+            host = addresses[0][1]
+            if timings is not None:
+                timings['dns'] = time.perf_counter() - start_time
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, self.port), self.timeout)
+            end_time = time.perf_counter()
+            writer.close()
+            error = None
+        except asyncio.TimeoutError:
+            end_time = time.perf_counter()
+            error = socket.timeout('timed out')
+        except (OSError, OverflowError) as err:
+            end_time = time.perf_counter()
+            logger.warning('Caught exception: %s.', repr(err))
+            error = err
+
+        availability = False if error else True
+        runtime = end_time - start_time
+        message = str(error) if error else ''
+        if timings is not None:
+            timings['total'] = runtime
+            if not error:
+                timings['connect'] = runtime - timings['dns']
         logger.info('Tested %s in %fs w/ message "%s".', availability,
                     runtime, message)
-        return Result(availability, runtime, message)
+        return Result(availability, runtime, message, timings=timings)
+
+
+class PortScanner(object):
+    """Runs many PortChecks at once with non-blocking connects.
+
+    Connects are multiplexed with selectors, epoll on Linux, so a batch
+        takes about as long as its slowest target rather than the sum of all
+        of them. Hostnames are resolved before any connect starts, so that
+        the select loop never blocks on DNS.
+
+    Attributes:
+        max_open (int): Most sockets open at once by this scanner, None for
+            the size of SOCKET_BUDGET. Further targets wait for a slot, as
+            they do for SOCKET_BUDGET.
+        resolvers (int): Most hostnames resolved at once.
+    """
+
+    def __init__(self, max_open=None, resolvers=16):
+        """Initialise PortScanner.
+
+        Arguments:
+            See class attributes.
+        """
+        self.max_open = max_open
+        self.resolvers = resolvers
+
+    def scan(self, port_checks):
+        """Check ports of a batch of PortChecks.
+
+        Arguments:
+            port_checks (list): PortCheck instances.
+
+        Returns:
+            list: gefion.checks.Result, in the order of port_checks.
+        """
+        results = [None] * len(port_checks)
+        slots = SOCKET_BUDGET.slots
+        max_open = min(self.max_open or SOCKET_BUDGET.size,
+                       SOCKET_BUDGET.size)
+        resolved = self.resolve(port_checks)
+        waiting = list(enumerate(port_checks))
+        waiting.reverse()  # Popped from the end, in order.
+        deadlines = list()  # Heap of deadline, index and socket.
+        selector = selectors.DefaultSelector()
+        try:
+            while waiting or selector.get_map():
+                # Wait for slots of other scanners only with none open.
+                while waiting and len(selector.get_map()) < max_open \
+                        and slots.acquire(not selector.get_map()):
+                    index, port_check = waiting.pop()
+                    results[index] = self.start(
+                        selector, deadlines, index, port_check,
+                        resolved[(port_check.host, port_check.fresh_dns)])
+                    if results[index] is not None:
+                        slots.release()
+                if not selector.get_map():  # All failed without a connect.
+                    continue
+                timeout = max(0, deadlines[0][0] - time.perf_counter()) \
+                    if deadlines else None
+                events = selector.select(timeout)
+                end_time = time.perf_counter()
+                for key, _ in events:
+                    selector.unregister(key.fileobj)
+                    code = key.fileobj.getsockopt(socket.SOL_SOCKET,
+                                                  socket.SO_ERROR)
+                    key.fileobj.close()
+                    slots.release()
+                    index, start_time, timings = key.data
+                    error = OSError(code, os.strerror(code)) if code \
+                        else None
+                    results[index] = self.result(start_time, end_time,
+                                                 timings, error)
+                while deadlines and deadlines[0][0] <= end_time:
+                    _, index, sock = heapq.heappop(deadlines)
+                    if sock.fileno() == -1:  # Already closed.
+                        continue
+                    _, start_time, timings = selector.unregister(sock).data
+                    sock.close()
+                    slots.release()
+                    results[index] = self.result(
+                        start_time, end_time, timings,
+                        socket.timeout('timed out'))
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+                slots.release()
+            selector.close()
+        return results
+
+    def resolve(self, port_checks):
+        """Resolve hostnames of a batch, each once and concurrently.
+
+        Arguments:
+            port_checks (list): PortCheck instances.
+
+        Returns:
+            dict: Tuples of the addresses, or the error resolving them, and
+                the duration of the resolution in seconds. Keyed by hostname
+                and fresh_dns.
+        """
+        def timed_resolve(name):
+            start_time = time.perf_counter()
+            try:
+                addresses = DNS_CACHE.resolve(name[0], socket.AF_INET,
+                                              name[1])
+            except (socket.error, OverflowError) as err:
+                addresses = err
+            return addresses, time.perf_counter() - start_time
+
+        names = list({(port_check.host, port_check.fresh_dns)
+                      for port_check in port_checks})
+        if len(names) < 2 or self.resolvers < 2:
+            return {name: timed_resolve(name) for name in names}
+        with ThreadPoolExecutor(min(self.resolvers, len(names))) as pool:
+            return dict(zip(names, pool.map(timed_resolve, names)))
+
+    def start(self, selector, deadlines, index, port_check, resolution):
+        """Start a non-blocking connect.
+
+        Arguments:
+            selector (selectors.BaseSelector): Selector of open connects.
+            deadlines (list): Heap of timeouts of open connects.
+            index (int): Index of the PortCheck in the batch.
+            port_check (PortCheck): Check to start.
+            resolution (tuple): Addresses of the host, or the error resolving
+                them, and the duration of the resolution. See resolve.
+
+        Returns:
+            gefion.checks.Result: None if the connect is in progress.
+        """
+        addresses, dns_time = resolution
+        timings = dict() if port_check.timings else None
+        if timings is not None:
+            timings['dns'] = dns_time
+        # The resolution counts towards the runtime, as in PortCheck.
+        start_time = time.perf_counter() - dns_time
+        if isinstance(addresses, Exception):
+            return self.result(start_time, time.perf_counter(), timings,
+                               addresses)
+        try:
+            host = addresses[0][1]
+            sock = socket.socket(socket.AF_INET, type=socket.SOCK_STREAM)
+        except (socket.error, OverflowError) as err:
+            return self.result(start_time, time.perf_counter(), timings, err)
+        sock.setblocking(False)
+        try:
+            code = sock.connect_ex((host, port_check.port))
+        except (socket.error, OverflowError) as err:
+            sock.close()
+            return self.result(start_time, time.perf_counter(), timings, err)
+        if code not in (0, errno.EINPROGRESS):
+            sock.close()
+            return self.result(start_time, time.perf_counter(), timings,
+                               OSError(code, os.strerror(code)))
+        selector.register(sock, selectors.EVENT_WRITE,
+                          (index, start_time, timings))
+        heapq.heappush(deadlines,
+                       (start_time + dns_time + port_check.timeout, index,
+                        sock))
+        return None
+
+    def result(self, start_time, end_time, timings, error):
+        """Make the Result of a connect.
+
+        Arguments:
+            start_time (float): perf_counter at the start of the check.
+            end_time (float): perf_counter when the connect completed.
+            timings (dict): Phase timings, None if not recorded.
+            error (Exception): Error of the connect, None if successful.
+
+        Returns:
+            gefion.checks.Result
+        """
+        if error:
+            logger.warning('Caught exception: %s.', repr(error))
+        availability = False if error else True
+        runtime = end_time - start_time
+        message = str(error) if error else ''
+        if timings is not None:
+            timings['total'] = runtime
+            if not error:
+                timings['connect'] = runtime - timings['dns']
+        return Result(availability, runtime, message, timings=timings)
+
+
+SOCKET_BUDGET = SocketBudget()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Contains DNSCache, the worker-wide hostname resolution cache."""
+
+import asyncio
+import contextvars
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from aiohttp.abc import AbstractResolver
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Whether the check running in the current context bypasses the cache.
+fresh_resolution = contextvars.ContextVar('fresh_resolution', default=False)
+
+
+def ip_literal(host):
+    """Return address family of an IP address literal, or None.
+
+    Arguments:
+        host (str): Hostname or IP address.
+
+    Returns:
+        int: socket.AF_INET or socket.AF_INET6, None for hostnames.
+    """
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    return socket.AF_INET6 if address.version == 6 else socket.AF_INET
+
+
+def unique_addresses(address_info):
+    """Reduce getaddrinfo results to distinct addresses.
+
+    Arguments:
+        address_info (list): Results of getaddrinfo.
+
+    Returns:
+        list: Tuples of address family and IP address, in order.
+    """
+    addresses = list()
+    for family, _, _, _, sockaddr in address_info:
+        if (family, sockaddr[0]) not in addresses:
+            addresses.append((family, sockaddr[0]))
+    return addresses
+
+
+class DNSCache(object):
+    """Caches resolved addresses of hostnames, shared by all checks.
+
+    getaddrinfo does not expose record TTLs, so entries live for a configured
+        TTL. Failed resolutions are cached for a shorter negative TTL, and the
+        least recently used entries are evicted beyond maxsize.
+
+    Attributes:
+        maxsize (int): Most hostnames kept.
+        ttl (float): Seconds before resolved addresses are looked up again.
+        negative_ttl (float): Seconds before failed resolutions are retried.
+        entries (collections.OrderedDict): Expiry time and addresses, or the
+            resolution error, keyed by hostname and address family. Ordered
+            from least to most recently used.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups which resolved, including fresh ones.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, negative_ttl=10):
+        """Initialise DNSCache.
+
+        Arguments:
+            See class attributes.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None, negative_ttl=None):
+        """Change limits of the cache.
+
+        Arguments:
+            See class attributes. Unchanged if None.
+        """
+        with self.lock:
+            self.maxsize = maxsize or self.maxsize
+            self.ttl = self.ttl if ttl is None else ttl
+            self.negative_ttl = self.negative_ttl if negative_ttl is None \
+                else negative_ttl
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get(self, host, family=0):
+        """Look up cached addresses of a hostname.
+
+        Arguments:
+            host (str): Hostname.
+            family (int): Address family, 0 for any.
+
+        Returns:
+            list: Tuples of address family and IP address, None if not cached
+                or expired.
+
+        Raises:
+            socket.gaierror: If the last resolution failed.
+        """
+        with self.lock:
+            entry = self.entries.get((host, family))
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end((host, family))
+            self.hits += 1
+        if isinstance(entry[1], socket.gaierror):
+            raise socket.gaierror(*entry[1].args)
+        return entry[1]
+
+    def put(self, host, family, addresses):
+        """Cache addresses or a resolution error of a hostname.
+
+        Arguments:
+            host (str): Hostname.
+            family (int): Address family, 0 for any.
+            addresses: List of tuples of address family and IP address, or
+                socket.gaierror if resolution failed.
+        """
+        failed = isinstance(addresses, socket.gaierror)
+        expiry = time.monotonic() + (self.negative_ttl if failed
+                                     else self.ttl)
+        with self.lock:
+            self.entries[(host, family)] = (expiry, addresses)
+            self.entries.move_to_end((host, family))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Forget all entries and statistics."""
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def lookup(self, host, family, fresh):
+        """Return cached addresses, counting fresh lookups as misses.
+
+        Arguments:
+            host (str): Hostname.
+            family (int): Address family, 0 for any.
+            fresh (bool): Skip the cache.
+
+        Returns:
+            list: As by get. None if the hostname is to be resolved.
+        """
+        if fresh:
+            with self.lock:
+                self.misses += 1
+            return None
+        return self.get(host, family)
+
+    def resolve(self, host, family=0, fresh=None):
+        """Resolve hostname, blocking on misses.
+
+        Arguments:
+            host (str): Hostname or IP address.
+            family (int): Address family, 0 for any.
+            fresh (bool): Skip the cache. Defaults to the fresh_resolution of
+                the current context.
+
+        Returns:
+            list: Tuples of address family and IP address, in order of
+                preference.
+
+        Raises:
+            socket.gaierror
+        """
+        literal_family = ip_literal(host)
+        if literal_family:
+            return [(literal_family, host)]
+        fresh = fresh_resolution.get() if fresh is None else fresh
+        addresses = self.lookup(host, family, fresh)
+        if addresses is None:
+            try:
+                addresses = unique_addresses(socket.getaddrinfo(
+                    host, None, family, socket.SOCK_STREAM))
+            except socket.gaierror as err:
+                self.put(host, family, err)
+                raise
+            self.put(host, family, addresses)
+        return addresses
+
+    async def resolve_async(self, host, family=0, fresh=None):
+        """Resolve hostname without blocking the event loop.
+
+        Arguments:
+            See resolve.
+
+        Returns:
+            list: As by resolve.
+
+        Raises:
+            socket.gaierror
+        """
+        literal_family = ip_literal(host)
+        if literal_family:
+            return [(literal_family, host)]
+        fresh = fresh_resolution.get() if fresh is None else fresh
+        addresses = self.lookup(host, family, fresh)
+        if addresses is None:
+            try:
+                addresses = unique_addresses(
+                    await asyncio.get_running_loop().getaddrinfo(
+                        host, None, family=family, type=socket.SOCK_STREAM))
+            except socket.gaierror as err:
+                self.put(host, family, err)
+                raise
+            self.put(host, family, addresses)
+        return addresses
+
+    @property
+    def api_serialised(self):
+        """Return serialisable statistics."""
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class CachedResolver(AbstractResolver):
+    """aiohttp resolver answering from DNS_CACHE.
+
+    Connectors using it should disable their own cache with
+        `use_dns_cache=False`.
+    """
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        """Resolve hostname for aiohttp connectors."""
+        return [{'hostname': host, 'host': address, 'port': port,
+                 'family': address_family, 'proto': 0,
+                 'flags': socket.AI_NUMERICHOST}
+                for address_family, address
+                in await DNS_CACHE.resolve_async(host, family)]
+
+    async def close(self):
+        """Release resolver. DNS_CACHE outlives it."""
+        pass
+
+
+DNS_CACHE = DNSCache()
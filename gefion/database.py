@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""Process-wide database engines, session factories and caches of master."""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import create_engine, event, inspect, literal, or_, text
+from sqlalchemy.orm import selectinload, sessionmaker
+
+from gefion.models import Base, Contact, Monitor
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Session factories and routing caches keyed by database URI, created once
+# per process.
+SESSION_FACTORIES = dict()
+ROUTING_CACHES = dict()
+factories_lock = threading.Lock()
+
+# Name of a Monitor and the notifier and destination of each of its Contacts.
+Route = namedtuple('Route', 'name contacts')
+
+
+def create_schema(engine):
+    """Create missing tables, and columns and indexes of existing tables.
+
+    Arguments:
+        engine (sqlalchemy.engine.Engine): Engine of the database.
+    """
+    Base.metadata.create_all(bind=engine)
+    add_columns(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def add_columns(engine):
+    """Add columns missing from tables made by earlier versions.
+
+    Only nullable columns can be added. Existing rows take the scalar
+        default of the column, if any, or NULL.
+
+    Arguments:
+        engine (sqlalchemy.engine.Engine): Engine of the database.
+
+    Returns:
+        list: Added columns, as `table.column`.
+    """
+    preparer = engine.dialect.identifier_preparer
+    added = list()
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name']
+                        for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    logger.error('Cannot add column %s.%s, which is not '
+                                 'nullable.', table.name, column.name)
+                    continue
+                definition = '{} {}'.format(
+                    preparer.quote(column.name),
+                    column.type.compile(dialect=engine.dialect))
+                if column.default is not None and column.default.is_scalar:
+                    definition += ' DEFAULT {}'.format(
+                        literal(column.default.arg, column.type).compile(
+                            dialect=engine.dialect,
+                            compile_kwargs={'literal_binds': True}))
+                connection.execute(text('ALTER TABLE {} ADD COLUMN {}'.format(
+                    preparer.format_table(table), definition)))
+                added.append('{}.{}'.format(table.name, column.name))
+    if added:
+        logger.info('Added columns %s.', ', '.join(added))
+    return added
+
+
+def get_session_factory(config):
+    """Return the session factory of the configured database.
+
+    The engine, its connection pool and the schema are set up on the first
+        call of a process, and reused by later calls.
+
+    Arguments:
+        config (dict): Entire loaded configuration file. The `database`
+            section may set `pool_size` and `max_overflow` of the pool.
+
+    Returns:
+        sqlalchemy.orm.sessionmaker
+    """
+    database_config = config['database']
+    uri = database_config.get('uri', ':memory:')
+    session_factory = SESSION_FACTORIES.get(uri)
+    if session_factory:
+        return session_factory
+    with factories_lock:
+        if uri not in SESSION_FACTORIES:
+            pool_arguments = {key: int(database_config[key])
+                              for key in ('pool_size', 'max_overflow')
+                              if key in database_config}
+            engine = create_engine(uri, pool_pre_ping=True, **pool_arguments)
+            create_schema(engine)
+            SESSION_FACTORIES[uri] = sessionmaker(bind=engine)
+            logger.info('Initialised database engine %s.', engine.url)
+        return SESSION_FACTORIES[uri]
+
+
+def get_routing_cache(config):
+    """Return the RoutingCache of the configured database.
+
+    Arguments:
+        config (dict): Entire loaded configuration file. The `cache` section
+            may set `routing_ttl` in seconds.
+
+    Returns:
+        RoutingCache
+    """
+    uri = config['database'].get('uri', ':memory:')
+    with factories_lock:
+        if uri not in ROUTING_CACHES:
+            ROUTING_CACHES[uri] = RoutingCache(float(
+                config.get('cache', dict()).get('routing_ttl', 300)))
+        return ROUTING_CACHES[uri]
+
+
+def dispose():
+    """Close pooled connections and forget session factories and caches."""
+    with factories_lock:
+        for session_factory in SESSION_FACTORIES.values():
+            session_factory.kw['bind'].dispose()
+        SESSION_FACTORIES.clear()
+        for routing_cache in ROUTING_CACHES.values():
+            routing_cache.close()
+        ROUTING_CACHES.clear()
+
+
+class MonitorCache(object):
+    """Maps the IDs and unique IDs of submissions to Monitor primary keys.
+
+    Lookups of cached keys cost no queries, and misses one exact match on
+        indexed columns. Entries are invalidated when Monitors are
+        changed through the ORM of this process, and expire after ttl seconds
+        to pick up changes made elsewhere.
+
+    Attributes:
+        ttl (float): Seconds an entry is trusted.
+        by_id (dict): Primary key and expiry time, keyed by submitted ID.
+        by_unique_id (dict): Primary key and expiry time, keyed by unique ID.
+    """
+
+    def __init__(self, ttl=300):
+        """Initialise MonitorCache and listen for Monitor changes.
+
+        Arguments:
+            See class attributes.
+        """
+        self.ttl = ttl
+        self.by_id = dict()
+        self.by_unique_id = dict()
+        self.lock = threading.Lock()
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(Monitor, event_name, self.on_change)
+
+    def close(self):
+        """Stop listening for Monitor changes."""
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            event.remove(Monitor, event_name, self.on_change)
+
+    def on_change(self, mapper, connection, monitor):
+        """Invalidate entries of a changed Monitor."""
+        self.invalidate(monitor.id)
+
+    def invalidate(self, primary_key=None):
+        """Forget entries of a Monitor, or all entries.
+
+        Arguments:
+            primary_key (int): Database ID of the Monitor. All entries are
+                forgotten if None.
+        """
+        with self.lock:
+            if primary_key is None:
+                self.by_id.clear()
+                self.by_unique_id.clear()
+                return
+            for entries in (self.by_id, self.by_unique_id):
+                for key in [key for key, (cached_key, _) in entries.items()
+                            if cached_key == primary_key]:
+                    del entries[key]
+
+    def cached(self, monitor_id, unique_id, now):
+        """Return cached primary key of a submission, or None."""
+        with self.lock:
+            for entries, key in ((self.by_id, str(monitor_id)),
+                                 (self.by_unique_id, unique_id)):
+                entry = entries.get(key)
+                if entry and entry[1] > now:
+                    return entry[0]
+        return None
+
+    def store(self, entries, key, primary_key, now):
+        """Cache primary key of a submitted ID or unique ID."""
+        with self.lock:
+            entries[key] = (primary_key, now + self.ttl)
+
+    def primary_keys(self, session, submissions):
+        """Find the Monitor primary keys of submissions.
+
+        Cached keys are returned without querying, so they may belong to
+            Monitors deleted elsewhere within ttl. Jobs drop results of such
+            Monitors.
+
+        Arguments:
+            session (sqlalchemy.orm.Session): Database session.
+            submissions (list): Tuples of submitted ID and unique ID.
+
+        Returns:
+            list: Primary keys, or None if not found, in the order of
+                submissions.
+        """
+        now = time.monotonic()
+        primary_keys = [self.cached(monitor_id, unique_id, now)
+                        for monitor_id, unique_id in submissions]
+        misses = [submission for submission, primary_key
+                  in zip(submissions, primary_keys) if primary_key is None]
+        if misses:
+            ids = {int(monitor_id) for monitor_id, _ in misses
+                   if str(monitor_id).isdigit()}
+            unique_ids = {unique_id for _, unique_id in misses
+                          if unique_id is not None}
+            rows = session.query(Monitor.id, Monitor.unique_id).filter(or_(
+                Monitor.id.in_(ids), Monitor.unique_id.in_(unique_ids))).all()
+            found_ids = {str(row.id): row.id for row in rows}
+            found_unique_ids = {row.unique_id: row.id for row in rows}
+            for index, (monitor_id, unique_id) in enumerate(submissions):
+                if primary_keys[index] is not None:
+                    continue
+                if str(monitor_id) in found_ids:
+                    primary_keys[index] = found_ids[str(monitor_id)]
+                    self.store(self.by_id, str(monitor_id),
+                               primary_keys[index], now)
+                elif unique_id in found_unique_ids:
+                    primary_keys[index] = found_unique_ids[unique_id]
+                    self.store(self.by_unique_id, unique_id,
+                               primary_keys[index], now)
+        return primary_keys
+
+
+class RoutingCache(object):
+    """Caches names and contacts of Monitors, to notify state changes.
+
+    Misses load Monitors with their contacts eagerly, so a batch costs two
+        queries however many Monitors it holds. Entries of a Monitor are
+        invalidated when it or its contacts change through the ORM of this
+        process, all entries when any Contact changes, and entries expire
+        after ttl seconds to pick up changes made elsewhere.
+
+    Attributes:
+        ttl (float): Seconds an entry is trusted.
+        routes (dict): Route and expiry time, keyed by Monitor ID.
+    """
+
+    def __init__(self, ttl=300):
+        """Initialise RoutingCache and listen for Monitor and Contact changes.
+
+        Arguments:
+            See class attributes.
+        """
+        self.ttl = ttl
+        self.routes = dict()
+        self.lock = threading.Lock()
+        for model, listener in ((Monitor, self.on_monitor_change),
+                                (Contact, self.on_contact_change)):
+            for event_name in ('after_update', 'after_delete'):
+                event.listen(model, event_name, listener)
+
+    def close(self):
+        """Stop listening for Monitor and Contact changes."""
+        for model, listener in ((Monitor, self.on_monitor_change),
+                                (Contact, self.on_contact_change)):
+            for event_name in ('after_update', 'after_delete'):
+                event.remove(model, event_name, listener)
+
+    def on_monitor_change(self, mapper, connection, monitor):
+        """Invalidate entry of a changed Monitor, including its contacts."""
+        with self.lock:
+            self.routes.pop(monitor.id, None)
+
+    def on_contact_change(self, mapper, connection, contact):
+        """Invalidate all entries, as Contacts are shared by Monitors."""
+        with self.lock:
+            self.routes.clear()
+
+    def load(self, session, monitor_ids=None):
+        """Load and cache routes of Monitors with their contacts.
+
+        Arguments:
+            session (sqlalchemy.orm.Session): Database session.
+            monitor_ids (list): Database IDs of Monitors. All if None.
+
+        Returns:
+            dict: Route, keyed by ID of each Monitor found.
+        """
+        query = session.query(Monitor).options(
+            selectinload(Monitor.contacts))
+        if monitor_ids is not None:
+            query = query.filter(Monitor.id.in_(monitor_ids))
+        routes = {monitor.id: Route(monitor.name, tuple(
+            (contact.notifier, contact.destination)
+            for contact in monitor.contacts)) for monitor in query}
+        expiry = time.monotonic() + self.ttl
+        with self.lock:
+            for monitor_id, route in routes.items():
+                self.routes[monitor_id] = (route, expiry)
+        return routes
+
+    def get_many(self, session, monitor_ids):
+        """Return routes of Monitors, loading only uncached ones.
+
+        Arguments:
+            session (sqlalchemy.orm.Session): Database session.
+            monitor_ids (list): Database IDs of Monitors.
+
+        Returns:
+            dict: Route, keyed by ID of each Monitor found.
+        """
+        now = time.monotonic()
+        routes = dict()
+        with self.lock:
+            for monitor_id in monitor_ids:
+                entry = self.routes.get(monitor_id)
+                if entry and entry[1] > now:
+                    routes[monitor_id] = entry[0]
+        misses = [monitor_id for monitor_id in monitor_ids
+                  if monitor_id not in routes]
+        if misses:
+            routes.update(self.load(session, misses))
+        return routes
+
+    def get(self, session, monitor_id):
+        """Return route of a Monitor, or None if not found.
+
+        Arguments:
+            session (sqlalchemy.orm.Session): Database session.
+            monitor_id (int): Database ID of the Monitor.
+
+        Returns:
+            Route
+        """
+        return self.get_many(session, [monitor_id]).get(monitor_id)
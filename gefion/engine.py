@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Asyncio check engine, running many checks within one event loop."""
+
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+import requests
+
+from gefion import name_maps
+from gefion.checks.http import phase_trace_config
+from gefion.checks.resolver import DNS_CACHE, CachedResolver
+from gefion.scheduling import (LagStats, monitor_interval, next_run_delay,
+                               phase_delay)
+from gefion.worker_tasks import diff_monitors, request_monitors, retry_delay
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class AsyncEngine(object):
+    """Runs checks concurrently on a single asyncio event loop.
+
+    Slots are only held while a check is in flight, so waiting between
+        attempts or intervals costs nothing but a timer.
+
+    Attributes:
+        concurrency (int): Maximum number of checks in flight at once.
+        max_attempts (int): Default attempts before a failed check is
+            reported.
+        retry_backoff (float): Default base wait before the first retry, in
+            seconds.
+        pool_maxsize (int): Keep-alive connections per origin, for HTTP
+            checks which reuse connections.
+        pool_idle_timeout (float): Seconds before idle keep-alive
+            connections are closed.
+        lag (gefion.scheduling.LagStats): Lateness of monitor runs.
+        monitors (dict): Monitors as served by the master, keyed by ID.
+        etag (str): ETag of the Monitors assignment.
+        tasks (dict): run_monitor tasks of served Monitors, keyed by ID.
+    """
+
+    def __init__(self, concurrency=1000, max_attempts=3, retry_backoff=3,
+                 pool_maxsize=10, pool_idle_timeout=300):
+        """Initialise AsyncEngine.
+
+        Arguments:
+            See class attributes.
+        """
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.pool_maxsize = pool_maxsize
+        self.pool_idle_timeout = pool_idle_timeout
+        self.lag = LagStats()
+        self.monitors = dict()
+        self.etag = None
+        self.tasks = dict()
+        self.semaphore = None
+        self.session = None
+
+    async def start(self):
+        """Create resources bound to the running event loop."""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.concurrency,
+                limit_per_host=self.pool_maxsize,
+                keepalive_timeout=self.pool_idle_timeout,
+                use_dns_cache=False,
+                resolver=CachedResolver()),
+            trace_configs=[phase_trace_config()])
+
+    async def close(self):
+        """Release resources bound to the running event loop."""
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def run_check(self, check_name, arguments, max_attempts=None,
+                        retry_backoff=None):
+        """Execute check, retrying failures without holding a slot.
+
+        Arguments:
+            check_name (str): Type of the check. Use names in name_maps.
+            arguments (dict): Arguments of the check.
+            max_attempts (int): Attempts before a failure is reported.
+                Defaults to the engine's.
+            retry_backoff (float): Base wait before the first retry, in
+                seconds. Defaults to the engine's.
+
+        Returns:
+            gefion.checks.Result: None if the check type is unknown.
+        """
+        if check_name not in name_maps.ASYNC_CHECKS:
+            return None
+        max_attempts = max_attempts or self.max_attempts
+        retry_backoff = retry_backoff or self.retry_backoff
+        check = name_maps.ASYNC_CHECKS[check_name](**arguments)
+        for attempt in range(1, max_attempts + 1):
+            async with self.semaphore:
+                result = await check.check(session=self.session)
+            if result.availability or attempt == max_attempts:
+                result.attempts = attempt
+                return result
+            await asyncio.sleep(retry_delay(attempt, retry_backoff))
+
+    def run(self, checks):
+        """Run checks to completion and return their results.
+
+        Arguments:
+            checks (list): Tuples of check name and arguments.
+
+        Returns:
+            list: gefion.checks.Result, in the order of checks.
+        """
+        async def run_all():
+            await self.start()
+            try:
+                return await asyncio.gather(
+                    *(self.run_check(name, arguments)
+                      for name, arguments in checks))
+            finally:
+                await self.close()
+
+        return asyncio.run(run_all())
+
+    async def run_monitor(self, monitor, buffer):
+        """Run the check of a monitor forever at its frequency and phase.
+
+        Runs which raise, ex. on invalid arguments, are logged and the
+            monitor runs again at its next due time.
+
+        Arguments:
+            monitor (dict): Monitor as served by the master.
+            buffer (gefion.reporting.ResultBuffer): Buffer submitting
+                results.
+        """
+        loop = asyncio.get_running_loop()
+        interval = monitor_interval(monitor)
+        due = loop.time() + phase_delay(monitor['id'], interval, time.time())
+        while True:
+            await asyncio.sleep(due - loop.time())
+            self.lag.record(loop.time() - due)
+            try:
+                result = await self.run_check(
+                    monitor['check'], json.loads(monitor['arguments']),
+                    monitor.get('max_attempts'), monitor.get('retry_backoff'))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Monitor %s failed to run.', monitor['id'])
+                result = None
+            if result is not None:
+                buffer.add(monitor['id'], monitor['unique_id'], result)
+            due += interval  # Fixed grid, so lateness does not drift.
+            if due <= loop.time():  # Fell behind by a whole interval.
+                due = loop.time() + next_run_delay(monitor['id'], interval,
+                                                   time.time())
+
+    async def sync(self, config, buffer):
+        """Fetch Monitors from master, applying only what has changed.
+
+        Tasks of removed Monitors are cancelled, and those of changed
+            Monitors are restarted at their phase. Unchanged Monitors keep
+            running undisturbed.
+
+        Arguments:
+            config (dict): Entire loaded config.
+            buffer (gefion.reporting.ResultBuffer): Buffer submitting
+                results.
+        """
+        loop = asyncio.get_running_loop()
+        monitors, self.etag = await loop.run_in_executor(
+            None, request_monitors, config, self.etag)
+        if monitors is None:
+            return
+        fetched = {monitor['id']: monitor for monitor in monitors}
+        added, removed, changed = diff_monitors(self.monitors, fetched)
+        for monitor_id in removed | changed:
+            self.tasks.pop(monitor_id).cancel()
+        for monitor_id in added | changed:
+            self.tasks[monitor_id] = asyncio.create_task(
+                self.run_monitor(fetched[monitor_id], buffer))
+        self.monitors = fetched
+        logger.info('Sync added %d, removed %d and changed %d monitors.',
+                    len(added), len(removed), len(changed))
+
+    async def log_stats(self, stats_interval):
+        """Log lag and DNS cache stats every stats_interval, until cancelled.
+
+        Arguments:
+            stats_interval (float): Seconds between stats logs.
+        """
+        while True:
+            await asyncio.sleep(stats_interval)
+            logger.info('Serving %d monitors. Lag stats: %s. DNS stats: %s.',
+                        len(self.tasks), self.lag.api_serialised,
+                        DNS_CACHE.api_serialised)
+
+    async def serve(self, config, buffer, sync_interval=300,
+                    stats_interval=60):
+        """Run assigned monitors on the current event loop until cancelled.
+
+        Arguments:
+            config (dict): Entire loaded config.
+            buffer (gefion.reporting.ResultBuffer): Buffer submitting
+                results.
+            sync_interval (float): Seconds between Monitor synchronisations.
+            stats_interval (float): Seconds between lag and DNS cache stats
+                logs.
+        """
+        await self.start()
+        stats_task = asyncio.create_task(self.log_stats(stats_interval))
+        try:
+            await self.sync(config, buffer)
+            logger.info('Serving %d monitors with concurrency %d.',
+                        len(self.monitors), self.concurrency)
+            while True:
+                await asyncio.sleep(sync_interval)
+                try:
+                    await self.sync(config, buffer)
+                except (requests.exceptions.RequestException, ValueError):
+                    logger.exception('Failed to sync monitors.')
+        finally:
+            stats_task.cancel()
+            tasks = list(self.tasks.values())
+            self.tasks.clear()
+            self.monitors = dict()
+            self.etag = None
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(stats_task, *tasks, return_exceptions=True)
+            await self.close()
+            buffer.close()
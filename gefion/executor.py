@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""In-process check executor, replacing rq's fork-per-job model."""
+
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+POOL_KINDS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+
+def timed_call(func, *args):
+    """Call function and measure its execution time.
+
+    This is module-level so that process pools can pickle it.
+
+    Arguments:
+        func (callable): Function to call.
+        args: Arguments of the function.
+
+    Returns:
+        tuple: Return value and execution time in seconds.
+    """
+    start_time = time.perf_counter()
+    value = func(*args)
+    return value, time.perf_counter() - start_time
+
+
+class ExecutorStats(object):
+    """Per-job overhead statistics of an executor.
+
+    Overhead is the time between submission and completion of a job which
+        was not spent executing it, such as queueing, pickling and dispatch.
+
+    Attributes:
+        jobs (int): Number of completed jobs.
+        failures (int): Number of jobs which raised exceptions.
+        total_overhead (float): Sum of overheads, in seconds.
+        max_overhead (float): Largest overhead, in seconds.
+    """
+
+    def __init__(self):
+        """Initialise ExecutorStats."""
+        self.jobs = 0
+        self.failures = 0
+        self.total_overhead = 0.0
+        self.max_overhead = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, overhead, failed=False):
+        """Record a completed job.
+
+        Arguments:
+            overhead (float): Overhead of the job, in seconds.
+            failed (bool): Whether the job raised an exception.
+        """
+        with self.lock:
+            self.jobs += 1
+            self.failures += 1 if failed else 0
+            self.total_overhead += overhead
+            self.max_overhead = max(self.max_overhead, overhead)
+
+    @property
+    def mean_overhead(self):
+        """Return mean overhead per job, in seconds."""
+        return self.total_overhead / self.jobs if self.jobs else 0.0
+
+    @property
+    def api_serialised(self):
+        """Return serialisable statistics."""
+        return {'jobs': self.jobs,
+                'failures': self.failures,
+                'mean_overhead': self.mean_overhead,
+                'max_overhead': self.max_overhead}
+
+
+class CheckExecutor(object):
+    """Runs jobs in a long-lived thread or process pool.
+
+    Attributes:
+        kind (str): Kind of pool, `thread` or `process`.
+        workers (int): Number of pool workers.
+        stats (ExecutorStats): Per-job overhead statistics.
+    """
+
+    def __init__(self, kind='thread', workers=32):
+        """Initialise CheckExecutor.
+
+        Arguments:
+            See class attributes.
+        """
+        if kind not in POOL_KINDS:
+            raise ValueError('Unknown pool kind {}.'.format(kind))
+        self.kind = kind
+        self.workers = workers
+        self.stats = ExecutorStats()
+        self.pool = POOL_KINDS[kind](max_workers=workers)
+
+    def submit(self, func, *args):
+        """Submit job to the pool.
+
+        Arguments:
+            func (callable): Function to run. Must be picklable for process
+                pools.
+            args: Arguments of the function.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the function's return
+                value and its execution time, as by timed_call.
+        """
+        submitted = time.perf_counter()
+        future = self.pool.submit(timed_call, func, *args)
+
+        def done(timed_future):
+            elapsed = time.perf_counter() - submitted
+            if timed_future.exception():
+                logger.error('Job %s raised: %s.', func.__name__,
+                             repr(timed_future.exception()))
+                self.stats.record(elapsed, failed=True)
+            else:
+                self.stats.record(elapsed - timed_future.result()[1])
+
+        future.add_done_callback(done)
+        return future
+
+    def shutdown(self, wait=True):
+        """Shut the pool down.
+
+        Arguments:
+            wait (bool): Wait for running jobs to finish.
+        """
+        self.pool.shutdown(wait=wait)
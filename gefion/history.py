@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""Result history and its minute, hour and day rollups."""
+
+import bisect
+import json
+import logging
+import time
+
+from sqlalchemy import and_, delete, insert, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from gefion.models import ResultRecord, Rollup
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+# Upper bounds of runtime histogram buckets in seconds, from 1 ms growing by
+# a quarter up to about 2 minutes. Percentiles are accurate to a bucket.
+LATENCY_BOUNDS = [0.001 * 1.25 ** index for index in range(53)]
+
+# Days raw results and rollups of each resolution are kept for.
+DEFAULT_RETENTION = {'raw': 7, MINUTE: 14, HOUR: 180, DAY: None}
+
+
+def latency_bucket(runtime):
+    """Return index of the histogram bucket of a runtime.
+
+    Arguments:
+        runtime (float): Runtime in seconds.
+
+    Returns:
+        int: Runtimes beyond the last bound fall in an extra last bucket.
+    """
+    return bisect.bisect_left(LATENCY_BOUNDS, runtime)
+
+
+class Aggregate(object):
+    """Mergeable count, failures and runtime distribution of results.
+
+    Attributes:
+        count (int): Number of results.
+        failures (int): Number of unavailable results.
+        runtime_sum (float): Sum of runtimes in seconds.
+        runtime_min (float): Shortest runtime, None if no runtimes.
+        runtime_max (float): Longest runtime, None if no runtimes.
+        histogram (list): Counts of runtimes per bucket of LATENCY_BOUNDS.
+    """
+
+    def __init__(self):
+        """Initialise empty Aggregate."""
+        self.count = 0
+        self.failures = 0
+        self.runtime_sum = 0.0
+        self.runtime_min = None
+        self.runtime_max = None
+        self.histogram = [0] * (len(LATENCY_BOUNDS) + 1)
+
+    def add(self, availability, runtime):
+        """Add a result.
+
+        Arguments:
+            availability (bool): Availability of the resource.
+            runtime (float): Runtime of the check in seconds.
+        """
+        self.count += 1
+        self.failures += 0 if availability else 1
+        if runtime is None:
+            return
+        self.runtime_sum += runtime
+        self.runtime_min = runtime if self.runtime_min is None \
+            else min(self.runtime_min, runtime)
+        self.runtime_max = runtime if self.runtime_max is None \
+            else max(self.runtime_max, runtime)
+        self.histogram[latency_bucket(runtime)] += 1
+
+    def merge(self, count, failures, runtime_sum, runtime_min, runtime_max,
+              histogram):
+        """Merge another aggregate, ex. a Rollup row.
+
+        Arguments:
+            See class attributes.
+        """
+        self.count += count or 0
+        self.failures += failures or 0
+        self.runtime_sum += runtime_sum or 0.0
+        for attribute, value, pick in (('runtime_min', runtime_min, min),
+                                       ('runtime_max', runtime_max, max)):
+            if value is not None:
+                current = getattr(self, attribute)
+                setattr(self, attribute,
+                        value if current is None else pick(current, value))
+        for index, bucket_count in enumerate(histogram or list()):
+            self.histogram[index] += bucket_count
+
+    def merge_rollup(self, rollup):
+        """Merge a Rollup row.
+
+        Arguments:
+            rollup (gefion.models.Rollup): Row to merge.
+        """
+        self.merge(rollup.count, rollup.failures, rollup.runtime_sum,
+                   rollup.runtime_min, rollup.runtime_max,
+                   json.loads(rollup.histogram) if rollup.histogram else None)
+
+    def apply(self, rollup):
+        """Overwrite a Rollup row with this aggregate.
+
+        Arguments:
+            rollup (gefion.models.Rollup): Row to overwrite.
+        """
+        rollup.count = self.count
+        rollup.failures = self.failures
+        rollup.runtime_sum = self.runtime_sum
+        rollup.runtime_min = self.runtime_min
+        rollup.runtime_max = self.runtime_max
+        rollup.histogram = json.dumps(self.histogram)
+
+    def percentile(self, fraction):
+        """Return a runtime percentile.
+
+        Arguments:
+            fraction (float): Percentile as a fraction, ex. 0.95.
+
+        Returns:
+            float: Upper bound of the bucket holding the percentile, capped
+                by the longest runtime. None if no runtimes.
+        """
+        total = sum(self.histogram)
+        if not total:
+            return None
+        seen = 0
+        for index, bucket_count in enumerate(self.histogram):
+            seen += bucket_count
+            if seen >= fraction * total:
+                break
+        bound = LATENCY_BOUNDS[index] if index < len(LATENCY_BOUNDS) \
+            else self.runtime_max
+        return min(bound, self.runtime_max)
+
+    @property
+    def api_serialised(self):
+        """Return serialisable summary."""
+        runtimes = sum(self.histogram)
+        return {'count': self.count,
+                'failures': self.failures,
+                'uptime': 1 - self.failures / self.count
+                if self.count else None,
+                'runtime_mean': self.runtime_sum / runtimes
+                if runtimes else None,
+                'runtime_min': self.runtime_min,
+                'runtime_max': self.runtime_max,
+                'runtime_p50': self.percentile(0.5),
+                'runtime_p95': self.percentile(0.95),
+                'runtime_p99': self.percentile(0.99)}
+
+
+def insert_missing_rollups(session, keys):
+    """Insert empty rollups of buckets which have none yet.
+
+    Rows inserted meanwhile by other writers are left alone rather than
+        raising IntegrityError.
+
+    Arguments:
+        session (sqlalchemy.orm.Session): Database session. Not committed.
+        keys (list): Tuples of Monitor ID, resolution and bucket.
+    """
+    rows = [{'monitor_id': monitor_id, 'resolution': resolution,
+             'bucket': bucket, 'count': 0, 'failures': 0, 'runtime_sum': 0.0}
+            for monitor_id, resolution, bucket in keys]
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        dialect_insert = postgresql.insert if dialect == 'postgresql' \
+            else sqlite.insert
+        session.execute(dialect_insert(Rollup).on_conflict_do_nothing(),
+                        rows)
+    elif dialect == 'mysql':
+        session.execute(insert(Rollup).prefix_with('IGNORE'), rows)
+    else:
+        for row in rows:
+            try:
+                with session.begin_nested():
+                    session.execute(insert(Rollup), row)
+            except IntegrityError:
+                pass
+
+
+def record_results(session, results):
+    """Append results to the history and fold them into rollups.
+
+    Results are aggregated in memory first, so each touched bucket costs one
+        row read and one row write however many results fall into it. Rows
+        are created up front and read locked, in primary key order, so that
+        concurrent writers neither fail on the first insert of a bucket nor
+        overwrite each other's counts.
+
+    Arguments:
+        session (sqlalchemy.orm.Session): Database session. Not committed.
+        results (list): Tuples of Monitor ID and gefion.checks.Result.
+    """
+    if not results:
+        return
+    session.execute(insert(ResultRecord), [
+        {'monitor_id': monitor_id, 'timestamp': result.timestamp,
+         'availability': result.availability, 'runtime': result.runtime,
+         'message': result.message} for monitor_id, result in results])
+
+    aggregates = dict()
+    for monitor_id, result in results:
+        for resolution in RESOLUTIONS:
+            key = (monitor_id, resolution,
+                   int(result.timestamp // resolution * resolution))
+            aggregates.setdefault(key, Aggregate()).add(result.availability,
+                                                        result.runtime)
+
+    insert_missing_rollups(session, sorted(aggregates))
+    locked = session.query(Rollup).filter(
+        Rollup.monitor_id.in_({key[0] for key in aggregates}),
+        Rollup.bucket.in_({key[2] for key in aggregates})).order_by(
+            Rollup.monitor_id, Rollup.resolution, Rollup.bucket)
+    existing = {(rollup.monitor_id, rollup.resolution, rollup.bucket): rollup
+                for rollup in locked.with_for_update().populate_existing()}
+    for key, aggregate in aggregates.items():
+        rollup = existing[key]
+        aggregate.merge_rollup(rollup)
+        aggregate.apply(rollup)
+
+
+def compact(session, retention=None, now=None):
+    """Delete raw results and rollups beyond their retention.
+
+    Arguments:
+        session (sqlalchemy.orm.Session): Database session. Not committed.
+        retention (dict): Days to keep, keyed by `raw` or resolution. None
+            keeps forever. Defaults to DEFAULT_RETENTION.
+        now (float): Current UNIX timestamp. Defaults to now.
+
+    Returns:
+        int: Number of deleted rows.
+    """
+    retention = dict(DEFAULT_RETENTION, **(retention or dict()))
+    now = time.time() if now is None else now
+    deleted = 0
+    if retention['raw'] is not None:
+        deleted += session.execute(delete(ResultRecord).where(
+            ResultRecord.timestamp < now - retention['raw'] * DAY)).rowcount
+    for resolution in RESOLUTIONS:
+        if retention[resolution] is not None:
+            deleted += session.execute(delete(Rollup).where(
+                Rollup.resolution == resolution,
+                Rollup.bucket < now - retention[resolution] * DAY)).rowcount
+    logger.info('Compacted %d result history rows.', deleted)
+    return deleted
+
+
+def cover(start, end):
+    """Split a time range into the fewest minute, hour and day buckets.
+
+    Arguments:
+        start (float): UNIX timestamp of the start, rounded up to a minute.
+        end (float): UNIX timestamp of the end, rounded down to a minute.
+
+    Returns:
+        list: Tuples of resolution and range of bucket starts, as start and
+            end timestamps.
+    """
+    ranges = list()
+
+    def split(start, end, resolutions):
+        resolution, coarser = resolutions[-1], resolutions[:-1]
+        aligned_start = -(-start // resolution) * resolution
+        aligned_end = end // resolution * resolution
+        if not coarser or aligned_start >= aligned_end:
+            if coarser:
+                return split(start, end, coarser)
+            if start < end:
+                ranges.append((resolution, start, end))
+            return
+        ranges.append((resolution, aligned_start, aligned_end))
+        split(start, aligned_start, coarser)
+        split(aligned_end, end, coarser)
+
+    split(-(-int(start) // MINUTE) * MINUTE, int(end) // MINUTE * MINUTE,
+          RESOLUTIONS)
+    return ranges
+
+
+def summarise(session, monitor_id, start, end):
+    """Summarise results of a Monitor from rollups only.
+
+    Reads one row per bucket of the coarsest resolutions covering the range,
+        so the cost does not depend on the number of results.
+
+    Arguments:
+        session (sqlalchemy.orm.Session): Database session.
+        monitor_id (int): Database ID of the Monitor.
+        start (float): UNIX timestamp of the start, rounded up to a minute.
+        end (float): UNIX timestamp of the end, rounded down to a minute.
+
+    Returns:
+        Aggregate: Merged rollups. See Aggregate.api_serialised.
+    """
+    aggregate = Aggregate()
+    ranges = cover(start, end)
+    if not ranges:
+        return aggregate
+    for rollup in session.query(Rollup).filter(
+            Rollup.monitor_id == monitor_id,
+            or_(*(and_(Rollup.resolution == resolution,
+                       Rollup.bucket >= range_start,
+                       Rollup.bucket < range_end)
+                  for resolution, range_start, range_end in ranges))):
+        aggregate.merge_rollup(rollup)
+    return aggregate
@@ -1,22 +1,48 @@
 # -*- coding: utf-8 -*-
 """Master RQ tasks."""
 
+import json
 import logging
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import yaml
+from redis import Redis
+from rq import Queue
 
 from gefion import name_maps
 from gefion.checks import Result
-from gefion.models import Base
+from gefion.database import get_routing_cache, get_session_factory
+from gefion.models import Monitor
 from gefion.notifiers import Message
+from gefion.notifiers.limits import LIMITER
+from gefion.state import get_state_cache, get_state_writer
+from gefion.worker_tasks import retry_delay
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Version of the process_result job payload. Bump on incompatible changes.
+PAYLOAD_VERSION = 1
+RESULT_FIELDS = ('availability', 'runtime', 'message', 'timestamp',
+                 'attempts', 'timings')
 
-def notify(notifier_name, hostname, result, destination, config):
+# Configuration files loaded by this process, keyed by path.
+CONFIGS = dict()
+
+# Queue of deliver jobs, apart from results so that slow providers never
+# hold up result processing.
+DELIVERY_QUEUE = 'notifications'
+# Delivery queues keyed by Redis host and port, and the thread pool sending
+# to the contacts of a delivery concurrently, created once per process.
+DELIVERY_QUEUES = dict()
+DELIVERY_POOLS = list()
+delivery_lock = threading.Lock()
+
+
+def notify(notifier_name, hostname, result, destination, config,
+           changes=None):
     """Notify using Notifiers.
 
     Arguments:
@@ -25,55 +51,367 @@ def notify(notifier_name, hostname, result, destination, config):
         result (gefion.checks.Result): Result of the check.
         destination (str): Message recipient.
         config (dict): Entire loaded configuration file.
+        changes (list): Tuples of hostname and Result of a digest, whose
+            latest are hostname and result. None if not a digest.
 
     Returns:
         bool: Successfulness of notification.
     """
+    return notify_batch(notifier_name, hostname, result, [destination],
+                        config, changes)[0]
+
+
+def notify_batch(notifier_name, hostname, result, destinations, config,
+                 changes=None):
+    """Notify destinations of one Notifier, in batches if it supports them.
+
+    Each notification first waits for a token of the budgets the Notifier
+        declares, so bursts beyond them are spread out in order rather than
+        rejected by the provider.
+
+    Arguments:
+        notifier_name (str): Name of Notifier. See name_maps.
+        hostname (str): Name of resource being checked.
+        result (gefion.checks.Result): Result of the check.
+        destinations (list): Message recipients.
+        config (dict): Entire loaded configuration file.
+        changes (list): Tuples of hostname and Result of a digest, whose
+            latest are hostname and result. None if not a digest.
+
+    Returns:
+        list: Successfulness of notification of each destination.
+    """
     logger.debug('Notifying %s with method %s to %s.', hostname,
-                 notifier_name, destination)
+                 notifier_name, destinations)
     notifier_config = config.get(notifier_name, dict())
     logger.debug('Got notifier config %s.', notifier_config)
     if notifier_name not in name_maps.NOTIFIERS:
-        return False
-    message = Message(hostname, result)
-    notifier = name_maps.NOTIFIERS[notifier_name](message=message,
-                                                  destination=destination,
-                                                  **notifier_config)
-    return notifier.send()
+        return [False] * len(destinations)
+    message = Message(hostname, result, changes)
+    notifier_class = name_maps.NOTIFIERS[notifier_name]
+    notifiers = [notifier_class(message=message, destination=destination,
+                                **notifier_config)
+                 for destination in destinations]
+    for notifier in notifiers:
+        LIMITER.acquire(notifier.limits())
+    if len(notifiers) == 1:
+        return [notifiers[0].send()]
+    return notifier_class.send_batch(notifiers)
 
 
-def process_result(monitor, result_dict, config):
-    """Process monitoring result received from worker.
+def load_config(path):
+    """Load configuration file, once per process.
+
+    Arguments:
+        path (str): Path to yaml configuration file.
+
+    Returns:
+        dict: Entire loaded configuration file.
+    """
+    if path not in CONFIGS:
+        with open(path) as config_file:
+            CONFIGS[path] = yaml.safe_load(config_file)
+        logger.debug('Master configuration loaded from %s.', path)
+    return CONFIGS[path]
+
+
+def result_fields(result_dict):
+    """Return the Result fields known to this PAYLOAD_VERSION, if set."""
+    return {key: result_dict[key] for key in RESULT_FIELDS
+            if result_dict.get(key) is not None}
+
+
+def result_from_fields(result_dict):
+    """Make Result from fields as returned by result_fields."""
+    return Result(
+        result_dict.get('availability'), result_dict.get('runtime'),
+        result_dict.get('message'), result_dict.get('timestamp'),
+        result_dict.get('attempts', 1), result_dict.get('timings'))
+
+
+def make_payload(monitor_id, result_dict, config_path):
+    """Make the job payload of a result submitted by a worker.
+
+    Payloads hold plain values only, and only the Result fields known to
+        this PAYLOAD_VERSION.
 
     Arguments:
-        monitor (gefion.models.Monitor): Instance of database model Monitor.
+        monitor_id (int): Database ID of the Monitor.
         result_dict (dict): Dictionary of results depicting Result class,
             submitted by workers.
+        config_path (str): Path to the configuration file of master.
+
+    Returns:
+        dict
+    """
+    return {'version': PAYLOAD_VERSION,
+            'monitor_id': int(monitor_id),
+            'result': result_fields(result_dict),
+            'config': config_path}
+
+
+def get_delivery_queue(config):
+    """Return the queue of deliver jobs of the configured Redis.
+
+    Arguments:
         config (dict): Entire loaded configuration file.
+
+    Returns:
+        rq.Queue
     """
-    hostname = monitor.name
-    result = Result(
-        result_dict.get('availability'), result_dict.get('runtime'),
-        result_dict.get('message'), result_dict.get('timestamp'))
-
-    # Initialise SQLAlchemy
-    engine = create_engine(config['database'].get('uri', ':memory:'))
-    Base.metadata.bind = engine
-    Base.metadata.create_all()
-    session_factory = sessionmaker(bind=engine)
-    session = session_factory()
-    monitor = session.merge(monitor)
-
-    logger.debug('%s last result was %s.', hostname,
-                 monitor.last_availability)
+    redis_host = config.get('rq', dict()).get('host', 'localhost')
+    redis_port = int(config.get('rq', dict()).get('port', 6379))
+    with delivery_lock:
+        if (redis_host, redis_port) not in DELIVERY_QUEUES:
+            DELIVERY_QUEUES[(redis_host, redis_port)] = Queue(
+                DELIVERY_QUEUE,
+                connection=Redis(host=redis_host, port=redis_port))
+        return DELIVERY_QUEUES[(redis_host, redis_port)]
+
+
+def get_delivery_pool(config):
+    """Return the thread pool sending notifications of deliver jobs.
+
+    Arguments:
+        config (dict): Entire loaded configuration file. The `notifiers`
+            section may set `concurrency`, the most notifications sent at
+            once.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor
+    """
+    with delivery_lock:
+        if not DELIVERY_POOLS:
+            DELIVERY_POOLS.append(ThreadPoolExecutor(
+                int(config.get('notifiers', dict()).get('concurrency', 16)),
+                thread_name_prefix='delivery'))
+        return DELIVERY_POOLS[0]
+
+
+def make_delivery(changes, contacts, config_path, attempt=1):
+    """Make the job payload of notifications of state changes.
+
+    Arguments:
+        changes (list): Tuples of hostname and dictionary of results
+            depicting Result class, oldest first. Several changes are
+            delivered as one digest.
+        contacts (list): Tuples of notifier name and destination.
+        config_path (str): Path to the configuration file of master.
+        attempt (int): Number of the delivery attempt, from 1.
+
+    Returns:
+        dict
+    """
+    return {'version': PAYLOAD_VERSION,
+            'changes': [[hostname, result_fields(result_dict)]
+                        for hostname, result_dict in changes],
+            'contacts': [list(contact) for contact in contacts],
+            'config': config_path,
+            'attempt': attempt}
+
+
+def digest_key(contact):
+    """Return Redis key of the state changes pending for a contact."""
+    return 'gefion:digest:{}:{}'.format(*contact)
+
+
+def dispatch(hostname, result, contacts, config, config_path):
+    """Enqueue notifications of a state change for delivery.
+
+    Without a digest window, costs one enqueue however many contacts there
+        are. With the `notifiers` section's `digest_window` in seconds,
+        changes are coalesced per contact instead: the first change of a
+        window schedules its digest to be flushed when the window ends, and
+        the window is flushed early once `digest_size` (default 30) changes
+        are pending, so that a digest is neither late nor long.
+
+    Arguments:
+        hostname (str): Name of resource being checked.
+        result (gefion.checks.Result): Result of the check.
+        contacts (list): Tuples of notifier name and destination.
+        config (dict): Entire loaded configuration file.
+        config_path (str): Path to the configuration file of master.
+    """
+    if not contacts:
+        return
+    queue = get_delivery_queue(config)
+    notifiers_config = config.get('notifiers', dict())
+    window = float(notifiers_config.get('digest_window', 0))
+    if window <= 0:
+        queue.enqueue(deliver, make_delivery(
+            [(hostname, result.api_serialised)], contacts, config_path))
+        return
+
+    size = int(notifiers_config.get('digest_size', 30))
+    change = json.dumps([hostname, result_fields(result.api_serialised)])
+    pipeline = queue.connection.pipeline()
+    for contact in contacts:
+        pipeline.rpush(digest_key(contact), change)
+        # Outlives missed flushes by little, should a worker die.
+        pipeline.expire(digest_key(contact), int(window * 10 + 60))
+    lengths = pipeline.execute()[::2]
+    for contact, length in zip(contacts, lengths):
+        payload = {'version': PAYLOAD_VERSION, 'contact': list(contact),
+                   'config': config_path}
+        if length == 1:
+            queue.enqueue_in(timedelta(seconds=window), flush_digest,
+                             payload)
+        if length % size == 0:
+            queue.enqueue(flush_digest, payload)
+
+
+def flush_digest(payload):
+    """Deliver state changes pending for a contact as digests.
+
+    Pending changes are taken atomically, and delivered in digests of at
+        most `digest_size` changes.
+
+    Arguments:
+        payload (dict): Job payload with `contact` and `config`.
+
+    Returns:
+        int: Number of digests enqueued.
+    """
+    if payload.get('version') != PAYLOAD_VERSION:
+        logger.error('Dropped digest payload of unknown version %s.',
+                     payload.get('version'))
+        return 0
+    config = load_config(payload['config'])
+    queue = get_delivery_queue(config)
+    size = int(config.get('notifiers', dict()).get('digest_size', 30))
+    key = digest_key(payload['contact'])
+    pipeline = queue.connection.pipeline()
+    pipeline.lrange(key, 0, -1)
+    pipeline.delete(key)
+    changes = [json.loads(change) for change in pipeline.execute()[0]]
+    for index in range(0, len(changes), size):
+        queue.enqueue(deliver, make_delivery(
+            changes[index:index + size], [payload['contact']],
+            payload['config']))
+    return -(-len(changes) // size)
+
+
+def deliver(payload):
+    """Send notifications of state changes to their contacts concurrently.
+
+    Contacts which failed are enqueued again after an exponential backoff,
+        until the `notifiers` section's `max_attempts` (default 5) is used
+        up. The backoff base is its `retry_backoff` in seconds (default 5).
+        Retries are scheduled, so workers of the delivery queue should run
+        with the rq scheduler.
+
+    Arguments:
+        payload (dict): Job payload, see make_delivery.
+
+    Returns:
+        list: Tuples of notifier name and destination which failed.
+    """
+    if payload.get('version') != PAYLOAD_VERSION:
+        logger.error('Dropped delivery payload of unknown version %s.',
+                     payload.get('version'))
+        return list()
+    config = load_config(payload['config'])
+    changes = [(hostname, result_from_fields(result_dict))
+               for hostname, result_dict in payload['changes']]
+    hostname, result = changes[-1]
+    contacts = [tuple(contact) for contact in payload['contacts']]
+
+    # Contacts of Notifiers which send in batches are grouped into batches,
+    # and every batch or other contact is sent concurrently.
+    batches = list()
+    for notifier_name in dict.fromkeys(name for name, _ in contacts):
+        destinations = [destination for name, destination in contacts
+                        if name == notifier_name]
+        batch_size = getattr(name_maps.NOTIFIERS.get(notifier_name),
+                             'batch_size', 1)
+        batches.extend((notifier_name, destinations[index:index + batch_size])
+                       for index in range(0, len(destinations), batch_size))
+
+    def send(batch):
+        notifier_name, destinations = batch
+        try:
+            return notify_batch(notifier_name, hostname, result, destinations,
+                                config, changes if len(changes) > 1 else None)
+        except Exception:
+            logger.exception('Failed to notify %s with %s.', destinations,
+                             notifier_name)
+            return [False] * len(destinations)
+
+    failed = list()
+    for (notifier_name, destinations), sent in zip(
+            batches, get_delivery_pool(config).map(send, batches)):
+        failed.extend((notifier_name, destination) for destination, success
+                      in zip(destinations, sent) if not success)
+    notifiers_config = config.get('notifiers', dict())
+    attempt = payload.get('attempt', 1)
+    if failed and attempt < int(notifiers_config.get('max_attempts', 5)):
+        delay = retry_delay(attempt,
+                            float(notifiers_config.get('retry_backoff', 5)))
+        logger.warning('Retrying %d notifications of %s in %.1f seconds.',
+                       len(failed), hostname, delay)
+        get_delivery_queue(config).enqueue_in(
+            timedelta(seconds=delay), deliver,
+            make_delivery(payload['changes'], failed, payload['config'],
+                          attempt + 1))
+    elif failed:
+        logger.error('Gave up notifying %s of %s after %d attempts.',
+                     failed, hostname, attempt)
+    return failed
+
+
+def process_result(payload):
+    """Process monitoring result received from worker.
+
+    The last state of the Monitor is taken from the StateCache, falling
+        back to the database. Results which change neither availability nor
+        message do not read the Monitor at all. Names and contacts of
+        Monitors are served by the RoutingCache, so changes of cached
+        Monitors do not query either. Notifications are delivered by deliver
+        jobs, and updates and the result history are written behind in bulk
+        by the StateWriter, or before the job ends in forking rq workers.
+
+    Arguments:
+        payload (dict): Job payload, see make_payload.
+    """
+    if payload.get('version') != PAYLOAD_VERSION:
+        logger.error('Dropped result payload of unknown version %s.',
+                     payload.get('version'))
+        return
+    config = load_config(payload['config'])
+    result = result_from_fields(payload['result'])
+
+    monitor_id = payload['monitor_id']
+    state_cache = get_state_cache(config)
+    state_writer = get_state_writer(config)
+    last_updated = datetime.fromtimestamp(result.timestamp)
+    state_writer.record(monitor_id, result)
+    last_state = state_cache.get(monitor_id)
+    if last_state == (result.availability, result.message):
+        state_writer.add(monitor_id, last_updated=last_updated)
+        state_writer.end_job()
+        return
+
+    session = get_session_factory(config)()
+    try:
+        route = get_routing_cache(config).get(session, monitor_id)
+        if route is None:
+            logger.warning('Dropped result of deleted monitor %d.',
+                           monitor_id)
+            state_writer.end_job()
+            return
+        last_availability = last_state[0] if last_state else \
+            session.query(Monitor.last_availability).filter(
+                Monitor.id == monitor_id).scalar()
+    finally:
+        session.close()
+
+    hostname = route.name
+    logger.debug('%s last result was %s.', hostname, last_availability)
     logger.info('%s latest result is %s.', hostname, result.availability)
-    if monitor.last_availability != result.availability:
-        for contact in monitor.contacts:
-            notify(contact.notifier, hostname, result, contact.destination,
-                   config)
-
-    monitor.last_availability = result.availability
-    monitor.last_message = result.message
-    monitor.last_updated = datetime.fromtimestamp(result.timestamp)
-    session.add(monitor)
-    session.commit()
+    if last_availability != result.availability:
+        dispatch(hostname, result, route.contacts, config, payload['config'])
+
+    state_writer.add(monitor_id, last_availability=result.availability,
+                     last_message=result.message, last_updated=last_updated)
+    state_writer.end_job()
+    state_cache.set(monitor_id, result.availability, result.message)
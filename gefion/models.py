@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 """SQLAlchemy ORM mdoels."""
 
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer, String,
-                        Table, func)
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Index,
+                        Integer, String, Table, func)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -26,6 +26,11 @@ class Monitor(Base):
         worker (Column(String)): Name of the worker. Use names assigned in the
             config file.
         frequency (Column(Integer)): In minutes.
+        interval (Column(Integer)): In seconds. Takes precedence over
+            frequency when set, for sub-minute checks.
+        max_attempts (Column(Integer)): Attempts before a failure is reported.
+        retry_backoff (Column(Float)): Base wait before the first retry, in
+            seconds. Doubles with every further attempt.
         last_availability (Column(Boolean)): Latest availability.
         last_message (Column(String)): Latest message.
         last_updated (Column((DateTime)): Last time check was run.
@@ -35,11 +40,14 @@ class Monitor(Base):
     __tablename__ = 'monitors'
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    unique_id = Column(String)
+    unique_id = Column(String, index=True)
     check = Column(String)  # ex. `port`.
     arguments = Column(String)
     worker = Column(String)
     frequency = Column(Integer)
+    interval = Column(Integer)
+    max_attempts = Column(Integer, default=3)
+    retry_backoff = Column(Float, default=3)
     last_availability = Column(Boolean)
     last_message = Column(String)
     last_updated = Column(DateTime, default=func.now())
@@ -56,7 +64,10 @@ class Monitor(Base):
                 'check': self.check,
                 'arguments': self.arguments,
                 'worker': self.worker,
-                'frequency': self.frequency}
+                'frequency': self.frequency,
+                'interval': self.interval,
+                'max_attempts': self.max_attempts,
+                'retry_backoff': self.retry_backoff}
 
 
 class Contact(Base):
@@ -75,3 +86,56 @@ class Contact(Base):
     name = Column(String)
     notifier = Column(String)  # ex `telegram`.
     destination = Column(String)
+
+
+class ResultRecord(Base):
+    """History of check results, appended in bulk and compacted by age.
+
+    Attributes:
+        id (Column(Integer)): Auto-incremental ID.
+        monitor_id (Column(Integer)): ID of the Monitor. Not a foreign key,
+            so appends need no lookups.
+        timestamp (Column(Float)): UNIX timestamp of the check.
+        availability (Column(Boolean)): Availability of the resource.
+        runtime (Column(Float)): Runtime of the check in seconds.
+        message (Column(String)): Message of the check.
+    """
+
+    __tablename__ = 'results'
+    __table_args__ = (Index('ix_results_monitor_id_timestamp', 'monitor_id',
+                            'timestamp'), )
+    id = Column(Integer, primary_key=True)
+    monitor_id = Column(Integer, nullable=False)
+    timestamp = Column(Float, nullable=False)
+    availability = Column(Boolean)
+    runtime = Column(Float)
+    message = Column(String)
+
+
+class Rollup(Base):
+    """Aggregated results of a Monitor over a time bucket.
+
+    Attributes:
+        monitor_id (Column(Integer)): ID of the Monitor.
+        resolution (Column(Integer)): Length of the bucket in seconds, ex.
+            60 for minutes.
+        bucket (Column(Integer)): UNIX timestamp of the start of the bucket.
+        count (Column(Integer)): Number of results.
+        failures (Column(Integer)): Number of unavailable results.
+        runtime_sum (Column(Float)): Sum of runtimes in seconds.
+        runtime_min (Column(Float)): Shortest runtime in seconds.
+        runtime_max (Column(Float)): Longest runtime in seconds.
+        histogram (Column(String)): JSON-ed counts of runtimes per bucket of
+            gefion.history.LATENCY_BOUNDS, for percentiles.
+    """
+
+    __tablename__ = 'rollups'
+    monitor_id = Column(Integer, primary_key=True)
+    resolution = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, default=0)
+    failures = Column(Integer, default=0)
+    runtime_sum = Column(Float, default=0)
+    runtime_min = Column(Float)
+    runtime_max = Column(Float)
+    histogram = Column(String)
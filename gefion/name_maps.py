@@ -11,6 +11,8 @@ from gefion import checks, notifiers
 
 CHECKS = {'http': checks.HTTPCheck, 'port': checks.PortCheck}
 
+ASYNC_CHECKS = {'http': checks.AsyncHTTPCheck, 'port': checks.AsyncPortCheck}
+
 NOTIFIERS = {'cachet': notifiers.CachetNotifier,
              'telegram': notifiers.TelegramNotifier,
              'postmark': notifiers.PostmarkNotifier}
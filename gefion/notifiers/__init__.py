@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """Contains different Notifier implementations, for notifying users."""
 
-from .base import Message, Notifier  # noqa: F401
+from .base import Message, Notifier, make_digest  # noqa: F401
 from .cachet import CachetNotifier  # noqa: F401
 from .postmark import PostmarkNotifier  # noqa: F401
 from .telegram import TelegramNotifier  # noqa: F401
@@ -8,9 +8,12 @@ class Message(object):
     Attributes:
         hostname (str): Identifying name of the host in question.
         result (gefion.checks.result): Result of the check.
+        changes (list): Tuples of hostname and result of every state change
+            in a digest, oldest first, None if not a digest. hostname and
+            result are then those of the latest change.
     """
 
-    def __init__(self, hostname, result):
+    def __init__(self, hostname, result, changes=None):
         """Initialise Check.
 
         Arguments:
@@ -18,6 +21,28 @@ class Message(object):
         """
         self.hostname = hostname
         self.result = result
+        self.changes = changes
+
+    @property
+    def digest(self):
+        """Return whether the message holds several state changes."""
+        return bool(self.changes) and len(self.changes) > 1
+
+
+def make_digest(changes):
+    """Make one Message of state changes.
+
+    Arguments:
+        changes (list): Tuples of hostname and gefion.checks.Result, oldest
+            first.
+
+    Returns:
+        Message: Plain Message if there is only one change.
+    """
+    hostname, result = changes[-1]
+    if len(changes) == 1:
+        return Message(hostname, result)
+    return Message(hostname, result, list(changes))
 
 
 class Notifier(object):
@@ -28,8 +53,12 @@ class Notifier(object):
     Attributes:
         message (gefion.notifiers.message): Message object for delivery.
         destination (str): Destination of the message.
+        batch_size (int): Most notifiers sent by one send_batch call. 1 if
+            the implementation does not send in batches.
     """
 
+    batch_size = 1
+
     def __init__(self, message, destination, **kwargs):
         """Initialise Check.
 
@@ -41,6 +70,17 @@ class Notifier(object):
         """
         self.message = message
 
+    def limits(self):
+        """Return the budgets a send of this notifier spends a token of.
+
+        Implementations of throttled APIs should override this.
+
+        Returns:
+            list: Tuples of key, rate in sends per second and burst. See
+                gefion.notifiers.limits.RateLimiter.
+        """
+        return list()
+
     def send(self):
         """Send the message to the destination.
 
@@ -50,3 +90,18 @@ class Notifier(object):
             bool: Successfulness of delivery.
         """
         raise NotImplementedError
+
+    @classmethod
+    def send_batch(cls, notifiers):
+        """Send messages of several notifiers of this class.
+
+        Implementations with an API for batches should override this and
+            batch_size.
+
+        Arguments:
+            notifiers (list): Notifiers of this class.
+
+        Returns:
+            list: Successfulness of delivery of each notifier.
+        """
+        return [notifier.send() for notifier in notifiers]
@@ -2,11 +2,15 @@
 """Contains CachetNotifier, the Cachet component updater."""
 
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
 import requests
 
 from gefion.notifiers import Notifier
+from gefion.notifiers.clients import CLIENTS, make_session
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -27,12 +31,53 @@ def make_component_url(api_endpoint, component_id):
     component_base = urljoin(api_endpoint, 'v1/components/')
     return urljoin(component_base, str(component_id))
 
+
+class ComponentStatusCache(object):
+    """Last known statuses of Cachet components, shared by all notifiers.
+
+    Attributes:
+        statuses (dict): Status and expiry time, keyed by component URL.
+    """
+
+    def __init__(self):
+        """Initialise ComponentStatusCache."""
+        self.statuses = dict()
+        self.lock = threading.Lock()
+
+    def get(self, component_url):
+        """Return unexpired status of a component, or None."""
+        with self.lock:
+            entry = self.statuses.get(component_url)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, component_url, status, ttl):
+        """Cache status of a component for ttl seconds."""
+        with self.lock:
+            self.statuses[component_url] = (status, time.monotonic() + ttl)
+
+    def invalidate(self, component_url=None):
+        """Forget status of a component, or of all if None."""
+        with self.lock:
+            if component_url is None:
+                self.statuses.clear()
+            else:
+                self.statuses.pop(component_url, None)
+
+
 class CachetNotifier(Notifier):
     """Updates Cachet components to up/down.
 
-    Cachet (cachethq.io) is a self-hosted status page software.
+    Cachet (cachethq.io) is a self-hosted status page software. Components
+        already known to have the status are not updated again.
+
+    Attributes:
+        batch_size (int): Most components updated concurrently.
     """
 
+    batch_size = 50
+
     def __init__(self, message, destination, **kwargs):
         """Initialise CachetNotifier.
 
@@ -43,8 +88,14 @@ class CachetNotifier(Notifier):
                 `/api/`.
             api_token (str): API token of a Cachet user of administrative
                 privileges.
+            status_ttl (float): Seconds the status of a component is trusted.
+                Default is 300.
+            refresh_on_miss (bool): Read the status of components not cached
+                from Cachet, to skip updates which change nothing. Default is
+                False.
         """
         api_endpoint = kwargs.get('api_endpoint', 'http://localhost/api/')
+        self.api_endpoint = api_endpoint
         self.component_url = make_component_url(api_endpoint, int(destination))
         logger.debug('Component API URL is %s.', self.component_url)
 
@@ -59,24 +110,91 @@ class CachetNotifier(Notifier):
         api_token = kwargs.get('api_token', 'invalidtoken')
         self.request_headers = {'X-Cachet-Token': api_token}
         logger.debug('Got API token %s.', api_token)
+        self.status_ttl = float(kwargs.get('status_ttl', 300))
+        self.refresh_on_miss = bool(kwargs.get('refresh_on_miss', False))
+
+    def current_status(self, session):
+        """Return known status of the component.
+
+        Arguments:
+            session (requests.Session): Pooled session of the endpoint.
+
+        Returns:
+            int: None if not cached, and not read from Cachet.
+        """
+        status = COMPONENT_STATUSES.get(self.component_url)
+        if status is not None or not self.refresh_on_miss:
+            return status
+        try:
+            r = session.get(self.component_url, headers=self.request_headers,
+                            timeout=15)
+            status = int(r.json()['data']['status'])
+        except (requests.exceptions.RequestException, ValueError, KeyError,
+                TypeError) as err:
+            logger.warning('Failed to read component at %s: %s.',
+                           self.component_url, str(err))
+            return None
+        COMPONENT_STATUSES.set(self.component_url, status, self.status_ttl)
+        return status
 
     def send(self):
-        """Update Cachet component.
+        """Update Cachet component with the pooled session of the endpoint.
 
         Returns:
-            bool: Successfulness of delivery.
+            bool: Successfulness of delivery, True if there was nothing to
+                update.
         """
+        session = CLIENTS.get('cachet', (self.api_endpoint, ), make_session)
+        if self.current_status(session) == self.request_data['status']:
+            logger.debug('Component at %s is already %s.', self.component_url,
+                         self.request_data['status'])
+            return True
         try:
-            r = requests.put(self.component_url,
-                             data=self.request_data,
-                             headers=self.request_headers,
-                             timeout=15)
+            r = session.put(self.component_url,
+                            data=self.request_data,
+                            headers=self.request_headers,
+                            timeout=15)
         except requests.exceptions.RequestException as err:
             logging.error('Caught requests exception: %s.', str(err))
+            COMPONENT_STATUSES.invalidate(self.component_url)
             return False
 
         if r.status_code == 200 and 'data' in r.json():
-            return True
             logging.info('Updated component at %s.', self.component_url)
-        else:
-            return False
+            COMPONENT_STATUSES.set(self.component_url,
+                                   self.request_data['status'],
+                                   self.status_ttl)
+            return True
+        COMPONENT_STATUSES.invalidate(self.component_url)
+        return False
+
+    @classmethod
+    def send_batch(cls, notifiers):
+        """Update components concurrently over pooled connections.
+
+        Notifiers of the same component are sent in order, so that the last
+            status wins.
+
+        Arguments:
+            notifiers (list): CachetNotifiers.
+
+        Returns:
+            list: Successfulness of delivery of each notifier.
+        """
+        components = dict()
+        for index, notifier in enumerate(notifiers):
+            components.setdefault(notifier.component_url, list()).append(index)
+
+        def send_component(indexes):
+            return [(index, notifiers[index].send()) for index in indexes]
+
+        sent = [False] * len(notifiers)
+        with ThreadPoolExecutor(min(len(components),
+                                    CLIENTS.pool_size)) as executor:
+            for results in executor.map(send_component, components.values()):
+                for index, success in results:
+                    sent[index] = success
+        return sent
+
+
+COMPONENT_STATUSES = ComponentStatusCache()
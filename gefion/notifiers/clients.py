@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Contains ClientRegistry, the process-wide pool of notifier API clients."""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from postmarker.core import PostmarkClient
+from telegram import Bot
+from telegram.utils.request import Request
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class ClientRegistry(object):
+    """Reuses notifier API clients, and their connections, across messages.
+
+    Clients are keyed by notifier type and credentials, so that each keeps
+        its keep-alive connections to the provider between notifications.
+        Clients idle for idle_timeout seconds are closed and forgotten.
+
+    Attributes:
+        idle_timeout (float): Seconds before an unused client is closed.
+        pool_size (int): Connections kept by each client.
+        clients (collections.OrderedDict): Client and last use time, keyed by
+            notifier type and credentials. Ordered from least to most
+            recently used.
+        created (int): Clients created.
+        reused (int): Lookups answered by an existing client.
+    """
+
+    def __init__(self, idle_timeout=300, pool_size=8):
+        """Initialise ClientRegistry.
+
+        Arguments:
+            See class attributes.
+        """
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size
+        self.clients = OrderedDict()
+        self.created = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def configure(self, idle_timeout=None, pool_size=None):
+        """Change limits of the registry.
+
+        Arguments:
+            See class attributes. Unchanged if None.
+        """
+        with self.lock:
+            self.idle_timeout = self.idle_timeout if idle_timeout is None \
+                else idle_timeout
+            self.pool_size = pool_size or self.pool_size
+
+    def get(self, notifier_name, credentials, factory):
+        """Return the client of a notifier type and credentials.
+
+        Arguments:
+            notifier_name (str): Type of the notifier, ex. `telegram`.
+            credentials (tuple): Values which tell clients apart, ex. tokens
+                and API endpoints.
+            factory (callable): Called with pool_size to create a missing
+                client.
+
+        Returns:
+            Client made by factory.
+        """
+        key = (notifier_name, ) + tuple(credentials)
+        now = time.monotonic()
+        with self.lock:
+            idle = self.evict(now)
+            entry = self.clients.get(key)
+            if entry is None:
+                entry = self.clients[key] = [factory(self.pool_size), now]
+                self.created += 1
+                logger.debug('Created %s client.', notifier_name)
+            else:
+                entry[1] = now
+                self.clients.move_to_end(key)
+                self.reused += 1
+        for client in idle:
+            close_client(client)
+        return entry[0]
+
+    def evict(self, now):
+        """Forget clients idle for longer than idle_timeout.
+
+        Called with the lock held.
+
+        Returns:
+            list: Forgotten clients, to be closed.
+        """
+        idle = list()
+        while self.clients:
+            key, (client, last_used) = next(iter(self.clients.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            del self.clients[key]
+            idle.append(client)
+        return idle
+
+    def clear(self):
+        """Close and forget all clients."""
+        with self.lock:
+            clients = [client for client, _ in self.clients.values()]
+            self.clients.clear()
+        for client in clients:
+            close_client(client)
+
+    @property
+    def api_serialised(self):
+        """Return serialisable statistics."""
+        return {'clients': len(self.clients),
+                'created': self.created,
+                'reused': self.reused}
+
+
+def close_client(client):
+    """Close connections of a client made by a factory below."""
+    try:
+        if isinstance(client, Bot):
+            client.request.stop()
+        elif isinstance(client, PostmarkClient):
+            client.session.close()
+        else:
+            client.close()
+    except Exception:
+        logger.exception('Failed to close notifier client.')
+
+
+def make_bot(token):
+    """Return factory of Telegram bots with pooled connections."""
+    def factory(pool_size):
+        return Bot(token, request=Request(con_pool_size=pool_size))
+    return factory
+
+
+def make_postmark_client(server_token, api_url):
+    """Return factory of Postmark clients with pooled connections."""
+    def factory(pool_size):
+        client = PostmarkClient(server_token=server_token,
+                                root_api_url=api_url)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        client.session.mount('http://', adapter)
+        client.session.mount('https://', adapter)
+        return client
+    return factory
+
+
+def make_session(pool_size):
+    """Return requests session with pooled connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+CLIENTS = ClientRegistry()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Contains RateLimiter, the token buckets of notifier API budgets."""
+
+import hashlib
+import logging
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Refills and takes a token of the bucket hash at KEYS[1] atomically, given
+# rate and burst as ARGV. Returns seconds until the token is refilled, as a
+# string since Redis truncates Lua numbers to integers. Time is Redis' own, so
+# that clocks of master processes do not matter.
+RESERVE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate) - 1
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens),
+           'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1],
+           math.ceil((burst - tokens) / rate * 1000) + 1000)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+
+class TokenBucket(object):
+    """Holds up to burst tokens, refilled at rate tokens per second.
+
+    Callers reserve a token and wait until it is theirs. Tokens not yet
+        refilled are owed, so callers are released in the order they
+        reserved, and none is turned away.
+
+    Attributes:
+        rate (float): Tokens refilled per second.
+        burst (float): Most tokens held.
+        tokens (float): Tokens held at updated, negative if owed.
+        updated (float): Monotonic time of the last reservation.
+    """
+
+    def __init__(self, rate, burst):
+        """Initialise full TokenBucket.
+
+        Arguments:
+            See class attributes.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, now=None):
+        """Take a token, owing it if none is held.
+
+        Arguments:
+            now (float): Monotonic time. Defaults to now.
+
+        Returns:
+            float: Seconds until the token is refilled, 0 if held.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def full(self, now):
+        """Return whether the bucket has refilled to burst."""
+        with self.lock:
+            return self.tokens + (now - self.updated) * self.rate >= \
+                self.burst
+
+
+class RedisTokenBucket(object):
+    """TokenBucket kept in Redis, shared by all processes using it.
+
+    Falls back to a TokenBucket of this process while Redis fails, so that
+        notifications are delayed by Redis failures no more than by budgets.
+
+    Attributes:
+        rate (float): Tokens refilled per second.
+        burst (float): Most tokens held.
+        redis_key (str): Redis key of the bucket hash.
+        script (redis.commands.core.Script): RESERVE_SCRIPT registered with
+            the Redis connection.
+        local (TokenBucket): Fallback bucket.
+    """
+
+    def __init__(self, rate, burst, redis_key, script):
+        """Initialise RedisTokenBucket.
+
+        Arguments:
+            See class attributes.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.redis_key = redis_key
+        self.script = script
+        self.local = TokenBucket(rate, burst)
+
+    def reserve(self, now=None):
+        """Take a token, owing it if none is held. See TokenBucket.reserve.
+
+        Arguments:
+            now (float): Monotonic time of the fallback bucket.
+
+        Returns:
+            float: Seconds until the token is refilled, 0 if held.
+        """
+        try:
+            return float(self.script(keys=[self.redis_key],
+                                     args=[self.rate, self.burst]))
+        except RedisError:
+            logger.exception('Failed to reserve shared notifier budget.')
+            return self.local.reserve(now)
+
+    def full(self, now):
+        """Return True, as nothing but the fallback is held in memory."""
+        return True
+
+
+class RateLimiter(object):
+    """Token buckets keyed by notifier type, credentials and destination.
+
+    Buckets are kept in memory, and so are budgets of this process alone,
+        unless a Redis connection is configured. With Redis, all processes
+        sharing it spend the same buckets, so a provider's budget holds
+        however many master workers run.
+
+    Attributes:
+        buckets (dict): TokenBuckets or RedisTokenBuckets by key.
+        redis (redis.Redis): Connection keeping the buckets, None to keep
+            them in memory.
+        prefix (str): Prefix of Redis keys.
+        maxsize (int): Buckets kept before full ones are forgotten. A full
+            bucket is no different from a new one.
+        acquired (int): Sends let through.
+        delayed (int): Sends which waited for tokens.
+        waited (float): Seconds waited by all sends.
+    """
+
+    def __init__(self, maxsize=10000, redis=None, prefix='gefion:'):
+        """Initialise RateLimiter.
+
+        Arguments:
+            See class attributes.
+        """
+        self.buckets = dict()
+        self.maxsize = maxsize
+        self.prefix = prefix
+        self.acquired = 0
+        self.delayed = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+        self.configure(redis)
+
+    def configure(self, redis=None, prefix=None):
+        """Keep buckets in Redis, or in memory again, forgetting all.
+
+        Arguments:
+            See class attributes. prefix is unchanged if None.
+        """
+        with self.lock:
+            self.redis = redis
+            self.prefix = prefix or self.prefix
+            self.script = redis.register_script(RESERVE_SCRIPT) if redis \
+                else None
+            self.buckets.clear()
+
+    def redis_key(self, key):
+        """Return Redis key of the bucket of a key, hiding credentials."""
+        return '{}limit:{}'.format(
+            self.prefix, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def bucket(self, key, rate, burst):
+        """Return the bucket of a key, creating it if missing."""
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None or (bucket.rate, bucket.burst) != (rate, burst):
+                if len(self.buckets) >= self.maxsize:
+                    now = time.monotonic()
+                    for full_key in [full_key for full_key, full_bucket
+                                     in self.buckets.items()
+                                     if full_bucket.full(now)]:
+                        del self.buckets[full_key]
+                bucket = self.buckets[key] = RedisTokenBucket(
+                    rate, burst, self.redis_key(key), self.script) \
+                    if self.redis else TokenBucket(rate, burst)
+            return bucket
+
+    def acquire(self, limits):
+        """Wait until a send fits all its budgets.
+
+        Arguments:
+            limits (list): Tuples of key, rate and burst. Limits without a
+                rate are ignored.
+
+        Returns:
+            float: Seconds waited.
+        """
+        now = time.monotonic()
+        wait = max([self.bucket(key, rate, burst or 1).reserve(now)
+                    for key, rate, burst in limits if rate] or [0.0])
+        with self.lock:
+            self.acquired += 1
+            if wait:
+                self.delayed += 1
+                self.waited += wait
+        if wait:
+            logger.debug('Waiting %.2f seconds for notifier budget.', wait)
+            time.sleep(wait)
+        return wait
+
+    def clear(self):
+        """Forget all buckets and statistics."""
+        with self.lock:
+            self.buckets.clear()
+            self.acquired = 0
+            self.delayed = 0
+            self.waited = 0.0
+
+    @property
+    def api_serialised(self):
+        """Return serialisable statistics."""
+        return {'buckets': len(self.buckets),
+                'shared': self.redis is not None,
+                'acquired': self.acquired,
+                'delayed': self.delayed,
+                'waited': self.waited}
+
+
+LIMITER = RateLimiter()
@@ -4,10 +4,12 @@
 import logging
 from datetime import datetime
 
-from postmarker.core import PostmarkClient
+import requests
+from postmarker.core import DEFAULT_API
 from postmarker.exceptions import PostmarkerException
 
 from gefion.notifiers import Notifier
+from gefion.notifiers.clients import CLIENTS, make_postmark_client
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -16,6 +18,9 @@ logger.setLevel(logging.DEBUG)
 def make_template_model(message, up_text='UP', down_text='DOWN'):
     """Make Postmark template model.
 
+    Digests are modelled after their latest change, and also list every
+        change as `changes`, with their `count`.
+
     Arguments:
         message (gefion.notifier.message): Message object for delivery.
         up_text (str): Text to describe up status. Default is "UP".
@@ -24,14 +29,35 @@ def make_template_model(message, up_text='UP', down_text='DOWN'):
     Returns:
         dict: Postmark template model.
     """
-    name = message.hostname
-    if message.result.availability:
+    model = make_change_model(message.hostname, message.result, up_text,
+                              down_text)
+    if message.digest:
+        model['count'] = len(message.changes)
+        model['changes'] = [
+            make_change_model(hostname, result, up_text, down_text)
+            for hostname, result in message.changes]
+    return model
+
+
+def make_change_model(hostname, result, up_text='UP', down_text='DOWN'):
+    """Make Postmark template model of a state change.
+
+    Arguments:
+        hostname (str): Identifying name of the host in question.
+        result (gefion.checks.Result): Result of the check.
+        up_text (str): Text to describe up status. Default is "UP".
+        down_text (str): Text to describe down status. Default is "DOWN".
+
+    Returns:
+        dict: With `name`, `availability` and `time_string`.
+    """
+    if result.availability:
         availability = up_text
     else:
         availability = down_text
-    time_string = datetime.utcfromtimestamp(message.result.timestamp).strftime(
+    time_string = datetime.utcfromtimestamp(result.timestamp).strftime(
         '%Y-%m-%dT%H:%M:%SZ')
-    return {'name': name,
+    return {'name': hostname,
             'availability': availability,
             'time_string': time_string}
 
@@ -41,8 +67,13 @@ class PostmarkNotifier(Notifier):
 
     Postmark (postmarkapp.com) is a commercial transactional email service
         provider.
+
+    Attributes:
+        batch_size (int): Most emails of one batch API call.
     """
 
+    batch_size = 500
+
     def __init__(self, message, destination, **kwargs):
         """Initialise PostmarkNotifier.
 
@@ -55,12 +86,26 @@ class PostmarkNotifier(Notifier):
             template_id (int): Postmark template ID.
             up_text (str): Text to describe up status. Default is "UP".
             down_text (str): Text to describe down status. Default is "DOWN".
+            api_url (str): Root URL of the Postmark API. Default is
+                Postmark's.
+            rate (float): Emails per second to a destination. Default is
+                unlimited.
+            burst (int): Emails to a destination sent before rate applies.
+            token_rate (float): Emails per second of the server token.
+                Default is unlimited.
+            token_burst (int): Emails of the server token sent before
+                token_rate applies.
         """
         self.destination = destination
         self.server_token = kwargs.get('server_token',
                                        'replace-this-in-config')
         self.from_address = kwargs.get('from_address', 'test@example.invalid')
         self.template_id = kwargs.get('template_id', 1200342)
+        self.api_url = kwargs.get('api_url', DEFAULT_API)
+        self.rate = kwargs.get('rate')
+        self.burst = kwargs.get('burst', 1)
+        self.token_rate = kwargs.get('token_rate')
+        self.token_burst = kwargs.get('token_burst', 1)
 
         up_text = kwargs.get('up_text', 'UP')
         down_text = kwargs.get('down_text', 'DOWN')
@@ -70,19 +115,74 @@ class PostmarkNotifier(Notifier):
         super().__init__(message, destination)
 
     def send(self):
-        """Send email with Postmark.
+        """Send email with the pooled Postmark client of the token.
 
         Returns:
             bool: Successfulness of delivery.
         """
-        postmark = PostmarkClient(token=self.server_token)
+        postmark = CLIENTS.get(
+            'postmark', (self.server_token, self.api_url),
+            make_postmark_client(self.server_token, self.api_url))
         try:
-            postmark.emails.send_with_template(
-                TemplateId=self.template_id,
-                TemplateModel=self.template_model,
-                From=self.from_address,
-                To=self.destination)
+            postmark.emails.send_with_template(**self.make_email())
         except PostmarkerException:
             return False
         logger.info('Sent message to email %s.', self.destination)
         return True
+
+    def limits(self):
+        """Return budgets of the destination and of the server token."""
+        return [(('postmark', self.server_token), self.token_rate,
+                 self.token_burst),
+                (('postmark', self.server_token, self.destination),
+                 self.rate, self.burst)]
+
+    def make_email(self):
+        """Return the email as a message of the Postmark API."""
+        return {'TemplateId': self.template_id,
+                'TemplateModel': self.template_model,
+                'From': self.from_address,
+                'To': self.destination}
+
+    @classmethod
+    def send_batch(cls, notifiers):
+        """Send emails with batch API calls of up to batch_size emails.
+
+        Emails are batched per server token and API URL. Postmark accepts or
+            rejects each email of a batch separately.
+
+        Arguments:
+            notifiers (list): PostmarkNotifiers.
+
+        Returns:
+            list: Successfulness of delivery of each notifier.
+        """
+        sent = [False] * len(notifiers)
+        groups = dict()
+        for index, notifier in enumerate(notifiers):
+            groups.setdefault((notifier.server_token, notifier.api_url),
+                              list()).append(index)
+        for (server_token, api_url), indexes in groups.items():
+            postmark = CLIENTS.get('postmark', (server_token, api_url),
+                                   make_postmark_client(server_token,
+                                                        api_url))
+            for start in range(0, len(indexes), cls.batch_size):
+                batch = indexes[start:start + cls.batch_size]
+                try:
+                    responses = postmark.emails.send_template_batch(
+                        *(notifiers[index].make_email() for index in batch))
+                except (PostmarkerException,
+                        requests.exceptions.RequestException) as err:
+                    logger.error('Failed to send batch of %d emails: %s.',
+                                 len(batch), str(err))
+                    continue
+                for index, response in zip(batch, responses):
+                    if response.get('ErrorCode') == 0:
+                        sent[index] = True
+                        continue
+                    logger.error('Failed to send message to email %s: %s.',
+                                 notifiers[index].destination,
+                                 response.get('Message'))
+        logger.info('Sent %d of %d messages to emails in batches.',
+                    sum(sent), len(notifiers))
+        return sent
@@ -2,17 +2,41 @@
 """Contains TelegramNotifier."""
 
 import logging
+import time
 from datetime import datetime
 
-from telegram import Bot, ParseMode
-from telegram.error import TelegramError
+from telegram import ParseMode
+from telegram.error import RetryAfter, TelegramError
 
 from gefion.notifiers import Notifier
+from gefion.notifiers.clients import CLIENTS, make_bot
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+def format_change(hostname, result, **kwargs):
+    """Format a state change with the up or down template.
+
+    Arguments:
+        hostname (str): Identifying name of the host in question.
+        result (gefion.checks.Result): Result of the check.
+        kwargs: Templates, see TelegramNotifier.
+
+    Returns:
+        str
+    """
+    if result.availability:
+        template = kwargs.get('up_template', '*{host}* is *UP* at {time}.')
+    else:
+        template = kwargs.get('down_template',
+                              '*{host}* is *DOWN* at {time}. Msg: {message}')
+    time_formatted = datetime.utcfromtimestamp(result.timestamp).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+    return template.format(host=hostname, time=time_formatted,
+                           message=result.message)
+
+
 class TelegramNotifier(Notifier):
     """Notifies Telegram contacts.
 
@@ -35,42 +59,75 @@ class TelegramNotifier(Notifier):
             up_template (str): Up message templates. Variables `host`, `time.`
             down_template (str): Down message templates. Variables `host`,
                 `time` and `message.`
+            digest_template (str): First line of digests, followed by a line
+                per change. Variables `count`, `down` and `up`.
+            rate (float): Messages per second to a chat. Default is 1.
+            burst (int): Messages to a chat sent before rate applies.
+                Default is 3.
+            token_rate (float): Messages per second of the bot. Default is
+                30.
+            token_burst (int): Messages of the bot sent before token_rate
+                applies. Default is 30.
+            max_retry_after (int): Most times a message throttled by Telegram
+                is sent again, after the wait it asks for. Default is 3.
         """
         self.token = kwargs.get('token', '0:invalidtoken')
         self.destination = destination
-
-        if message.result.availability:
-            template = kwargs.get('up_template', '*{host}* is *UP* at {time}.')
-        else:
-            template = kwargs.get(
-                'down_template',
-                '*{host}* is *DOWN* at {time}. Msg: {message}')
-        time_formatted = datetime.utcfromtimestamp(
-            message.result.timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
-        self.text = template.format(host=message.hostname,
-                                    time=time_formatted,
-                                    message=message.result.message)
+        self.rate = kwargs.get('rate', 1)
+        self.burst = kwargs.get('burst', 3)
+        self.token_rate = kwargs.get('token_rate', 30)
+        self.token_burst = kwargs.get('token_burst', 30)
+        self.max_retry_after = kwargs.get('max_retry_after', 3)
+
+        lines = [format_change(hostname, result, **kwargs)
+                 for hostname, result in message.changes or
+                 [(message.hostname, message.result)]]
+        if message.digest:
+            up = sum(1 for _, result in message.changes
+                     if result.availability)
+            header = kwargs.get(
+                'digest_template',
+                '*{count} state changes*, {down} down and {up} up:')
+            lines.insert(0, header.format(count=len(message.changes),
+                                          down=len(message.changes) - up,
+                                          up=up))
+        self.text = '\n'.join(lines)
         logger.debug('Message is "%s".', self.text)
 
         super().__init__(message, destination)
 
+    def limits(self):
+        """Return budgets of the chat and of the bot."""
+        return [(('telegram', self.token), self.token_rate, self.token_burst),
+                (('telegram', self.token, str(self.destination)), self.rate,
+                 self.burst)]
+
     def send(self):
-        """Initialise Telegram bot and send message with Bot API.
+        """Send message with Bot API, through the pooled bot of the token.
 
         Returns:
             bool: Successfulness of delivery.
         """
         logger.debug('Sending message to chat %s.', self.destination)
-        try:
-            logger.debug('Initialising bot with token %s.', self.token)
-            bot = Bot(self.token)
-            bot.sendMessage(chat_id=int(self.destination),
-                            text=self.text,
-                            parse_mode=ParseMode.MARKDOWN)
-
-        except TelegramError as err:
-            logger.error('Caught Telegram error: %s', str(err))
-            return False
+        for retry in range(self.max_retry_after + 1):
+            try:
+                bot = CLIENTS.get('telegram', (self.token, ),
+                                  make_bot(self.token))
+                bot.sendMessage(chat_id=int(self.destination),
+                                text=self.text,
+                                parse_mode=ParseMode.MARKDOWN)
+                break
+            except RetryAfter as err:
+                if retry == self.max_retry_after:
+                    logger.error('Gave up throttled message to chat %s.',
+                                 self.destination)
+                    return False
+                logger.warning('Throttled by Telegram, waiting %s seconds.',
+                               err.retry_after)
+                time.sleep(err.retry_after)
+            except TelegramError as err:
+                logger.error('Caught Telegram error: %s', str(err))
+                return False
 
         logger.info('Sent message to chat %s.', self.destination)
         return True
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Batched result reporting from workers to master."""
+
+import logging
+import threading
+from urllib.parse import urljoin
+
+import requests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class ResultBuffer(object):
+    """Buffers results and submits them to master's `/results` in batches.
+
+    A batch is flushed once it reaches batch_size, or max_delay seconds after
+        its first result, whichever is sooner. Batches are sent over one
+        keep-alive session by a background thread.
+
+    Attributes:
+        reporting_url (str): URL of the master's bulk result endpoint.
+        batch_size (int): Results per batch.
+        max_delay (float): Longest a result waits in the buffer, in seconds.
+        max_pending (int): Results kept for resubmission while the master is
+            unreachable. Oldest results are dropped beyond this.
+        session (requests.Session): Session used for submissions.
+        pending (list): Buffered results, serialised for the API.
+    """
+
+    def __init__(self, endpoint_url, batch_size=100, max_delay=1,
+                 max_pending=100000, session=None):
+        """Initialise ResultBuffer and start its flushing thread.
+
+        Arguments:
+            endpoint_url (str): Endpoint URL of master.
+            batch_size (int): Results per batch.
+            max_delay (float): Longest a result waits in the buffer, in
+                seconds.
+            max_pending (int): Results kept for resubmission while the master
+                is unreachable.
+            session (requests.Session): Session to use. A new one is created
+                by default.
+        """
+        self.reporting_url = urljoin(endpoint_url, 'results')
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.session = session or requests.Session()
+        self.pending = list()
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, monitor_id, unique_id, result):
+        """Buffer a result for submission.
+
+        Arguments:
+            monitor_id (str): Database ID of the Monitor.
+            unique_id (str): UUID of the version.
+            result (gefion.checks.Result): Result of the check.
+        """
+        with self.condition:
+            self.pending.append({'id': monitor_id,
+                                 'unique_id': unique_id,
+                                 'result': result.api_serialised})
+            if len(self.pending) == 1 or \
+                    len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def submit(self, batch):
+        """Submit a batch to master.
+
+        Arguments:
+            batch (list): Results serialised for the API.
+
+        Replies which are not a JSON object, such as the error page of a
+            proxy, count as failed submissions.
+
+        Returns:
+            bool: Success of submission.
+        """
+        try:
+            r = self.session.post(self.reporting_url,
+                                  json={'results': batch},
+                                  timeout=15)
+            if r.status_code != 200:
+                logger.error('Master rejected batch with status %d.',
+                             r.status_code)
+                return False
+            reply = r.json()
+        except (requests.exceptions.RequestException, ValueError) as err:
+            logger.error('Failed to submit %d results: %s.', len(batch),
+                         str(err))
+            return False
+        if not isinstance(reply, dict):
+            logger.error('Master replied to batch with %s.', reply)
+            return False
+        rejected = reply.get('rejected')
+        if rejected:
+            logger.warning('Master rejected results of monitors %s.',
+                           rejected)
+        return True
+
+    def flush(self):
+        """Submit everything buffered, keeping failed batches for later.
+
+        Returns:
+            int: Number of results submitted.
+        """
+        with self.condition:
+            pending, self.pending = self.pending, list()
+        submitted = 0
+        for index in range(0, len(pending), self.batch_size):
+            batch = pending[index:index + self.batch_size]
+            if not self.submit(batch):
+                with self.condition:
+                    self.pending = (pending[index:] + self.pending)[
+                        -self.max_pending:]
+                break
+            submitted += len(batch)
+        return submitted
+
+    def run(self):
+        """Flush batches when full or due, until closed."""
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                if len(self.pending) < self.batch_size:
+                    self.condition.wait(self.max_delay)
+            if not self.flush():
+                with self.condition:  # Back off while master is unreachable.
+                    self.condition.wait(self.max_delay)
+
+    def close(self):
+        """Stop the flushing thread and submit what is left."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+        self.session.close()
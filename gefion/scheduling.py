@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Scheduling helpers shared by worker runtimes."""
+
+import heapq
+import itertools
+import logging
+import threading
+import zlib
+from collections import deque
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def monitor_interval(monitor):
+    """Return the interval of a Monitor in seconds.
+
+    The seconds-resolution `interval` takes precedence over `frequency`,
+        which is in minutes.
+
+    Arguments:
+        monitor (dict): Monitor as served by the master.
+
+    Returns:
+        int
+    """
+    return monitor.get('interval') or monitor['frequency'] * 60
+
+
+def phase_offset(monitor_id, interval):
+    """Return the stable phase of a Monitor within its interval.
+
+    The phase is derived from a hash of the Monitor ID, so that Monitors of
+        the same interval are spread evenly and keep their phase across syncs
+        and restarts.
+
+    Arguments:
+        monitor_id (int): Database ID of the Monitor.
+        interval (float): Interval of the Monitor in seconds.
+
+    Returns:
+        float: Offset from the epoch-aligned interval start, in seconds.
+    """
+    digest = zlib.crc32(str(monitor_id).encode('utf-8')) & 0xffffffff
+    return digest / 2 ** 32 * interval
+
+
+def phase_delay(monitor_id, interval, timestamp):
+    """Return the time until the next phase-aligned run of a Monitor.
+
+    Arguments:
+        monitor_id (int): Database ID of the Monitor.
+        interval (float): Interval of the Monitor in seconds.
+        timestamp (float): Current UNIX timestamp.
+
+    Returns:
+        float: Seconds until the next run, from 0 up to the interval.
+    """
+    return (phase_offset(monitor_id, interval) - timestamp) % interval
+
+
+def next_run_delay(monitor_id, interval, timestamp):
+    """Return the time from a run until the next run of a Monitor.
+
+    Slots closer than half an interval are skipped, so that a run which
+        started early or late does not fire twice in a row.
+
+    Arguments:
+        monitor_id (int): Database ID of the Monitor.
+        interval (float): Interval of the Monitor in seconds.
+        timestamp (float): UNIX timestamp of the current run.
+
+    Returns:
+        float: Seconds until the next run.
+    """
+    delay = phase_delay(monitor_id, interval, timestamp)
+    return delay + interval if delay < interval / 2 else delay
+
+
+def load_histogram(monitors, window=None):
+    """Count runs per second of the phase-spread schedule.
+
+    Arguments:
+        monitors (list): Monitors as served by the master.
+        window (int): Seconds to cover, from an epoch-aligned start. Defaults
+            to the longest interval of the Monitors.
+
+    Returns:
+        list: Number of runs starting in each second of the window.
+    """
+    intervals = [(monitor['id'], monitor_interval(monitor))
+                 for monitor in monitors]
+    if window is None:
+        window = int(max((interval for _, interval in intervals), default=0))
+    histogram = [0] * window
+    for monitor_id, interval in intervals:
+        run = phase_offset(monitor_id, interval)
+        while run < window:
+            histogram[int(run)] += 1
+            run += interval
+    return histogram
+
+
+def log_load(monitors):
+    """Log a summary of the per-second load of Monitors.
+
+    Arguments:
+        monitors (list): Monitors as served by the master.
+
+    Returns:
+        list: The load histogram, as by load_histogram.
+    """
+    histogram = load_histogram(monitors)
+    if histogram:
+        logger.info('Load over %ds window: peak %d, mean %.2f runs/s.',
+                    len(histogram), max(histogram),
+                    sum(histogram) / len(histogram))
+    return histogram
+
+
+class TimerHeap(object):
+    """Due times keyed by Monitor ID, ordered in a binary heap.
+
+    Pushing a key again supersedes its previous entry, which is skipped when
+        it surfaces. Pushes and pops are O(log n), so tens of thousands of
+        Monitors can be scheduled at sub-second precision.
+
+    Attributes:
+        heap (list): Heap of due time, sequence number and key.
+        entries (dict): Live due time, value and sequence number, keyed by
+            key.
+    """
+
+    def __init__(self):
+        """Initialise TimerHeap."""
+        self.heap = list()
+        self.entries = dict()
+        self.counter = itertools.count()
+
+    def __len__(self):
+        """Return number of live entries."""
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """Return whether a key is scheduled."""
+        return key in self.entries
+
+    def push(self, key, due, value=None):
+        """Schedule key, replacing its previous entry.
+
+        Arguments:
+            key: Key of the entry, usually a Monitor ID.
+            due (float): Due time.
+            value: Additional value kept with the entry.
+        """
+        sequence = next(self.counter)
+        self.entries[key] = (due, value, sequence)
+        heapq.heappush(self.heap, (due, sequence, key))
+
+    def get(self, key):
+        """Return due time and value of a key.
+
+        Arguments:
+            key: Key of the entry.
+
+        Returns:
+            tuple: Due time and value, or None if not scheduled.
+        """
+        entry = self.entries.get(key)
+        return entry[:2] if entry else None
+
+    def remove(self, key):
+        """Unschedule key, if scheduled.
+
+        Arguments:
+            key: Key of the entry.
+        """
+        self.entries.pop(key, None)
+
+    def prune(self):
+        """Drop superseded entries from the top of the heap."""
+        while self.heap:
+            due, sequence, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry and entry[2] == sequence:
+                return
+            heapq.heappop(self.heap)
+
+    def next_due(self):
+        """Return the earliest due time, or None if empty."""
+        self.prune()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """Remove and return entries due by now, earliest first.
+
+        Arguments:
+            now (float): Current time.
+
+        Returns:
+            list: Tuples of key, due time and value.
+        """
+        due_entries = list()
+        while self.next_due() is not None and self.heap[0][0] <= now:
+            due, _, key = heapq.heappop(self.heap)
+            due_entries.append((key, due, self.entries.pop(key)[1]))
+        return due_entries
+
+
+class LagStats(object):
+    """Lateness of scheduled runs relative to their due times.
+
+    Attributes:
+        runs (int): Number of recorded runs.
+        max_lag (float): Largest lag, in seconds.
+        recent (collections.deque): Most recent lags, for percentiles.
+    """
+
+    def __init__(self, window=10000):
+        """Initialise LagStats.
+
+        Arguments:
+            window (int): Number of recent lags kept for percentiles.
+        """
+        self.runs = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.recent = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, lag):
+        """Record the lag of a run.
+
+        Arguments:
+            lag (float): Seconds between due time and actual start.
+        """
+        with self.lock:
+            self.runs += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            self.recent.append(lag)
+
+    def percentile(self, fraction):
+        """Return a percentile of recent lags.
+
+        Arguments:
+            fraction (float): Percentile as a fraction, ex. 0.99.
+
+        Returns:
+            float: Lag in seconds, 0 if nothing was recorded.
+        """
+        with self.lock:
+            recent = sorted(self.recent)
+        if not recent:
+            return 0.0
+        return recent[min(len(recent) - 1, int(fraction * len(recent)))]
+
+    @property
+    def api_serialised(self):
+        """Return serialisable statistics."""
+        return {'runs': self.runs,
+                'mean_lag': self.total_lag / self.runs if self.runs else 0.0,
+                'p99_lag': self.percentile(0.99),
+                'max_lag': self.max_lag}
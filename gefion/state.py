@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""Hot Monitor state and write-behind Monitor updates of master jobs."""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+from redis import Redis
+from sqlalchemy import bindparam, update
+
+from gefion.database import get_session_factory
+from gefion.history import DAY, HOUR, MINUTE, compact, record_results
+from gefion.models import Monitor
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# State caches keyed by Redis host and port, and state writers keyed by
+# database URI, created once per process.
+STATE_CACHES = dict()
+STATE_WRITERS = dict()
+caches_lock = threading.Lock()
+
+# Set by processes which outlive their jobs, ex. run_master_worker.py. Only
+# these write behind; a forking rq worker ends each job with os._exit, which
+# runs neither the flushing thread nor atexit, so its jobs write before ending.
+WRITE_BEHIND = threading.Event()
+
+
+class StateCache(object):
+    """Last availability and message of Monitors, kept in Redis.
+
+    Results which change neither need not be read from or written to the
+        database right away. Entries expire after ttl seconds, so that
+        Monitors changed outside of process_result are read from the
+        database again.
+
+    Attributes:
+        redis (redis.Redis): Connection shared by all job workers.
+        ttl (int): Seconds a state is trusted.
+        prefix (str): Prefix of Redis keys.
+    """
+
+    def __init__(self, redis, ttl=3600, prefix='gefion:'):
+        """Initialise StateCache.
+
+        Arguments:
+            See class attributes.
+        """
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def state_key(self, monitor_id):
+        """Return Redis key of the state of a Monitor."""
+        return '{}state:{}'.format(self.prefix, monitor_id)
+
+    def get(self, monitor_id):
+        """Return cached state of a Monitor.
+
+        Arguments:
+            monitor_id (int): Database ID of the Monitor.
+
+        Returns:
+            tuple: Last availability and message, None if not cached.
+        """
+        state = self.redis.get(self.state_key(monitor_id))
+        return tuple(json.loads(state)) if state is not None else None
+
+    def set(self, monitor_id, availability, message):
+        """Cache state of a Monitor.
+
+        Arguments:
+            monitor_id (int): Database ID of the Monitor.
+            availability (bool): Last availability.
+            message (str): Last message.
+        """
+        self.redis.set(self.state_key(monitor_id),
+                       json.dumps([availability, message]), ex=self.ttl)
+
+
+class StateWriter(object):
+    """Coalesces Monitor updates and writes them behind in bulk.
+
+    Updates of the same Monitor are merged, latest values winning. Pending
+        updates and result history are written in one transaction of bulk
+        statements once batch_size Monitors or results are pending, or
+        flush_interval seconds after the first, whichever is sooner. Whatever
+        is pending is written on close, which is also registered to run at
+        exit. History beyond retention is compacted every compact_interval
+        seconds. Without background, nothing is written behind and jobs
+        write what they queued with end_job.
+
+    Attributes:
+        session_factory (sqlalchemy.orm.sessionmaker): Session factory of the
+            database.
+        flush_interval (float): Longest an update waits, in seconds.
+        batch_size (int): Pending Monitors which trigger a flush.
+        pending (dict): Columns to update, keyed by Monitor ID.
+        history (list): Tuples of Monitor ID and gefion.checks.Result to
+            append to the result history.
+        retention (dict): Days of history to keep. See
+            gefion.history.compact.
+        compact_interval (float): Seconds between compactions.
+        background (bool): Whether a thread flushes behind the jobs.
+        pid (int): Process which created the writer.
+        stats_interval (float): Seconds between stats logs.
+        updates (int): Updates added.
+        rows (int): Monitor rows written.
+        results (int): Results appended to the history.
+        commits (int): Transactions committed.
+    """
+
+    def __init__(self, session_factory, flush_interval=1, batch_size=1000,
+                 stats_interval=60, retention=None, compact_interval=3600,
+                 background=True):
+        """Initialise StateWriter and start its flushing thread if background.
+
+        Arguments:
+            See class attributes.
+        """
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.stats_interval = stats_interval
+        self.retention = retention
+        self.compact_interval = compact_interval
+        self.background = background
+        self.pid = os.getpid()
+        self.pending = dict()
+        self.history = list()
+        self.updates = 0
+        self.rows = 0
+        self.results = 0
+        self.commits = 0
+        self.started = self.last_stats = time.monotonic()
+        self.last_compact = self.started
+        self.closed = False
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def add(self, monitor_id, **columns):
+        """Queue an update of a Monitor.
+
+        Arguments:
+            monitor_id (int): Database ID of the Monitor.
+            columns: Values of Monitor columns, ex. `last_updated`.
+        """
+        with self.condition:
+            self.pending.setdefault(monitor_id, dict()).update(columns)
+            self.updates += 1
+            self.notify_pending()
+
+    def record(self, monitor_id, result):
+        """Queue a result for the result history.
+
+        Arguments:
+            monitor_id (int): Database ID of the Monitor.
+            result (gefion.checks.Result): Result of the check.
+        """
+        with self.condition:
+            self.history.append((monitor_id, result))
+            self.notify_pending()
+
+    def backlog(self):
+        """Return the larger of pending Monitors and pending results."""
+        return max(len(self.pending), len(self.history))
+
+    def notify_pending(self):
+        """Wake the flushing thread on the first or batch_size-th pending."""
+        if len(self.pending) + len(self.history) == 1 or \
+                self.backlog() >= self.batch_size:
+            self.condition.notify()
+
+    def flush(self, raise_errors=False):
+        """Write pending updates and history in one transaction.
+
+        Both are kept for the next flush if the transaction fails.
+
+        Arguments:
+            raise_errors (bool): Whether to raise why the transaction failed.
+
+        Returns:
+            int: Number of Monitor rows and results written.
+        """
+        with self.flush_lock:
+            with self.condition:
+                pending, self.pending = self.pending, dict()
+                history, self.history = self.history, list()
+            if not pending and not history:
+                return 0
+            # Rows with the same columns are written by one executemany.
+            groups = dict()
+            for monitor_id, columns in pending.items():
+                groups.setdefault(tuple(sorted(columns)), list()).append(
+                    dict(columns, monitor_id=monitor_id))
+            session = self.session_factory()
+            try:
+                # Core executemany, so Monitors deleted meanwhile match no
+                # row rather than failing the whole batch.
+                table = Monitor.__table__
+                for rows in groups.values():
+                    session.execute(update(table).where(
+                        table.c.id == bindparam('monitor_id')), rows)
+                record_results(session, history)
+                session.commit()
+            except Exception:
+                logger.exception('Failed to write %d monitor updates and %d '
+                                 'results.', len(pending), len(history))
+                with self.condition:
+                    for monitor_id, columns in pending.items():
+                        self.pending[monitor_id] = dict(
+                            columns, **self.pending.get(monitor_id, dict()))
+                    self.history[:0] = history
+                if raise_errors:
+                    raise
+                return 0
+            finally:
+                session.close()
+            self.rows += len(pending)
+            self.results += len(history)
+            self.commits += 1
+            if time.monotonic() - self.last_stats >= self.stats_interval:
+                logger.info('State writer stats: %s.', self.api_serialised)
+                self.last_stats = time.monotonic()
+            if time.monotonic() - self.last_compact >= self.compact_interval:
+                self.compact_history()
+            return len(pending) + len(history)
+
+    def end_job(self):
+        """Write what a job queued before it ends, unless written behind.
+
+        Raises:
+            Exception: The transaction failed, so that the job fails.
+        """
+        if not self.background:
+            self.flush(raise_errors=True)
+
+    def compact_history(self):
+        """Delete history beyond retention in its own transaction."""
+        self.last_compact = time.monotonic()
+        session = self.session_factory()
+        try:
+            compact(session, self.retention)
+            session.commit()
+        except Exception:
+            logger.exception('Failed to compact result history.')
+        finally:
+            session.close()
+
+    def run(self):
+        """Flush updates when enough are pending or due, until closed."""
+        while True:
+            with self.condition:
+                while not self.pending and not self.history \
+                        and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                if self.backlog() < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+            if not self.flush():
+                with self.condition:  # Back off while the database fails.
+                    self.condition.wait(self.flush_interval)
+
+    def close(self):
+        """Stop the flushing thread and write what is pending."""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            atexit.unregister(self.close)
+        self.flush()
+        logger.info('State writer stats: %s.', self.api_serialised)
+
+    @property
+    def api_serialised(self):
+        """Return serialisable statistics."""
+        elapsed = time.monotonic() - self.started
+        return {'updates': self.updates,
+                'rows': self.rows,
+                'results': self.results,
+                'commits': self.commits,
+                'updates_per_commit': self.updates / self.commits
+                if self.commits else 0.0,
+                'updates_per_second': self.updates / elapsed
+                if elapsed else 0.0}
+
+
+def get_state_cache(config):
+    """Return the StateCache of the configured Redis.
+
+    Arguments:
+        config (dict): Entire loaded configuration file. The `cache` section
+            may set `state_ttl` in seconds.
+
+    Returns:
+        StateCache
+    """
+    redis_host = config.get('rq', dict()).get('host', 'localhost')
+    redis_port = int(config.get('rq', dict()).get('port', 6379))
+    with caches_lock:
+        if (redis_host, redis_port) not in STATE_CACHES:
+            cache_config = config.get('cache', dict())
+            STATE_CACHES[(redis_host, redis_port)] = StateCache(
+                Redis(host=redis_host, port=redis_port),
+                ttl=int(cache_config.get('state_ttl', 3600)))
+        return STATE_CACHES[(redis_host, redis_port)]
+
+
+def get_state_writer(config):
+    """Return the StateWriter of the configured database.
+
+    Writers are written behind only if WRITE_BEHIND is set, and are created
+        again in a forked child, whose copy has no flushing thread.
+
+    Arguments:
+        config (dict): Entire loaded configuration file. The `cache` section
+            may set `flush_interval` in seconds and `flush_batch` in
+            Monitors. The `history` section may set days to keep as
+            `raw_days`, `minute_days`, `hour_days` and `day_days`, and
+            `compact_interval` in seconds.
+
+    Returns:
+        StateWriter
+    """
+    uri = config['database'].get('uri', ':memory:')
+    with caches_lock:
+        writer = STATE_WRITERS.get(uri)
+        if writer is None or writer.pid != os.getpid():
+            cache_config = config.get('cache', dict())
+            history_config = config.get('history', dict())
+            retention = {key: history_config[name] for key, name in (
+                ('raw', 'raw_days'), (MINUTE, 'minute_days'),
+                (HOUR, 'hour_days'), (DAY, 'day_days'))
+                if name in history_config}
+            STATE_WRITERS[uri] = StateWriter(
+                get_session_factory(config),
+                flush_interval=float(cache_config.get('flush_interval', 1)),
+                batch_size=int(cache_config.get('flush_batch', 1000)),
+                retention=retention,
+                compact_interval=float(
+                    history_config.get('compact_interval', 3600)),
+                background=WRITE_BEHIND.is_set())
+        return STATE_WRITERS[uri]
+
+
+def close_writers():
+    """Write pending updates of all StateWriters and forget them."""
+    with caches_lock:
+        writers = list(STATE_WRITERS.values())
+        STATE_WRITERS.clear()
+    for writer in writers:
+        writer.close()
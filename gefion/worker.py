@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""Long-lived in-process worker runtime."""
+
+import json
+import logging
+import time
+
+import requests
+
+from gefion import name_maps
+from gefion.checks.resolver import DNS_CACHE
+from gefion.scheduling import (LagStats, TimerHeap, log_load,
+                               monitor_interval, next_run_delay, phase_delay)
+from gefion.worker_tasks import (diff_monitors, request_monitors,
+                                 retry_delay, run_check, run_port_scan,
+                                 should_retry)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class Worker(object):
+    """Pulls due Monitors and runs them on a CheckExecutor.
+
+    Unlike rq workers, nothing is forked or re-imported per job; each run is
+        a function call in a pool that lives as long as the process.
+
+    Attributes:
+        config (dict): Entire loaded config.
+        executor (gefion.executor.CheckExecutor): Pool running the checks.
+        buffer (gefion.reporting.ResultBuffer): Buffer submitting results.
+        monitors (dict): Monitors as served by the master, keyed by ID.
+        etag (str): ETag of the Monitors assignment.
+        load (list): Runs per second of the phase-spread schedule, see
+            gefion.scheduling.load_histogram.
+        timers (gefion.scheduling.TimerHeap): Next due times of Monitors.
+        running (dict): Futures, attempt numbers and indices within port
+            scans of in-flight runs, keyed by Monitor ID. The index is None
+            for runs of their own.
+        retries (gefion.scheduling.TimerHeap): Due times of deferred retries,
+            with their attempt numbers.
+        lag (gefion.scheduling.LagStats): Lateness of runs.
+    """
+
+    def __init__(self, config, executor, buffer):
+        """Initialise Worker.
+
+        Arguments:
+            config (dict): Entire loaded config.
+            executor (gefion.executor.CheckExecutor): Pool running the
+                checks.
+            buffer (gefion.reporting.ResultBuffer): Buffer submitting
+                results.
+        """
+        self.config = config
+        self.executor = executor
+        self.buffer = buffer
+        self.monitors = dict()
+        self.etag = None
+        self.load = list()
+        self.timers = TimerHeap()
+        self.running = dict()
+        self.retries = TimerHeap()
+        self.lag = LagStats()
+
+    def sync(self):
+        """Fetch Monitors from master, applying only what has changed.
+
+        New Monitors, and those whose interval changed, are scheduled at their
+            phase. Other changed Monitors keep their timing, and removed ones
+            are forgotten with their retries.
+        """
+        monitors, self.etag = request_monitors(self.config, self.etag)
+        if monitors is None:
+            return
+        fetched = {monitor['id']: monitor for monitor in monitors}
+        added, removed, changed = diff_monitors(self.monitors, fetched)
+        now = time.monotonic()
+        timestamp = time.time()
+        for monitor_id in removed:
+            self.timers.remove(monitor_id)
+            self.retries.remove(monitor_id)
+        for monitor_id in added | changed:
+            interval = monitor_interval(fetched[monitor_id])
+            if monitor_id in changed and \
+                    interval == monitor_interval(self.monitors[monitor_id]):
+                continue
+            self.timers.push(monitor_id, now + phase_delay(
+                monitor_id, interval, timestamp))
+        self.monitors = fetched
+        self.load = log_load(monitors)
+        logger.info('Sync added %d, removed %d and changed %d monitors.',
+                    len(added), len(removed), len(changed))
+
+    def try_sync(self):
+        """Sync Monitors, logging failures to retry at the next sync.
+
+        Returns:
+            bool: Whether the sync succeeded.
+        """
+        try:
+            self.sync()
+        except (requests.exceptions.RequestException, ValueError):
+            logger.exception('Failed to sync monitors.')
+            return False
+        return True
+
+    def submit(self, monitor, attempt=1):
+        """Submit an attempt of a Monitor to the executor.
+
+        Arguments:
+            monitor (dict): Monitor as served by the master.
+            attempt (int): Number of the attempt, from 1.
+        """
+        self.running[monitor['id']] = (self.executor.submit(
+            run_check, monitor['check'], json.loads(monitor['arguments'])),
+            attempt, None)
+
+    def submit_all(self, runs):
+        """Submit attempts of Monitors, batching port checks into one scan.
+
+        Due port checks are connected concurrently by a single PortScanner
+            rather than one pool worker each. Port checks with invalid
+            arguments are submitted on their own, failing as they would.
+
+        Arguments:
+            runs (list): Tuples of Monitor as served by the master and number
+                of the attempt.
+        """
+        port_runs = [run for run in runs if run[0]['check'] == 'port']
+        if len(port_runs) < 2:
+            port_runs = list()
+        scanned, port_checks = list(), list()
+        for monitor, attempt in port_runs:
+            try:
+                port_checks.append(name_maps.CHECKS['port'](
+                    **json.loads(monitor['arguments'])))
+            except TypeError:
+                continue
+            scanned.append((monitor, attempt))
+        if scanned:
+            future = self.executor.submit(run_port_scan, port_checks)
+            for index, (monitor, attempt) in enumerate(scanned):
+                self.running[monitor['id']] = (future, attempt, index)
+        scanned_ids = {monitor['id'] for monitor, _ in scanned}
+        for monitor, attempt in runs:
+            if monitor['id'] not in scanned_ids:
+                self.submit(monitor, attempt)
+
+    def harvest(self, now):
+        """Collect finished runs, buffering results or deferring retries.
+
+        Arguments:
+            now (float): Current monotonic time.
+        """
+        for monitor_id, (future, attempt, index) in \
+                list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[monitor_id]
+            monitor = self.monitors.get(monitor_id)
+            if future.exception() or not monitor:
+                continue
+            result = future.result()[0]
+            if index is not None:
+                result = result[index]
+            if result is None:
+                logger.error('Monitor %s has unknown check %s.', monitor_id,
+                             monitor['check'])
+            elif should_retry(result, attempt,
+                              monitor.get('max_attempts') or 3):
+                self.retries.push(monitor_id, now + retry_delay(
+                    attempt, monitor.get('retry_backoff') or 3), attempt + 1)
+            else:
+                result.attempts = attempt
+                self.buffer.add(monitor_id, monitor['unique_id'], result)
+
+    def tick(self, now=None):
+        """Submit due Monitors and retries to the executor.
+
+        Runs are rescheduled on their fixed grid rather than from the time
+            they actually ran, so lateness does not accumulate into drift.
+
+        Arguments:
+            now (float): Current monotonic time. Defaults to now.
+
+        Returns:
+            int: Number of submitted runs.
+        """
+        now = time.monotonic() if now is None else now
+        self.harvest(now)
+        runs = list()
+        for monitor_id, due, _ in self.timers.pop_due(now):
+            monitor = self.monitors[monitor_id]
+            interval = monitor_interval(monitor)
+            next_due = due + interval
+            if next_due <= now:  # Fell behind by a whole interval.
+                next_due = now + next_run_delay(monitor_id, interval,
+                                                time.time())
+            self.timers.push(monitor_id, next_due)
+            self.lag.record(now - due)
+            if monitor_id in self.running or monitor_id in self.retries:
+                logger.warning('Monitor %s still running, skipped.',
+                               monitor_id)
+                continue
+            runs.append((monitor, 1))
+        for monitor_id, _, attempt in self.retries.pop_due(now):
+            if monitor_id in self.monitors:
+                runs.append((self.monitors[monitor_id], attempt))
+        self.submit_all(runs)
+        return len(runs)
+
+    def run_forever(self, tick_interval=1, sync_interval=300,
+                    stats_interval=60):
+        """Run the worker loop until interrupted.
+
+        Arguments:
+            tick_interval (float): Longest sleep between ticks, in seconds.
+                The loop wakes earlier when a run is due sooner.
+            sync_interval (float): Seconds between Monitor synchronisations.
+            stats_interval (float): Seconds between executor, lag and DNS
+                cache stats logs. DNS cache stats only cover thread pools, as
+                process pool workers each have their own cache.
+        """
+        last_sync = last_stats = time.monotonic()
+        self.try_sync()
+        try:
+            while True:
+                now = time.monotonic()
+                if now - last_sync >= sync_interval:
+                    self.try_sync()
+                    last_sync = now
+                if now - last_stats >= stats_interval:
+                    logger.info('Executor stats: %s. Lag stats: %s. '
+                                'DNS stats: %s.',
+                                self.executor.stats.api_serialised,
+                                self.lag.api_serialised,
+                                DNS_CACHE.api_serialised)
+                    last_stats = now
+                self.tick(now)
+                next_due = min(due for due in (self.timers.next_due(),
+                                               self.retries.next_due(),
+                                               now + tick_interval)
+                               if due is not None)
+                time.sleep(max(0, next_due - time.monotonic()))
+        finally:
+            self.executor.shutdown(wait=False)
+            self.buffer.close()
@@ -3,13 +3,18 @@
 
 import json
 import logging
-from datetime import datetime
+import random
+import time
+from datetime import datetime, timedelta
 from urllib.parse import urljoin
 
 import requests
-from retrying import RetryError, retry
+from rq import get_current_job
+from rq_scheduler import Scheduler
 
 from gefion import name_maps
+from gefion.checks import PortScanner
+from gefion.scheduling import log_load, monitor_interval, phase_delay
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -19,8 +24,7 @@ def result_is_false(result):
     """
     Determine if the availability of a Result is False.
 
-    This is used by the retry decorator to determine if a check should be
-        re-ran.
+    This is used to determine if a check should be re-ran.
 
     Arguments:
         result (gefion.checks.Result): Instance with availability to check.
@@ -34,10 +38,23 @@ def result_is_false(result):
         return True
 
 
-@retry(retry_on_result=result_is_false,
-       stop_max_attempt_number=3,
-       wait_random_min=3000,
-       wait_random_max=6000)
+def retry_delay(attempt, retry_backoff=3):
+    """
+    Determine the wait before the next attempt of a failed check.
+
+    The wait doubles with every attempt, with random jitter so that targets
+        failing together are not retried in lockstep.
+
+    Arguments:
+        attempt (int): Number of the attempt that just failed, from 1.
+        retry_backoff (float): Base wait in seconds.
+
+    Returns:
+        float: Wait in seconds.
+    """
+    return retry_backoff * 2 ** (attempt - 1) * random.uniform(1, 2)
+
+
 def run_check(check_name, arguments):
     """
     Execute check task.
@@ -54,30 +71,98 @@ def run_check(check_name, arguments):
         return check.check()
 
 
-def run_monitor(monitor_id, unique_id, check_name, arguments, endpoint_url):
+def run_port_scan(port_checks):
+    """
+    Execute a batch of port checks at once.
+
+    Arguments:
+        port_checks (list): gefion.checks.PortCheck instances.
+
+    Returns:
+        list: gefion.checks.Result of each check, in order.
+    """
+    return PortScanner().scan(port_checks)
+
+
+def should_retry(result, attempt, max_attempts=3):
+    """
+    Determine if another attempt of a check is due.
+
+    Arguments:
+        result (gefion.checks.Result): Result of the attempt.
+        attempt (int): Number of the attempt, from 1.
+        max_attempts (int): Attempts before a failure is reported.
+
+    Returns:
+        bool
+    """
+    return result_is_false(result) and attempt < max_attempts
+
+
+def run_monitor(monitor_id, unique_id, check_name, arguments, endpoint_url,
+                max_attempts=3, retry_backoff=3, attempt=1):
     """
     Run check and report to backend.
 
+    Failed attempts are not waited on. The next attempt is scheduled with
+        rq-scheduler as a new job, freeing the worker in the meantime.
+
     Arguments:
         monitor_id (str): Database ID of the Monitor.
         unique_id (str): UUID of the version.
         check_name (str): Type of the check. Use names found in name_maps.
         arguments (dict): Argument of the check.
         endpoint_url (str): Endpoint URL of master.
+        max_attempts (int): Attempts before a failure is reported.
+        retry_backoff (float): Base wait before the first retry, in seconds.
+        attempt (int): Number of this attempt, from 1.
 
     Returns:
-        bool: Success of execution and report.
+        bool: Success of execution and report. False if deferred.
+    """
+    check_result = run_check(check_name, arguments)
+    if check_result is None:
+        logger.error('Monitor %s has unknown check %s.', monitor_id,
+                     check_name)
+        return False
+
+    if should_retry(check_result, attempt, max_attempts):
+        logger.info('Monitor %s failed attempt %d of %d.', monitor_id,
+                    attempt, max_attempts)
+        job = get_current_job()
+        scheduler = Scheduler(queue_name=job.origin,
+                              connection=job.connection)
+        scheduler.enqueue_in(
+            timedelta(seconds=retry_delay(attempt, retry_backoff)),
+            run_monitor, monitor_id, unique_id, check_name, arguments,
+            endpoint_url, max_attempts=max_attempts,
+            retry_backoff=retry_backoff, attempt=attempt + 1,
+            meta={'retry_of': monitor_id})  # Cancelled by syncs if stale.
+        return False
+
+    check_result.attempts = attempt
+    return report_result(monitor_id, unique_id, check_result, endpoint_url)
+
+
+def report_result(monitor_id, unique_id, result, endpoint_url):
+    """
+    Report check result to backend.
+
+    Arguments:
+        monitor_id (str): Database ID of the Monitor.
+        unique_id (str): UUID of the version.
+        result (gefion.checks.Result): Result of the check.
+        endpoint_url (str): Endpoint URL of master.
+
+    Returns:
+        bool: Success of report.
     """
-    try:
-        check_result = run_check(check_name, arguments)
-    except RetryError as error:
-        check_result = error.args[0].value
     reporting_url = urljoin(endpoint_url, 'result')
     r = requests.post(reporting_url,
                       data={
                           'id': monitor_id,
                           'unique_id': unique_id,
-                          'result': json.dumps(check_result.api_serialised)
+                          'result': json.dumps(result.api_serialised)
                       })
     if r.status_code == 204:
         return True
@@ -85,33 +170,159 @@ def run_monitor(monitor_id, unique_id, check_name, arguments, endpoint_url):
     return False
 
 
-def fetch_monitors(scheduler, config):
-    """Fetch Monitors and schedule accordingly.
+def request_monitors(config, etag=None):
+    """Request Monitors assigned to this worker from master.
 
     Arguments:
-        scheduler (rq_scheduler.Scheduler): The Scheduler instance initialized.
         config (dict): Entire loaded config.
+        etag (str): ETag of the previous response. If the assignment has not
+            changed since, master answers with an empty 304.
+
+    Returns:
+        tuple: Monitors serialised as dicts, or None if unchanged, and the
+            ETag of the assignment.
+
+    Raises:
+        requests.exceptions.RequestException: Master is unreachable or
+            answered with an error status.
+        ValueError: Master answered with invalid JSON.
     """
     monitors_url = urljoin(config['master'].get('endpoint'), 'monitors')
     logger.info('Requesting endpoint for monitors at %s.', monitors_url)
+    headers = {'If-None-Match': '"{}"'.format(etag)} if etag else dict()
     r = requests.get(monitors_url,
+                     headers=headers,
                      auth=(config.get('my_name'), config['master'].get('key')))
+    if r.status_code == 304:
+        logger.debug('Monitors unchanged since %s.', etag)
+        return None, etag
+    r.raise_for_status()
     logger.debug('Master returned following Monitors: %s.', r.text)
-    monitors = json.loads(r.text).get('monitors')
-
-    for job in scheduler.get_jobs():  # Delete all existing jobs.
-        scheduler.cancel(job)
-
-    for monitor in monitors:
-        scheduler.schedule(
-            scheduled_time=datetime.utcnow(),
-            func=run_monitor,
-            args=[
-                monitor['id'],
-                monitor['unique_id'],
-                monitor['check'],
-                json.loads(monitor['arguments']),
-                config['master'].get('endpoint')],
-            interval=monitor['frequency'] * 60,  # Minutes to seconds.
-            repeat=None  # Repeat forever (until deletion).
-        )
+    return (json.loads(r.text).get('monitors'),
+            r.headers.get('ETag', '').strip('"') or None)
+
+
+def get_monitors(config):
+    """Request Monitors assigned to this worker from master.
+
+    Arguments:
+        config (dict): Entire loaded config.
+
+    Returns:
+        list: Monitors serialised as dicts.
+    """
+    return request_monitors(config)[0]
+
+
+def diff_monitors(current, fetched):
+    """Compare assignments of Monitors.
+
+    Arguments:
+        current (dict): Monitors serialised as dicts, keyed by ID.
+        fetched (dict): Monitors serialised as dicts, keyed by ID.
+
+    Returns:
+        tuple: Sets of added, removed and changed Monitor IDs.
+    """
+    added = fetched.keys() - current.keys()
+    removed = current.keys() - fetched.keys()
+    changed = {monitor_id for monitor_id in fetched.keys() & current.keys()
+               if fetched[monitor_id] != current[monitor_id]}
+    return added, removed, changed
+
+
+def schedule_monitor(scheduler, monitor, endpoint_url):
+    """Schedule a Monitor to run periodically with rq-scheduler.
+
+    The first run is delayed to the Monitor's phase, see
+        gefion.scheduling.phase_offset.
+
+    Arguments:
+        scheduler (rq_scheduler.Scheduler): The Scheduler instance initialized.
+        monitor (dict): Monitor as served by the master.
+        endpoint_url (str): Endpoint URL of master.
+    """
+    interval = monitor_interval(monitor)
+    now = time.time()
+    scheduler.schedule(
+        scheduled_time=datetime.utcfromtimestamp(
+            now + phase_delay(monitor['id'], interval, now)),
+        func=run_monitor,
+        args=[
+            monitor['id'],
+            monitor['unique_id'],
+            monitor['check'],
+            json.loads(monitor['arguments']),
+            endpoint_url],
+        kwargs={
+            'max_attempts': monitor.get('max_attempts') or 3,
+            'retry_backoff': monitor.get('retry_backoff') or 3},
+        interval=interval,
+        repeat=None,  # Repeat forever (until deletion).
+        meta={'monitor': monitor}  # Compared against on the next sync.
+    )
+
+
+def etag_key(config):
+    """Return Redis key of the ETag of the last sync of this worker."""
+    return 'gefion:monitors_etag:{}'.format(config.get('my_name'))
+
+
+def fetch_monitors(scheduler, config, etag=None):
+    """Fetch Monitors and schedule accordingly.
+
+    Only Monitors which were added, removed or changed since the last sync
+        touch the scheduler, so unchanged ones keep their timing. Pending
+        retries of removed and changed Monitors are cancelled. The ETag is
+        kept in Redis next to the scheduled jobs, so that syncs of separate
+        runs are answered with 304 while the assignment is unchanged.
+
+    Arguments:
+        scheduler (rq_scheduler.Scheduler): The Scheduler instance initialized.
+        config (dict): Entire loaded config.
+        etag (str): ETag returned by the previous sync. Defaults to the one
+            kept in Redis, if any Monitors are scheduled.
+
+    Returns:
+        str: ETag of the assignment, for the next sync.
+    """
+    jobs = dict()
+    retries = list()
+    for job in scheduler.get_jobs():
+        if 'monitor' in job.meta:
+            jobs[job.meta['monitor']['id']] = job
+        elif 'retry_of' in job.meta:
+            retries.append(job)
+        elif job.meta.get('interval'):  # Scheduled before syncs were diffed.
+            scheduler.cancel(job)
+    if etag is None and jobs:
+        etag = scheduler.connection.get(etag_key(config))
+        etag = etag.decode() if isinstance(etag, bytes) else etag
+
+    monitors, etag = request_monitors(config, etag)
+    if monitors is None:
+        return etag
+    current = {monitor_id: job.meta['monitor']
+               for monitor_id, job in jobs.items()}
+    fetched = {monitor['id']: monitor for monitor in monitors}
+    added, removed, changed = diff_monitors(current, fetched)
+    logger.info('Sync added %d, removed %d and changed %d monitors.',
+                len(added), len(removed), len(changed))
+
+    for monitor_id in removed | changed:
+        scheduler.cancel(jobs[monitor_id])
+    for job in retries:
+        if job.meta['retry_of'] in removed | changed:
+            scheduler.cancel(job)
+    for monitor_id in added | changed:
+        schedule_monitor(scheduler, fetched[monitor_id],
+                         config['master'].get('endpoint'))
+    if any(monitor_interval(monitor) < 60 for monitor in monitors):
+        logger.warning('Sub-minute intervals are not kept by rq-scheduler, '
+                       'use an in-process engine mode for them.')
+    log_load(monitors)
+    if etag:
+        scheduler.connection.set(etag_key(config), etag)
+    else:
+        scheduler.connection.delete(etag_key(config))
+    return etag
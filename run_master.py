@@ -2,8 +2,10 @@
 """Master endpoint and tasks."""
 
 import argparse
+import hashlib
 import json
 import logging
+import os
 
 import yaml
 from flask import Flask, jsonify, request
@@ -11,10 +13,10 @@ from flask_httpauth import HTTPBasicAuth
 from flask_sqlalchemy import SQLAlchemy
 from redis import Redis
 from rq import Queue
-from sqlalchemy import or_
 
-from gefion.master_tasks import process_result
-from gefion.models import Base, Monitor
+from gefion.database import MonitorCache, create_schema
+from gefion.master_tasks import make_payload, process_result
+from gefion.models import Monitor
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -25,7 +27,8 @@ parser.add_argument('-c',
                     '--config',
                     help='Path to yaml configuration file.',
                     required=True)
-config_file = open(parser.parse_args().config.strip())
+config_path = os.path.abspath(parser.parse_args().config.strip())
+config_file = open(config_path)
 config = yaml.safe_load(config_file)
 logger.debug('Master configuration loaded: %s.', config)
 config_file.close()
@@ -41,11 +44,12 @@ redis_host = config.get('rq', dict()).get('host', 'localhost')
 redis_port = int(config.get('rq', dict()).get('port', 6379))
 queue = Queue(connection=Redis(host=redis_host, port=redis_port))
 
+monitor_cache = MonitorCache(
+    float(config.get('cache', dict()).get('monitor_ttl', 300)))
 
-@app.before_first_request
-def setup():
-    """Setup flask-sqlalchemy session with existing models."""
-    Base.metadata.create_all(bind=db.engine)
+# Tables are created on start, as Flask 2.3 removed before_first_request.
+with app.app_context():
+    create_schema(db.engine)
 
 
 @auth.get_password
@@ -75,12 +79,20 @@ def get_monitors():
     """Retrieve Monitors of a worker.
 
     The worker's name will be determined by the username given in
-        the HTTP authorisation.
+        the HTTP authorisation. Responses carry an ETag, and unchanged
+        assignments are answered with 304 given `If-None-Match`.
     """
     worker_name = auth.username()
     monitors = db.session.query(Monitor).filter(
-        Monitor.worker == worker_name).all()
-    return jsonify(monitors=[monitor.api_serialised for monitor in monitors])
+        Monitor.worker == worker_name).order_by(Monitor.id).all()
+    serialised = [monitor.api_serialised for monitor in monitors]
+    etag = hashlib.sha1(json.dumps(serialised, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        return ('', 304, {'ETag': '"{}"'.format(etag)})
+    response = jsonify(monitors=serialised)
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/result', methods=['POST'])
@@ -89,15 +101,51 @@ def receive_result():
     monitor_id = request.form.get('id')
     monitor_unique_id = request.form.get('unique_id')
     result = json.loads(request.form.get('result'))
-    monitor = db.session.query(Monitor).filter(or_(
-        Monitor.id.like(monitor_id), Monitor.unique_id.like(
-            monitor_unique_id))).first()
-    if not monitor:
+    primary_key = monitor_cache.primary_keys(
+        db.session, [(monitor_id, monitor_unique_id)])[0]
+    if primary_key is None:
         return ('', 403)
 
-    queue.enqueue(process_result, monitor, result, config)
+    queue.enqueue(process_result,
+                  make_payload(primary_key, result, config_path))
     return ('', 204)
 
 
+@app.route('/results', methods=['POST'])
+def receive_results():
+    """Receive a batch of monitor results from worker.
+
+    The body is a JSON object, whose `results` list holds objects with the
+        `id`, `unique_id` and `result` of each submission. Monitors are looked
+        up through the MonitorCache and jobs are enqueued in one Redis
+        pipeline.
+
+    Returns the IDs of rejected submissions as JSON. Elements which are not
+        objects are rejected as they are.
+    """
+    submissions = (request.get_json(silent=True) or dict()).get('results')
+    if not isinstance(submissions, list):
+        return ('', 400)
+
+    rejected = [submission for submission in submissions
+                if not isinstance(submission, dict)]
+    submissions = [submission for submission in submissions
+                   if isinstance(submission, dict)]
+    primary_keys = monitor_cache.primary_keys(
+        db.session, [(submission.get('id'), submission.get('unique_id'))
+                     for submission in submissions])
+
+    jobs = list()
+    for submission, primary_key in zip(submissions, primary_keys):
+        if primary_key is None:
+            rejected.append(submission.get('id'))
+            continue
+        jobs.append(Queue.prepare_data(process_result, (make_payload(
+            primary_key, submission.get('result') or dict(), config_path),)))
+    if jobs:
+        queue.enqueue_many(jobs)
+    return jsonify(accepted=len(jobs), rejected=rejected)
+
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Master job processing, with database connections pooled across jobs."""
+
+import argparse
+import logging
+import os
+
+from redis import Redis
+from rq import Queue, SimpleWorker
+
+from gefion.database import get_routing_cache, get_session_factory
+from gefion.master_tasks import DELIVERY_QUEUE, load_config
+from gefion.notifiers.clients import CLIENTS
+from gefion.notifiers.limits import LIMITER
+from gefion.state import WRITE_BEHIND, close_writers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Load configuration file
+parser = argparse.ArgumentParser(description='Gefion master job worker.')
+parser.add_argument('-c',
+                    '--config',
+                    help='Path to yaml configuration file.',
+                    required=True)
+parser.add_argument('-q',
+                    '--queues',
+                    help='Comma-separated queues to work on, in order of '
+                    'priority. Run separate workers with `-q {}` to keep '
+                    'notifications apart from results.'.format(
+                        DELIVERY_QUEUE),
+                    default='default,' + DELIVERY_QUEUE)
+args = parser.parse_args()
+# Jobs refer to the configuration by path, so load it into their cache.
+config = load_config(os.path.abspath(args.config.strip()))
+
+redis_host = config.get('rq', dict()).get('host', 'localhost')
+redis_port = int(config.get('rq', dict()).get('port', 6379))
+connection = Redis(host=redis_host, port=redis_port)
+
+notifiers_config = config.get('notifiers', dict())
+CLIENTS.configure(idle_timeout=notifiers_config.get('idle_timeout'),
+                  pool_size=notifiers_config.get('pool_size'))
+# Notifier budgets are spent by all master workers sharing this Redis.
+LIMITER.configure(redis=connection)
+
+if __name__ == '__main__':
+    # Jobs run in this process rather than forked children, so the engine
+    # and its pool outlive every job, and updates can be written behind.
+    WRITE_BEHIND.set()
+    session = get_session_factory(config)()
+    try:
+        # Routes of all Monitors are loaded up front, so that a mass outage
+        # right after start does not query contacts per Monitor.
+        get_routing_cache(config).load(session)
+    finally:
+        session.close()
+    try:
+        # The scheduler releases delivery retries once their backoff is up.
+        SimpleWorker([Queue(name.strip(), connection=connection)
+                      for name in args.queues.split(',')],
+                     connection=connection).work(with_scheduler=True)
+    finally:
+        close_writers()  # Write monitor updates still pending.
+        CLIENTS.clear()
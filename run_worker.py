@@ -2,12 +2,20 @@
 """Worker task executions."""
 
 import argparse
+import asyncio
 import logging
 
 import yaml
 from redis import Redis
 from rq_scheduler import Scheduler
 
+from gefion.checks.http import SESSION_POOL
+from gefion.checks.port import SOCKET_BUDGET
+from gefion.checks.resolver import DNS_CACHE
+from gefion.engine import AsyncEngine
+from gefion.executor import CheckExecutor
+from gefion.reporting import ResultBuffer
+from gefion.worker import Worker
 from gefion.worker_tasks import fetch_monitors
 
 logger = logging.getLogger(__name__)
@@ -28,5 +36,43 @@ redis_host = config.get('rq', dict()).get('host', 'localhost')
 redis_port = int(config.get('rq', dict()).get('port', 6379))
 scheduler = Scheduler(connection=Redis(host=redis_host, port=redis_port))
 
+engine_config = config.get('engine', dict())
+reporting_config = config.get('reporting', dict())
+http_pool_config = config.get('http_pool', dict())
+pool_maxsize = int(http_pool_config.get('maxsize', 10))
+pool_idle_timeout = float(http_pool_config.get('idle_timeout', 300))
+SESSION_POOL.configure(pool_maxsize, pool_idle_timeout)
+SOCKET_BUDGET.configure(int(engine_config.get('max_open_sockets', 512)))
+dns_config = config.get('dns', dict())
+DNS_CACHE.configure(int(dns_config.get('maxsize', 10000)),
+                    float(dns_config.get('ttl', 60)),
+                    float(dns_config.get('negative_ttl', 10)))
+
+
+def make_buffer():
+    """Make ResultBuffer for in-process modes as configured."""
+    return ResultBuffer(
+        config['master'].get('endpoint'),
+        batch_size=int(reporting_config.get('batch_size', 100)),
+        max_delay=float(reporting_config.get('max_delay', 1)))
+
+
 if __name__ == '__main__':
-    fetch_monitors(scheduler, config)
+    engine_mode = engine_config.get('mode', 'rq')
+    if engine_mode == 'asyncio':
+        engine = AsyncEngine(
+            concurrency=int(engine_config.get('concurrency', 1000)),
+            pool_maxsize=pool_maxsize,
+            pool_idle_timeout=pool_idle_timeout)
+        asyncio.run(engine.serve(
+            config, make_buffer(),
+            sync_interval=float(engine_config.get('sync_interval', 300)),
+            stats_interval=float(engine_config.get('stats_interval', 60))))
+    elif engine_mode in ('thread', 'process'):
+        executor = CheckExecutor(engine_mode,
+                                 int(engine_config.get('workers', 32)))
+        Worker(config, executor, make_buffer()).run_forever(
+            sync_interval=float(engine_config.get('sync_interval', 300)),
+            stats_interval=float(engine_config.get('stats_interval', 60)))
+    else:
+        fetch_monitors(scheduler, config)
@@ -10,9 +10,9 @@ with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
 requirements = [
-    'Flask', 'Flask-HTTPAuth', 'Flask-SQLAlchemy', 'postmarker',
-    'python-telegram-bot', 'PyYAML', 'requests', 'retrying', 'rq',
-    'rq-scheduler'
+    'aiohttp', 'Flask', 'Flask-HTTPAuth', 'Flask-SQLAlchemy',
+    'postmarker>=1.0', 'python-telegram-bot<20', 'PyYAML', 'requests', 'rq',
+    'rq-scheduler', 'SQLAlchemy>=2.0', 'urllib3>=2'
 ]
 
 test_requirements = [
@@ -41,9 +41,12 @@ setup(name='gefion',
           'License :: OSI Approved :: BSD License',
           'Natural Language :: English',
           'Programming Language :: Python :: 3',
-          'Programming Language :: Python :: 3.3',
-          'Programming Language :: Python :: 3.4',
-          'Programming Language :: Python :: 3.5',
+          'Programming Language :: Python :: 3.7',
+          'Programming Language :: Python :: 3.8',
+          'Programming Language :: Python :: 3.9',
+          'Programming Language :: Python :: 3.10',
+          'Programming Language :: Python :: 3.11',
       ],
+      python_requires='>=3.7',
       test_suite='tests',
       tests_require=test_requirements)
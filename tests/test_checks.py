@@ -1,14 +1,72 @@
 # -*- coding: utf-8 -*-
 """Tests for checks."""
 
+import asyncio
+import socket
+import threading
 import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
+import aiohttp
 import requests
 
 from gefion import checks
 
 
+class LocalHandler(BaseHTTPRequestHandler):
+    """Serves a small keep-alive page, counting connections."""
+
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    body = b'<html>Hello, local world.</html>'
+
+    def setup(self):
+        """Count connection."""
+        LocalHandler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        """Serve page, or an endless stream at `/endless`."""
+        self.send_response(200)
+        if self.path != '/endless':
+            self.send_header('Content-Length', str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+            return
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunk = b'Still streaming. ' * 1024
+        try:
+            while True:
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() +
+                                 chunk + b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, *args):
+        """Keep test output quiet."""
+        pass
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """Runs a local HTTP server for the duration of a test."""
+
+    def setUp(self):
+        """Start local HTTP server."""
+        LocalHandler.connections = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), LocalHandler)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def tearDown(self):
+        """Stop local HTTP server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
 class TestCheck(unittest.TestCase):
     """Test Check base class.."""
 
@@ -45,6 +103,7 @@ class TestHTTPCheck(unittest.TestCase):
                                       'iana', {'Accept-Ranges': 'bytes'})
         self.assertEqual(init_check.url, 'https://www.example.com/')
         self.assertEqual(init_check.requests_method, requests.post)
+        self.assertEqual(init_check.verb, 'POST')
         self.assertEqual(init_check.data, {'post-some': 'data'})
         self.assertEqual(init_check.req_headers, {'x-custom-header': 'header'})
         self.assertEqual(init_check.status_code, 204)
@@ -101,6 +160,248 @@ class TestHTTPCheck(unittest.TestCase):
         self.assertIn('Errno -2', bad_url_check.check().message)
 
 
+class TestBodySearch(unittest.TestCase):
+    """Test BodySearch."""
+
+    def setUp(self):
+        """Setup BodySearch tests."""
+        pass
+
+    def tearDown(self):
+        """Tear down BodySearch tests."""
+        pass
+
+    def test_across_chunks(self):
+        """Test matches spanning chunk boundaries."""
+        search = checks.http.BodySearch('needle', 1000)
+        self.assertFalse(search.feed(b'hay hay nee'))
+        self.assertTrue(search.feed(b'dle hay'))
+        self.assertIsNone(search.assert_found())
+        self.assertEqual(search.read, 18)
+
+    def test_budget(self):
+        """Test that reading stops at the byte budget."""
+        search = checks.http.BodySearch('needle', 10)
+        self.assertFalse(search.feed(b'hay hay'))
+        self.assertTrue(search.feed(b'hay needle'))
+        self.assertEqual(search.read, 10)
+        self.assertRaisesRegex(checks.http.ContainResponseError,
+                               'not in first 10 bytes',
+                               search.assert_found)
+
+    def test_not_found(self):
+        """Test bodies ending without a match."""
+        search = checks.http.BodySearch('é', 1000, 'latin-1')
+        self.assertFalse(search.feed('café'.encode('utf-8')))
+        self.assertRaisesRegex(checks.http.ContainResponseError,
+                               'not in body', search.assert_found)
+
+
+class TestHTTPCheckStreaming(LocalServerTestCase):
+    """Test streamed body matching of HTTPCheck."""
+
+    def test_endless_found(self):
+        """Test that endless streams stop at the first match."""
+        endless_check = checks.HTTPCheck(self.url + 'endless', 'GET',
+                                         text_contain='streaming')
+        self.assertTrue(endless_check.check().availability)
+
+    def test_endless_budget(self):
+        """Test that endless streams stop at the byte budget."""
+        endless_check = checks.HTTPCheck(self.url + 'endless', 'GET',
+                                         text_contain='the end',
+                                         max_body_bytes=100000)
+        self.assertEqual(endless_check.check().message,
+                         'Text the end not in first 100000 bytes of body.')
+
+    def test_async_endless(self):
+        """Test streamed matching of AsyncHTTPCheck."""
+        async_check = checks.AsyncHTTPCheck(self.url + 'endless', 'GET',
+                                            text_contain='the end',
+                                            max_body_bytes=100000)
+        self.assertFalse(asyncio.run(async_check.check()).availability)
+        async_check.text_contain = 'streaming'
+        self.assertTrue(asyncio.run(async_check.check()).availability)
+
+
+class TestSessionPool(LocalServerTestCase):
+    """Test SessionPool and connection reuse of HTTPCheck."""
+
+    def tearDown(self):
+        """Tear down SessionPool tests."""
+        checks.http.SESSION_POOL.close()
+        super().tearDown()
+
+    def test_get(self):
+        """Test that sessions are shared per origin."""
+        pool = checks.http.SessionPool(maxsize=2, idle_timeout=60)
+        session = pool.get('https://www.example.com/a')
+        self.assertIs(pool.get('HTTPS://www.example.com/b'), session)
+        self.assertIsNot(pool.get('http://www.example.com/a'), session)
+        pool.close()
+        self.assertEqual(pool.sessions, dict())
+
+    def test_evict(self):
+        """Test that idle origins are evicted."""
+        pool = checks.http.SessionPool(idle_timeout=60)
+        pool.get('https://www.example.com/')
+        pool.evict(time.monotonic() + 30)
+        self.assertEqual(len(pool.sessions), 1)
+        pool.evict(time.monotonic() + 60)
+        self.assertEqual(len(pool.sessions), 0)
+
+    def test_reuse_connection(self):
+        """Test that reusing checks share one connection."""
+        for _ in range(3):
+            reuse_check = checks.HTTPCheck(self.url, 'GET', status_code=200,
+                                           text_contain='Hello',
+                                           reuse_connection=True)
+            self.assertTrue(reuse_check.check().availability)
+        self.assertEqual(LocalHandler.connections, 1)
+
+    def test_reuse_status_only(self):
+        """Test that checks leaving the body unread share one connection."""
+        for _ in range(5):
+            reuse_check = checks.HTTPCheck(self.url, 'GET', status_code=200,
+                                           reuse_connection=True)
+            self.assertTrue(reuse_check.check().availability)
+        self.assertEqual(LocalHandler.connections, 1)
+        endless_check = checks.HTTPCheck(self.url + 'endless', 'GET',
+                                         status_code=200,
+                                         reuse_connection=True)
+        self.assertTrue(endless_check.check().availability)
+        self.assertTrue(reuse_check.check().availability)
+        self.assertEqual(LocalHandler.connections, 2)
+
+    def test_async_reuse_status_only(self):
+        """Test the same of AsyncHTTPCheck on a shared session."""
+        async def run_checks():
+            async with aiohttp.ClientSession() as session:
+                for _ in range(5):
+                    reuse_check = checks.AsyncHTTPCheck(
+                        self.url, 'GET', status_code=200,
+                        reuse_connection=True)
+                    result = await reuse_check.check(session)
+                    self.assertTrue(result.availability)
+        asyncio.run(run_checks())
+        self.assertEqual(LocalHandler.connections, 1)
+
+    def test_cold_connection(self):
+        """Test that cold checks connect every time."""
+        for _ in range(3):
+            cold_check = checks.HTTPCheck(self.url, 'GET', status_code=200)
+            self.assertTrue(cold_check.check().availability)
+        self.assertEqual(LocalHandler.connections, 3)
+
+
+class TestPhaseTimings(LocalServerTestCase):
+    """Test per-phase timings of HTTP checks."""
+
+    def test_cold_timings(self):
+        """Test that cold checks time every phase."""
+        timed_check = checks.HTTPCheck(
+            self.url.replace('127.0.0.1', 'localhost'), 'GET',
+            text_contain='Hello', timings=True)
+        result = timed_check.check()
+        self.assertTrue(result.availability)
+        self.assertEqual(set(result.timings),
+                         {'dns', 'connect', 'ttfb', 'transfer', 'total'})
+        self.assertTrue(all(duration >= 0
+                            for duration in result.timings.values()))
+        self.assertIn('timings', result.api_serialised)
+
+    def test_reused_timings(self):
+        """Test that reused connections skip connection phases."""
+        checks.http.SESSION_POOL.get(self.url).get(self.url).close()
+        timed_check = checks.HTTPCheck(self.url, 'GET', timings=True,
+                                       reuse_connection=True)
+        result = timed_check.check()
+        checks.http.SESSION_POOL.close()
+        self.assertEqual(set(result.timings), {'ttfb', 'transfer', 'total'})
+
+    def test_untimed(self):
+        """Test that timings are not recorded by default."""
+        result = checks.HTTPCheck(self.url, 'GET').check()
+        self.assertIsNone(result.timings)
+        self.assertNotIn('timings', result.api_serialised)
+
+    def test_async_timings(self):
+        """Test timings of AsyncHTTPCheck."""
+        timed_check = checks.AsyncHTTPCheck(
+            self.url.replace('127.0.0.1', 'localhost'), 'GET', timings=True)
+        result = asyncio.run(timed_check.check())
+        self.assertTrue(result.availability)
+        self.assertEqual(set(result.timings),
+                         {'dns', 'connect', 'ttfb', 'transfer', 'total'})
+
+
+class TestDNSCache(LocalServerTestCase):
+    """Test DNSCache and its use by checks."""
+
+    def setUp(self):
+        """Setup DNSCache tests."""
+        checks.resolver.DNS_CACHE.clear()
+        super().setUp()
+
+    def tearDown(self):
+        """Tear down DNSCache tests."""
+        checks.resolver.DNS_CACHE.clear()
+        super().tearDown()
+
+    def test_resolve(self):
+        """Test that resolutions are cached and counted."""
+        cache = checks.resolver.DNSCache()
+        addresses = cache.resolve('localhost', socket.AF_INET)
+        self.assertIn((socket.AF_INET, '127.0.0.1'), addresses)
+        self.assertEqual(cache.resolve('localhost', socket.AF_INET),
+                         addresses)
+        cache.resolve('localhost', socket.AF_INET, fresh=True)
+        self.assertEqual(cache.api_serialised,
+                         {'entries': 1, 'hits': 1, 'misses': 2,
+                          'hit_ratio': 1 / 3})
+
+    def test_ip_literal(self):
+        """Test that IP addresses bypass the cache."""
+        cache = checks.resolver.DNSCache()
+        self.assertEqual(cache.resolve('::1'), [(socket.AF_INET6, '::1')])
+        self.assertEqual(cache.api_serialised['misses'], 0)
+
+    def test_eviction(self):
+        """Test that least recently used and expired entries are evicted."""
+        cache = checks.resolver.DNSCache(maxsize=2, ttl=60)
+        cache.put('a.example', 0, [(socket.AF_INET, '192.0.2.1')])
+        cache.put('b.example', 0, [(socket.AF_INET, '192.0.2.2')])
+        cache.get('a.example')
+        cache.put('c.example', 0, [(socket.AF_INET, '192.0.2.3')])
+        self.assertEqual(list(cache.entries),
+                         [('a.example', 0), ('c.example', 0)])
+        cache.configure(ttl=0)
+        cache.put('a.example', 0, [(socket.AF_INET, '192.0.2.1')])
+        self.assertIsNone(cache.get('a.example'))
+
+    def test_negative(self):
+        """Test that failed resolutions are cached."""
+        cache = checks.resolver.DNSCache()
+        cache.put('fancy.but.invalid', 0,
+                  socket.gaierror(-2, 'Name or service not known'))
+        with self.assertRaisesRegex(socket.gaierror, 'Errno -2'):
+            cache.resolve('fancy.but.invalid')
+        self.assertEqual(cache.hits, 1)
+
+    def test_checks(self):
+        """Test that all check types share the cache."""
+        url = self.url.replace('127.0.0.1', 'localhost')
+        port = self.server.server_port
+        checks.HTTPCheck(url, 'GET').check()
+        checks.HTTPCheck(url, 'GET').check()
+        checks.PortCheck('localhost', port).check()
+        asyncio.run(checks.AsyncHTTPCheck(url, 'GET').check())
+        asyncio.run(checks.AsyncPortCheck('localhost', port).check())
+        checks.HTTPCheck(url, 'GET', fresh_dns=True).check()
+        self.assertEqual(checks.resolver.DNS_CACHE.misses, 3)
+        self.assertEqual(checks.resolver.DNS_CACHE.hits, 3)
+
+
 class TestPortCheck(unittest.TestCase):
     """Test PortCheck."""
 
@@ -143,6 +444,123 @@ class TestPortCheck(unittest.TestCase):
                       invalid_port_check.check().message)
 
 
+class TestAsyncPortCheck(unittest.TestCase):
+    """Test AsyncPortCheck."""
+
+    def setUp(self):
+        """Setup AsyncPortCheck tests."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        """Tear down AsyncPortCheck tests."""
+        self.listener.close()
+
+    def test_open_port(self):
+        """Test against a local listening port."""
+        open_check = checks.AsyncPortCheck('127.0.0.1', self.port)
+        self.assertTrue(asyncio.run(open_check.check()).availability)
+
+    def test_timings(self):
+        """Test per-phase timings of port checks."""
+        for port_check in (checks.PortCheck, checks.AsyncPortCheck):
+            timed_check = port_check('localhost', self.port, timings=True)
+            result = timed_check.check()
+            if asyncio.iscoroutine(result):
+                result = asyncio.run(result)
+            self.assertTrue(result.availability)
+            self.assertEqual(set(result.timings), {'dns', 'connect', 'total'})
+
+    def test_invalid_port(self):
+        """Test the handling of out-of-range ports."""
+        invalid_port_check = checks.AsyncPortCheck('127.0.0.1', 424242)
+        self.assertFalse(asyncio.run(invalid_port_check.check()).availability)
+
+
+class TestPortScanner(unittest.TestCase):
+    """Test PortScanner."""
+
+    def setUp(self):
+        """Setup PortScanner tests."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('127.0.0.1', 0))
+        self.closed_port = closed.getsockname()[1]
+        closed.close()
+
+    def tearDown(self):
+        """Tear down PortScanner tests."""
+        self.listener.close()
+
+    def test_scan(self):
+        """Test results of a batch within a small socket budget."""
+        port_checks = [checks.PortCheck('127.0.0.1', self.port),
+                       checks.PortCheck('127.0.0.1', self.closed_port),
+                       checks.PortCheck('127.0.0.1', 424242),
+                       checks.PortCheck('localhost', self.port,
+                                        timings=True)]
+        results = checks.PortScanner(max_open=2).scan(port_checks * 5)
+        self.assertEqual([result.availability for result in results],
+                         [True, False, False, True] * 5)
+        self.assertIn('Connection refused', results[1].message)
+        self.assertIn('port must be 0-65535', results[2].message)
+        self.assertEqual(set(results[3].timings), {'dns', 'connect', 'total'})
+        self.assertEqual(checks.port.SOCKET_BUDGET.slots._value,
+                         checks.port.SOCKET_BUDGET.size)
+
+    def test_all_failed(self):
+        """Test that batches failing before any connect return."""
+        port_checks = [checks.PortCheck('fancy.but.invalid', 80),
+                       checks.PortCheck('127.0.0.1', 99999)]
+        with mock.patch('gefion.checks.resolver.DNS_CACHE.resolve',
+                        side_effect=socket.gaierror(-2, 'Name unknown')):
+            results = checks.PortScanner().scan(port_checks[:1])
+        self.assertIn('Name unknown', results[0].message)
+        results = checks.PortScanner().scan(port_checks[1:] * 3)
+        self.assertEqual([result.availability for result in results],
+                         [False] * 3)
+
+    def test_budget(self):
+        """Test that scanners stay within a resized SOCKET_BUDGET."""
+        self.addCleanup(checks.port.SOCKET_BUDGET.configure,
+                        checks.port.SOCKET_BUDGET.size)
+        checks.port.SOCKET_BUDGET.configure(2)
+        results = checks.PortScanner(max_open=10).scan(
+            [checks.PortCheck('127.0.0.1', self.port)] * 6)
+        self.assertTrue(all(result.availability for result in results))
+        self.assertEqual(checks.port.SOCKET_BUDGET.slots._value, 2)
+
+    def test_timeout(self):
+        """Test that unanswered connects time out individually."""
+        backlogged = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        backlogged.bind(('127.0.0.1', 0))
+        backlogged.listen(0)
+        port = backlogged.getsockname()[1]
+        pending = list()
+        for _ in range(3):  # Fill the backlog so further SYNs are dropped.
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            sock.connect_ex(('127.0.0.1', port))
+            pending.append(sock)
+        port_checks = [checks.PortCheck('127.0.0.1', port, timeout=0.2),
+                       checks.PortCheck('127.0.0.1', self.port)]
+        start_time = time.perf_counter()
+        results = checks.PortScanner().scan(port_checks)
+        self.assertLess(time.perf_counter() - start_time, 1)
+        self.assertEqual(results[0].message, 'timed out')
+        self.assertGreaterEqual(results[0].runtime, 0.2)
+        self.assertTrue(results[1].availability)
+        self.assertEqual(checks.port.SOCKET_BUDGET.slots._value,
+                         checks.port.SOCKET_BUDGET.size)
+        for sock in pending + [backlogged]:
+            sock.close()
+
+
 class TestResult(unittest.TestCase):
     """Test Result class."""
 
@@ -176,5 +594,6 @@ class TestResult(unittest.TestCase):
         expected_dict = {'availability': False,
                          'runtime': 1.03e-05,
                          'message': 'Something happened.',
-                         'timestamp': 1480000000}
+                         'timestamp': 1480000000,
+                         'attempts': 1}
         self.assertEqual(result.api_serialised, expected_dict)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Tests for database helpers."""
+
+import unittest
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from gefion.database import (MonitorCache, Route, RoutingCache, add_columns,
+                             create_schema)
+from gefion.models import Contact, Monitor
+
+
+# Tables as created before retries, intervals and the result history.
+LEGACY_SCHEMA = (
+    'CREATE TABLE monitors (id INTEGER NOT NULL, name VARCHAR, '
+    'unique_id VARCHAR, "check" VARCHAR, arguments VARCHAR, worker VARCHAR, '
+    'frequency INTEGER, last_availability BOOLEAN, last_message VARCHAR, '
+    'last_updated DATETIME, PRIMARY KEY (id))',
+    'CREATE TABLE contacts (id INTEGER NOT NULL, name VARCHAR, '
+    'notifier VARCHAR, destination VARCHAR, PRIMARY KEY (id))',
+    'CREATE TABLE contactassociations (monitor_id INTEGER, '
+    'contact_id INTEGER, FOREIGN KEY(monitor_id) REFERENCES monitors (id), '
+    'FOREIGN KEY(contact_id) REFERENCES contacts (id))',
+    "INSERT INTO monitors (name, unique_id, \"check\", frequency) "
+    "VALUES ('old', 'uuid-old', 'port', 5)")
+
+
+class TestCreateSchema(unittest.TestCase):
+    """Test create_schema on databases of earlier versions."""
+
+    def setUp(self):
+        """Setup create_schema tests."""
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as connection:
+            for statement in LEGACY_SCHEMA:
+                connection.execute(text(statement))
+
+    def tearDown(self):
+        """Tear down create_schema tests."""
+        self.engine.dispose()
+
+    def test_upgrade(self):
+        """Test that missing columns are added to existing rows."""
+        create_schema(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        monitor = session.query(Monitor).one()
+        self.assertEqual(monitor.name, 'old')
+        self.assertIsNone(monitor.interval)
+        self.assertEqual(monitor.max_attempts, 3)
+        self.assertEqual(monitor.retry_backoff, 3)
+        session.close()
+        self.assertEqual(add_columns(self.engine), list())
+
+
+class TestMonitorCache(unittest.TestCase):
+    """Test MonitorCache."""
+
+    def setUp(self):
+        """Setup MonitorCache tests."""
+        self.engine = create_engine('sqlite://')
+        create_schema(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.session.add_all([Monitor(name='one', unique_id='uuid-1'),
+                              Monitor(name='two', unique_id='uuid-2')])
+        self.session.commit()
+        self.cache = MonitorCache(ttl=60)
+        self.statements = list()
+        event.listen(self.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        """Tear down MonitorCache tests."""
+        self.cache.close()
+        self.session.close()
+        self.engine.dispose()
+
+    def record(self, connection, cursor, statement, *args):
+        """Record executed statement."""
+        self.statements.append(statement)
+
+    def test_primary_keys(self):
+        """Test exact matches by ID or unique ID."""
+        self.assertEqual(
+            self.cache.primary_keys(self.session, [
+                ('1', None), (None, 'uuid-2'), ('%', 'uuid-%'),
+                ('2', 'old'), ('9', 'uuid-1'), ('9', '')]),
+            [1, 2, None, 2, 1, None])
+
+    def test_cached(self):
+        """Test that cached lookups do not query."""
+        self.cache.primary_keys(self.session, [('1', 'uuid-1')])
+        self.statements.clear()
+        self.assertEqual(
+            self.cache.primary_keys(self.session, [('1', 'uuid-1')]), [1])
+        self.assertEqual(self.statements, list())
+
+    def test_invalidate(self):
+        """Test that changed Monitors are invalidated."""
+        self.cache.primary_keys(self.session, [(None, 'uuid-1')])
+        monitor = self.session.get(Monitor, 1)
+        monitor.unique_id = 'uuid-3'
+        self.session.commit()
+        self.assertEqual(self.cache.by_unique_id, dict())
+        self.assertEqual(
+            self.cache.primary_keys(self.session, [(None, 'uuid-1')]),
+            [None])
+
+    def test_index(self):
+        """Test that unique IDs are looked up by index."""
+        with self.engine.begin() as connection:  # As in older databases.
+            connection.execute(text('DROP INDEX ix_monitors_unique_id'))
+        create_schema(self.engine)
+        with self.engine.connect() as connection:
+            plan = connection.execute(text(
+                'EXPLAIN QUERY PLAN SELECT id FROM monitors '
+                'WHERE unique_id = :unique_id'), {'unique_id': 'x'}).all()
+        self.assertIn('USING', ' '.join(row[-1] for row in plan))
+
+
+class TestRoutingCache(unittest.TestCase):
+    """Test RoutingCache."""
+
+    def setUp(self):
+        """Setup RoutingCache tests."""
+        self.engine = create_engine('sqlite://')
+        create_schema(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        ops = Contact(name='ops', notifier='telegram', destination='42')
+        self.session.add_all([
+            Monitor(name='monitor{}'.format(index), contacts=[ops])
+            for index in range(100)])
+        self.session.commit()
+        self.cache = RoutingCache(ttl=60)
+        self.statements = list()
+        event.listen(self.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        """Tear down RoutingCache tests."""
+        self.cache.close()
+        self.session.close()
+        self.engine.dispose()
+
+    def record(self, connection, cursor, statement, *args):
+        """Record executed statement."""
+        self.statements.append(statement)
+
+    def test_eager(self):
+        """Test that contacts of many Monitors are loaded in two queries."""
+        routes = self.cache.get_many(self.session, list(range(1, 102)))
+        self.assertEqual(len(routes), 100)
+        self.assertEqual(routes[1], Route('monitor0', (('telegram', '42'),)))
+        self.assertEqual(len(self.statements), 2)
+        self.statements.clear()
+        self.assertEqual(self.cache.get(self.session, 100).name, 'monitor99')
+        self.assertIsNone(self.cache.get(self.session, 101))
+        self.assertEqual(len(self.statements), 1)  # Only the unknown ID.
+
+    def test_invalidate(self):
+        """Test that Monitor and Contact changes invalidate entries."""
+        self.cache.load(self.session)
+        monitor = self.session.get(Monitor, 1)
+        monitor.contacts.append(Contact(notifier='postmark',
+                                        destination='ops@example.com'))
+        self.session.commit()
+        self.assertNotIn(1, self.cache.routes)
+        self.assertIn(2, self.cache.routes)
+        self.assertEqual(len(self.cache.get(self.session, 1).contacts), 2)
+        contact = self.session.get(Contact, 1)
+        contact.destination = '43'
+        self.session.commit()
+        self.assertEqual(self.cache.routes, dict())
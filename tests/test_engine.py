@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Tests for the asyncio check engine."""
+
+import asyncio
+import json
+import socket
+import unittest
+from unittest import mock
+
+from gefion.engine import AsyncEngine
+
+
+class FakeBuffer(object):
+    """Duck-types ResultBuffer, recording results."""
+
+    def __init__(self):
+        """Initialise FakeBuffer."""
+        self.added = []
+        self.closed = False
+
+    def add(self, monitor_id, unique_id, result):
+        """Record result."""
+        self.added.append((monitor_id, unique_id, result))
+
+    def close(self):
+        """Record closing."""
+        self.closed = True
+
+
+class TestAsyncEngine(unittest.TestCase):
+    """Test AsyncEngine."""
+
+    def setUp(self):
+        """Setup AsyncEngine tests."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1024)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        """Tear down AsyncEngine tests."""
+        self.listener.close()
+
+    def test_init(self):
+        """Test the initialisation of the AsyncEngine class."""
+        init_engine = AsyncEngine(concurrency=42, max_attempts=1)
+        self.assertEqual(init_engine.concurrency, 42)
+        self.assertEqual(init_engine.max_attempts, 1)
+
+    def test_run(self):
+        """Test running many checks with limited concurrency."""
+        engine = AsyncEngine(concurrency=50, max_attempts=1)
+        results = engine.run(
+            [('port', {'host': '127.0.0.1', 'port': self.port})] * 200)
+        self.assertEqual(len(results), 200)
+        self.assertTrue(all(result.availability for result in results))
+
+    def test_unknown_check(self):
+        """Test that unknown check types yield no result."""
+        engine = AsyncEngine()
+        self.assertEqual(engine.run([('invalid', {})]), [None])
+
+    def test_retry(self):
+        """Test that failed checks are attempted again."""
+        engine = AsyncEngine(max_attempts=2, retry_backoff=0.01)
+        results = engine.run([('port', {'host': '127.0.0.1',
+                                        'port': 424242})])
+        self.assertFalse(results[0].availability)
+        self.assertEqual(results[0].attempts, 2)
+
+    def test_sync(self):
+        """Test that served monitors follow the assignment of master."""
+        engine = AsyncEngine()
+        buffer = FakeBuffer()
+        monitor = {'id': 1, 'unique_id': 'a', 'check': 'port',
+                   'arguments': json.dumps({'host': '127.0.0.1',
+                                            'port': self.port}),
+                   'frequency': 1}
+        responses = [([monitor], 'etag'), (None, 'etag'),
+                     ([dict(monitor, id=2, unique_id='b')], 'etag2')]
+        calls = list()
+
+        def request_monitors(config, etag):
+            calls.append((etag, set(engine.tasks)))
+            return responses[min(len(calls), len(responses)) - 1]
+
+        with mock.patch('gefion.engine.request_monitors',
+                        side_effect=request_monitors), \
+                self.assertLogs('gefion.engine') as logs:
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(asyncio.wait_for(
+                    engine.serve(dict(), buffer, sync_interval=0.05,
+                                 stats_interval=0.1), 0.3))
+        self.assertTrue(any('Lag stats' in line for line in logs.output))
+        self.assertEqual(calls[:4], [(None, set()), ('etag', {1}),
+                                     ('etag', {1}), ('etag2', {2})])
+        self.assertEqual(engine.tasks, dict())
+        self.assertTrue(buffer.closed)
+
+    def test_failing_monitor(self):
+        """Test that runs which raise are logged and run again."""
+        engine = AsyncEngine()
+        monitor = {'id': 1, 'unique_id': 'a', 'check': 'port',
+                   'arguments': json.dumps({'bogus': 1}), 'interval': 0.05}
+
+        async def run_monitor():
+            await engine.start()
+            try:
+                await asyncio.wait_for(
+                    engine.run_monitor(monitor, FakeBuffer()), 0.3)
+            finally:
+                await engine.close()
+
+        with self.assertLogs('gefion.engine') as logs:
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(run_monitor())
+        self.assertGreater(sum('Monitor 1 failed to run' in line
+                               for line in logs.output), 1)
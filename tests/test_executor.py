@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Tests for the in-process executor and worker runtime."""
+
+import json
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import requests
+
+from gefion.checks import Result
+from gefion.executor import CheckExecutor, ExecutorStats, timed_call
+from gefion.worker import Worker
+from gefion.worker_tasks import run_port_scan
+
+
+def add(a, b):
+    """Add two numbers, picklable for process pools."""
+    return a + b
+
+
+class FakeExecutor(object):
+    """Duck-types CheckExecutor, recording submissions."""
+
+    def __init__(self):
+        """Initialise FakeExecutor."""
+        self.submitted = []
+        self.availability = True
+
+    def submit(self, func, *args):
+        """Record submission, returning a completed future."""
+        self.submitted.append(args)
+        result = Result(self.availability, 0, '')
+        future = Future()
+        future.set_result(([result] * len(args[0])
+                           if func is run_port_scan else result, 0))
+        return future
+
+    def shutdown(self, wait=True):
+        """Do nothing, as nothing runs."""
+        pass
+
+
+class FakeBuffer(object):
+    """Duck-types ResultBuffer, recording results."""
+
+    def __init__(self):
+        """Initialise FakeBuffer."""
+        self.added = []
+
+    def add(self, monitor_id, unique_id, result):
+        """Record result."""
+        self.added.append((monitor_id, unique_id, result))
+
+    def close(self):
+        """Do nothing, as nothing is buffered."""
+        pass
+
+
+class TestCheckExecutor(unittest.TestCase):
+    """Test CheckExecutor."""
+
+    def setUp(self):
+        """Setup CheckExecutor tests."""
+        pass
+
+    def tearDown(self):
+        """Tear down CheckExecutor tests."""
+        pass
+
+    def test_timed_call(self):
+        """Test the timed_call() method."""
+        value, elapsed = timed_call(add, 1, 2)
+        self.assertEqual(value, 3)
+        self.assertGreaterEqual(elapsed, 0)
+
+    def test_invalid_kind(self):
+        """Test that unknown pool kinds are rejected."""
+        self.assertRaises(ValueError, CheckExecutor, 'fork')
+
+    def test_thread_pool(self):
+        """Test running jobs in a thread pool."""
+        executor = CheckExecutor('thread', 4)
+        futures = [executor.submit(add, i, 1) for i in range(20)]
+        self.assertEqual([future.result()[0] for future in futures],
+                         list(range(1, 21)))
+        executor.shutdown()
+        self.assertEqual(executor.stats.jobs, 20)
+        self.assertGreaterEqual(executor.stats.max_overhead,
+                                executor.stats.mean_overhead)
+
+    def test_process_pool(self):
+        """Test running jobs in a process pool."""
+        executor = CheckExecutor('process', 2)
+        self.assertEqual(executor.submit(add, 40, 2).result()[0], 42)
+        executor.shutdown()
+        self.assertEqual(executor.stats.jobs, 1)
+
+    def test_stats(self):
+        """Test the ExecutorStats class."""
+        stats = ExecutorStats()
+        self.assertEqual(stats.mean_overhead, 0.0)
+        stats.record(0.1)
+        stats.record(0.3, failed=True)
+        self.assertEqual(stats.api_serialised,
+                         {'jobs': 2, 'failures': 1,
+                          'mean_overhead': 0.2, 'max_overhead': 0.3})
+
+
+class TestWorker(unittest.TestCase):
+    """Test Worker."""
+
+    def setUp(self):
+        """Setup Worker tests."""
+        self.executor = FakeExecutor()
+        self.buffer = FakeBuffer()
+        self.worker = Worker({'master': {'endpoint': 'http://master/'}},
+                             self.executor, self.buffer)
+        self.worker.monitors = {1: {'id': 1, 'unique_id': 'a',
+                                    'check': 'port',
+                                    'arguments': json.dumps({'port': 1}),
+                                    'frequency': 1}}
+        self.worker.timers.push(1, 0)
+
+    def tearDown(self):
+        """Tear down Worker tests."""
+        pass
+
+    def test_tick(self):
+        """Test that due monitors are submitted once per interval."""
+        self.assertEqual(self.worker.tick(10), 1)
+        self.assertEqual(self.executor.submitted[0],
+                         ('port', {'port': 1}))
+        self.assertEqual(self.worker.timers.get(1)[0], 60)  # On the grid.
+        self.assertEqual(self.worker.tick(59), 0)
+        self.assertEqual(self.worker.tick(60), 1)
+        self.assertEqual(self.worker.lag.runs, 2)
+        self.assertEqual(self.worker.lag.max_lag, 10)
+        self.assertEqual(len(self.buffer.added), 1)
+        self.assertEqual(self.buffer.added[0][:2], (1, 'a'))
+
+    def test_port_scan(self):
+        """Test that due port checks are batched into one scan."""
+        self.worker.monitors[2] = dict(self.worker.monitors[1], id=2,
+                                       unique_id='b',
+                                       arguments=json.dumps({
+                                           'host': '127.0.0.1', 'port': 2}))
+        self.worker.monitors[3] = dict(self.worker.monitors[2], id=3,
+                                       unique_id='c')
+        self.worker.timers.push(2, 0)
+        self.worker.timers.push(3, 0)
+        self.assertEqual(self.worker.tick(0), 3)
+        self.assertEqual(len(self.executor.submitted), 2)
+        self.assertEqual(self.executor.submitted[1], ('port', {'port': 1}))
+        port_checks = self.executor.submitted[0][0]
+        self.assertEqual([port_check.port for port_check in port_checks],
+                         [2, 2])
+        self.assertEqual([self.worker.running[monitor_id][2]
+                          for monitor_id in (2, 3)], [0, 1])
+        self.worker.tick(1)
+        self.assertEqual(sorted(added[1] for added in self.buffer.added),
+                         ['a', 'b', 'c'])
+
+    def test_retry(self):
+        """Test that failed attempts are deferred, not waited on."""
+        self.executor.availability = False
+        self.worker.monitors[1]['retry_backoff'] = 10
+        self.assertEqual(self.worker.tick(0), 1)
+        self.assertEqual(self.worker.tick(1), 0)  # Harvested, deferred.
+        due, attempt = self.worker.retries.get(1)
+        self.assertTrue(11 <= due <= 21)
+        self.assertEqual(attempt, 2)
+        self.assertEqual(self.worker.tick(21), 1)
+        self.assertEqual(self.worker.running[1][1], 2)
+        self.worker.tick(22)
+        self.assertEqual(self.buffer.added, [])  # Still retrying.
+        self.worker.tick(100)
+        self.worker.tick(101)
+        self.assertEqual(self.buffer.added[0][2].attempts, 3)
+
+    def test_sync(self):
+        """Test that syncs only touch changed monitors."""
+        self.worker.timers.push(1, 30)
+        self.worker.retries.push(1, 40, 2)
+        changed = dict(self.worker.monitors[1], unique_id='b')
+        added = dict(changed, id=2)
+        with mock.patch('gefion.worker.request_monitors',
+                        return_value=([changed, added], 'etag')):
+            self.worker.sync()
+        self.assertEqual(self.worker.etag, 'etag')
+        self.assertEqual(self.worker.monitors[1]['unique_id'], 'b')
+        self.assertEqual(self.worker.timers.get(1)[0], 30)  # Timing kept.
+        self.assertIn(2, self.worker.timers)
+
+        with mock.patch('gefion.worker.request_monitors',
+                        return_value=(None, 'etag')) as request_monitors:
+            self.worker.sync()
+        request_monitors.assert_called_with(self.worker.config, 'etag')
+        self.assertEqual(len(self.worker.monitors), 2)
+
+        with mock.patch('gefion.worker.request_monitors',
+                        return_value=([added], 'etag2')):
+            self.worker.sync()
+        self.assertNotIn(1, self.worker.timers)
+        self.assertNotIn(1, self.worker.retries)
+
+    def test_sync_failure(self):
+        """Test that failed syncs keep the worker and its Monitors."""
+        with mock.patch('gefion.worker.request_monitors',
+                        side_effect=ValueError('Not JSON.')), \
+                self.assertLogs('gefion.worker'):
+            self.assertFalse(self.worker.try_sync())
+        self.assertIn(1, self.worker.monitors)
+        with mock.patch('gefion.worker.request_monitors',
+                        side_effect=[requests.exceptions.ConnectionError()]), \
+                mock.patch('time.sleep', side_effect=KeyboardInterrupt), \
+                self.assertLogs('gefion.worker'):
+            with self.assertRaises(KeyboardInterrupt):
+                self.worker.run_forever()
+        self.assertIn(1, self.worker.running)  # Ticked after the failure.
+
+    def test_sync_interval(self):
+        """Test that monitors with changed intervals are re-phased."""
+        self.worker.timers.push(1, 1000000)
+        changed = dict(self.worker.monitors[1], interval=10)
+        with mock.patch('gefion.worker.request_monitors',
+                        return_value=([changed], 'etag')):
+            self.worker.sync()
+        self.assertLessEqual(self.worker.timers.get(1)[0] - time.monotonic(),
+                             10)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Tests for the result history."""
+
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from gefion.checks import Result
+from gefion.database import create_schema
+from gefion.history import (DAY, HOUR, MINUTE, Aggregate, compact, cover,
+                            record_results, summarise)
+from gefion.models import ResultRecord, Rollup
+
+# Midnight of a day, so buckets of all resolutions align.
+EPOCH = 1000 * DAY
+
+
+class TestAggregate(unittest.TestCase):
+    """Test Aggregate."""
+
+    def setUp(self):
+        """Setup Aggregate tests."""
+        self.aggregate = Aggregate()
+
+    def tearDown(self):
+        """Tear down Aggregate tests."""
+        pass
+
+    def test_percentile(self):
+        """Test percentiles within a histogram bucket."""
+        for millisecond in range(1, 101):
+            self.aggregate.add(millisecond != 100, millisecond / 1000)
+        summary = self.aggregate.api_serialised
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['uptime'], 0.99)
+        self.assertEqual(summary['runtime_min'], 0.001)
+        self.assertEqual(summary['runtime_max'], 0.1)
+        self.assertAlmostEqual(summary['runtime_p50'], 0.05, delta=0.0125)
+        self.assertAlmostEqual(summary['runtime_p95'], 0.095, delta=0.024)
+        self.assertLessEqual(summary['runtime_p99'], 0.1)
+
+    def test_empty(self):
+        """Test summary of no results."""
+        self.assertIsNone(self.aggregate.api_serialised['uptime'])
+        self.assertIsNone(self.aggregate.percentile(0.5))
+
+
+class TestHistory(unittest.TestCase):
+    """Test recording, compacting and summarising results."""
+
+    def setUp(self):
+        """Setup history tests."""
+        self.engine = create_engine('sqlite://')
+        create_schema(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.statements = list()
+        event.listen(self.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        """Tear down history tests."""
+        self.session.close()
+        self.engine.dispose()
+
+    def record(self, connection, cursor, statement, *args):
+        """Record executed statement."""
+        self.statements.append(statement)
+
+    def test_rollups(self):
+        """Test that rollups are maintained incrementally."""
+        record_results(self.session, [
+            (1, Result(True, 0.1, 'Up.', EPOCH + 1)),
+            (1, Result(False, 0.3, 'Down.', EPOCH + 61))])
+        self.session.commit()
+        record_results(self.session, [
+            (1, Result(True, 0.2, 'Up.', EPOCH + 62))])
+        self.session.commit()
+        self.assertEqual(self.session.query(ResultRecord).count(), 3)
+        rollups = {(rollup.resolution, rollup.bucket): rollup
+                   for rollup in self.session.query(Rollup)}
+        self.assertEqual(sorted(rollups), [
+            (MINUTE, EPOCH), (MINUTE, EPOCH + 60), (HOUR, EPOCH),
+            (DAY, EPOCH)])
+        self.assertEqual(rollups[(MINUTE, EPOCH + 60)].count, 2)
+        self.assertEqual(rollups[(DAY, EPOCH)].count, 3)
+        self.assertEqual(rollups[(DAY, EPOCH)].failures, 1)
+        self.assertEqual(rollups[(DAY, EPOCH)].runtime_min, 0.1)
+        self.assertEqual(rollups[(DAY, EPOCH)].runtime_max, 0.3)
+
+    def test_concurrent(self):
+        """Test that rollups inserted meanwhile are merged, not clobbered."""
+        inserted = list()
+
+        def insert_first(connection, cursor, statement, *args):
+            # Another writer inserts the first rollup of the bucket.
+            if statement.startswith('INSERT INTO rollups') and not inserted:
+                inserted.append(statement)
+                cursor.execute(
+                    'INSERT INTO rollups (monitor_id, resolution, bucket, '
+                    'count, failures, runtime_sum) VALUES (1, ?, ?, 5, 1, 0)',
+                    (MINUTE, EPOCH))
+        event.listen(self.engine, 'before_cursor_execute', insert_first)
+        record_results(self.session, [(1, Result(True, 0.1, 'Up.', EPOCH))])
+        self.session.commit()
+        rollup = self.session.query(Rollup).filter(
+            Rollup.resolution == MINUTE).one()
+        self.assertEqual((rollup.count, rollup.failures), (6, 1))
+        self.assertEqual(self.session.query(Rollup).count(), 3)
+
+    def test_cover(self):
+        """Test that ranges are covered by the coarsest buckets."""
+        self.assertEqual(
+            sorted(cover(EPOCH - 90, EPOCH + DAY + HOUR + 30)),
+            [(MINUTE, EPOCH - MINUTE, EPOCH),
+             (HOUR, EPOCH + DAY, EPOCH + DAY + HOUR),
+             (DAY, EPOCH, EPOCH + DAY)])
+        self.assertEqual(cover(EPOCH + 10, EPOCH + 50), list())
+
+    def test_summarise(self):
+        """Test that summaries read rollups with one query."""
+        record_results(self.session, [
+            (1, Result(second % 600 != 0, 0.01, '', EPOCH + second))
+            for second in range(0, 2 * DAY, 30)])
+        record_results(self.session, [(2, Result(False, 1, '', EPOCH))])
+        self.session.commit()
+        self.statements.clear()
+        summary = summarise(self.session, 1, EPOCH - DAY,
+                            EPOCH + DAY + 90).api_serialised
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(summary['count'], 2880 + 2)
+        self.assertEqual(summary['failures'], 144 + 1)
+        self.assertEqual(summary['runtime_max'], 0.01)
+
+    def test_compact(self):
+        """Test that expired history is deleted."""
+        record_results(self.session, [
+            (1, Result(True, 0.1, '', EPOCH)),
+            (1, Result(True, 0.1, '', EPOCH + 20 * DAY))])
+        self.session.commit()
+        self.assertEqual(compact(self.session, now=EPOCH + 21 * DAY), 2)
+        self.session.commit()
+        self.assertEqual(self.session.query(ResultRecord).count(), 1)
+        self.assertEqual(
+            self.session.query(Rollup).filter(
+                Rollup.bucket == EPOCH).count(), 2)
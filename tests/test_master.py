@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Tests for the master endpoints."""
+
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+
+from gefion.models import Monitor
+
+
+class MasterTestCase(unittest.TestCase):
+    """Imports run_master with a temporary database for each test."""
+
+    def setUp(self):
+        """Import master app."""
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        handle, self.config_path = tempfile.mkstemp(suffix='.yml')
+        with os.fdopen(handle, 'w') as config_file:
+            yaml.safe_dump({'database': {'uri': 'sqlite:///' + self.path},
+                            'workers': {'internal01': {'key': 'secret'}}},
+                           config_file)
+        sys.modules.pop('run_master', None)
+        with mock.patch('sys.argv', ['run_master.py', '-c',
+                                     self.config_path]):
+            self.master = importlib.import_module('run_master')
+        self.master.queue = mock.Mock()
+        self.client = self.master.app.test_client()
+        self.auth = ('internal01', 'secret')
+        with self.master.app.app_context():
+            self.monitor = Monitor(name='example', unique_id='uuid',
+                                   check='port', arguments='{}',
+                                   worker='internal01', frequency=1)
+            self.master.db.session.add(self.monitor)
+            self.master.db.session.commit()
+            self.monitor_id = self.monitor.id
+
+    def tearDown(self):
+        """Dispose master app."""
+        with self.master.app.app_context():
+            self.master.db.engine.dispose()
+        sys.modules.pop('run_master', None)
+        os.remove(self.path)
+        os.remove(self.config_path)
+
+
+class TestMonitors(MasterTestCase):
+    """Test the /monitors endpoint."""
+
+    def test_etag(self):
+        """Test that unchanged assignments are answered with 304."""
+        response = self.client.get('/monitors', auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([monitor['id'] for monitor
+                          in response.get_json()['monitors']],
+                         [self.monitor_id])
+        etag = response.headers['ETag']
+        response = self.client.get('/monitors', auth=self.auth,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        with self.master.app.app_context():
+            self.master.db.session.query(Monitor).update({'frequency': 5})
+            self.master.db.session.commit()
+        response = self.client.get('/monitors', auth=self.auth,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_unauthorised(self):
+        """Test that unknown workers are refused."""
+        response = self.client.get('/monitors',
+                                   auth=('internal01', 'wrong'))
+        self.assertEqual(response.status_code, 401)
+
+
+class TestResults(MasterTestCase):
+    """Test the /results endpoint."""
+
+    def test_results(self):
+        """Test that submissions are enqueued or rejected one by one."""
+        result = {'availability': True, 'runtime': 0.1, 'response': '',
+                  'timestamp': 1480000000}
+        response = self.client.post('/results', json={'results': [
+            {'id': self.monitor_id, 'unique_id': 'uuid', 'result': result},
+            {'id': 999, 'unique_id': 'unknown', 'result': result},
+            'invalid', None]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(),
+                         {'accepted': 1, 'rejected': ['invalid', None, 999]})
+        jobs = self.master.queue.enqueue_many.call_args[0][0]
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].args[0]['monitor_id'], self.monitor_id)
+
+    def test_invalid_body(self):
+        """Test that bodies without a results list are refused."""
+        response = self.client.post('/results', json={'results': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+        self.master.queue.enqueue_many.assert_not_called()
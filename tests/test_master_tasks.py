@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Tests for master tasks."""
+
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import yaml
+from sqlalchemy import event
+
+from gefion.checks import Result
+
+from gefion import database, master_tasks, state
+from gefion.models import Contact, Monitor
+from gefion.state import StateCache
+from tests.test_state import FakeRedis
+
+
+class TestProcessResult(unittest.TestCase):
+    """Test process_result with a pooled SQLite database."""
+
+    def setUp(self):
+        """Setup process_result tests."""
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.config = {'database': {'uri': 'sqlite:///' + self.path},
+                       'telegram': {'token': '0:invalidtoken'}}
+        handle, self.config_path = tempfile.mkstemp(suffix='.yml')
+        with os.fdopen(handle, 'w') as config_file:
+            yaml.safe_dump(self.config, config_file)
+        session = database.get_session_factory(self.config)()
+        self.monitor = Monitor(name='example', unique_id='uuid', check='port',
+                               arguments='{}', worker='internal01',
+                               frequency=1, last_availability=True)
+        self.monitor.contacts.append(Contact(name='ops', notifier='telegram',
+                                             destination='42'))
+        session.add(self.monitor)
+        session.commit()
+        session.refresh(self.monitor)
+        session.expunge(self.monitor)
+        session.close()
+        self.state_cache = StateCache(FakeRedis())
+        patcher = mock.patch('gefion.master_tasks.get_state_cache',
+                             return_value=self.state_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        state.WRITE_BEHIND.set()
+
+    def tearDown(self):
+        """Tear down process_result tests."""
+        state.WRITE_BEHIND.clear()
+        state.close_writers()
+        database.dispose()
+        master_tasks.CONFIGS.clear()
+        os.remove(self.path)
+        os.remove(self.config_path)
+
+    def payload(self, availability):
+        """Make payload of a result of the Monitor."""
+        return master_tasks.make_payload(
+            self.monitor.id,
+            {'availability': availability, 'runtime': 0.1,
+             'message': 'Down.' if not availability else '',
+             'timestamp': time.time(), 'unknown': 'field'},
+            self.config_path)
+
+    def test_payload(self):
+        """Test that payloads are versioned, explicit and compact."""
+        payload = self.payload(False)
+        self.assertEqual(payload['version'], master_tasks.PAYLOAD_VERSION)
+        self.assertEqual(set(payload['result']),
+                         {'availability', 'runtime', 'message', 'timestamp'})
+        legacy_size = len(pickle.dumps((self.monitor, payload['result'],
+                                        self.config)))
+        self.assertLess(len(pickle.dumps(payload)) * 2, legacy_size)
+
+    def test_reuse(self):
+        """Test that the engine and config are loaded once per process."""
+        factory = database.get_session_factory(self.config)
+        with mock.patch('gefion.database.create_engine') as create_engine, \
+                mock.patch('gefion.master_tasks.dispatch'), \
+                mock.patch('yaml.safe_load', wraps=yaml.safe_load) as load:
+            master_tasks.process_result(self.payload(True))
+            master_tasks.process_result(self.payload(False))
+        create_engine.assert_not_called()
+        self.assertEqual(load.call_count, 1)
+        self.assertIs(database.get_session_factory(self.config), factory)
+        self.assertEqual(factory.kw['bind'].pool.checkedout(), 0)
+
+    def test_update(self):
+        """Test that results are stored and changes notified."""
+        with mock.patch('gefion.master_tasks.dispatch') as dispatch:
+            master_tasks.process_result(self.payload(False))
+            master_tasks.process_result(self.payload(False))
+        self.assertEqual(dispatch.call_count, 1)
+        self.assertEqual(dispatch.call_args[0][3], self.config)
+        state.close_writers()
+        session = database.get_session_factory(self.config)()
+        monitor = session.query(Monitor).one()
+        self.assertFalse(monitor.last_availability)
+        self.assertEqual(monitor.last_message, 'Down.')
+        session.close()
+
+    def test_forked(self):
+        """Test that jobs of forking workers write before they end."""
+        state.WRITE_BEHIND.clear()
+        with mock.patch('gefion.master_tasks.dispatch'):
+            master_tasks.process_result(self.payload(False))
+            writer = state.get_state_writer(self.config)
+            self.assertIsNone(writer.thread)
+            session = database.get_session_factory(self.config)()
+            self.assertFalse(session.query(Monitor.last_availability).scalar())
+            session.close()
+            with mock.patch('os.getpid', return_value=-1):
+                self.assertIsNot(state.get_state_writer(self.config), writer)
+
+    def test_dropped(self):
+        """Test that unknown versions and deleted Monitors are dropped."""
+        payload = self.payload(False)
+        with mock.patch('gefion.master_tasks.dispatch') as dispatch:
+            master_tasks.process_result(dict(payload, version=0))
+            master_tasks.process_result(dict(payload, monitor_id=42))
+        dispatch.assert_not_called()
+
+    def test_unchanged(self):
+        """Test that unchanged results do not read the database."""
+        with mock.patch('gefion.master_tasks.dispatch') as dispatch:
+            master_tasks.process_result(self.payload(True))
+            with mock.patch('gefion.master_tasks.get_session_factory') as \
+                    get_session_factory:
+                master_tasks.process_result(self.payload(True))
+                master_tasks.process_result(self.payload(True))
+            get_session_factory.return_value.assert_not_called()
+            master_tasks.process_result(self.payload(False))
+        self.assertEqual(dispatch.call_count, 1)
+        self.assertEqual(self.state_cache.get(self.monitor.id),
+                         (False, 'Down.'))
+
+    def test_routing(self):
+        """Test that changes of cached Monitors only query the state."""
+        factory = database.get_session_factory(self.config)
+        session = factory()
+        database.get_routing_cache(self.config).load(session)
+        session.close()
+        statements = list()
+        event.listen(factory.kw['bind'], 'before_cursor_execute',
+                     lambda *args: statements.append(args[2]))
+        with mock.patch('gefion.master_tasks.dispatch') as dispatch:
+            master_tasks.process_result(self.payload(False))
+        dispatch.assert_called_once()
+        self.assertEqual(dispatch.call_args[0][0], 'example')
+        self.assertEqual(dispatch.call_args[0][2], (('telegram', '42'), ))
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('contact', statements[0])
+
+
+class TestDeliver(unittest.TestCase):
+    """Test dispatch and deliver of notifications."""
+
+    def setUp(self):
+        """Setup deliver tests."""
+        handle, self.config_path = tempfile.mkstemp(suffix='.yml')
+        with os.fdopen(handle, 'w') as config_file:
+            yaml.safe_dump({'notifiers': {'concurrency': 8,
+                                          'max_attempts': 2}}, config_file)
+        self.queue = mock.Mock()
+        patcher = mock.patch('gefion.master_tasks.get_delivery_queue',
+                             return_value=self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.contacts = [('telegram', str(chat)) for chat in range(8)]
+
+    def tearDown(self):
+        """Tear down deliver tests."""
+        master_tasks.CONFIGS.clear()
+        os.remove(self.config_path)
+
+    def test_dispatch(self):
+        """Test that a state change costs one enqueue."""
+        master_tasks.dispatch('example', Result(False, 1, 'Down.'),
+                              self.contacts, dict(), self.config_path)
+        self.queue.enqueue.assert_called_once()
+        payload = self.queue.enqueue.call_args[0][1]
+        self.assertEqual(len(payload['contacts']), 8)
+        self.assertEqual(payload['changes'][0][1]['message'], 'Down.')
+
+    def test_digest(self):
+        """Test that an outage costs each contact few digests."""
+        self.queue.connection = FakeRedis()
+        config = {'notifiers': {'digest_window': 10, 'digest_size': 30}}
+        for index in range(100):
+            master_tasks.dispatch(
+                'monitor{}'.format(index), Result(False, 1, 'Down.'),
+                self.contacts[:2], config, self.config_path)
+        self.assertEqual(self.queue.enqueue_in.call_count, 2)
+        self.assertEqual(self.queue.enqueue.call_count, 2 * 3)
+        self.assertEqual(self.queue.enqueue_in.call_args[0][0].seconds, 10)
+        flush = self.queue.enqueue_in.call_args[0][2]
+        self.queue.reset_mock()
+        self.assertEqual(master_tasks.flush_digest(flush), 4)
+        self.assertEqual(master_tasks.flush_digest(flush), 0)
+        deliveries = [call[0][1] for call in
+                      self.queue.enqueue.call_args_list]
+        self.assertEqual([len(delivery['changes'])
+                          for delivery in deliveries], [30, 30, 30, 10])
+        self.assertEqual(deliveries[0]['contacts'], [['telegram', '1']])
+        with mock.patch('gefion.master_tasks.notify_batch',
+                        return_value=[True]) as notify_batch:
+            master_tasks.deliver(deliveries[-1])
+        hostname, result, destinations, _, changes = \
+            notify_batch.call_args[0][1:]
+        self.assertEqual(hostname, 'monitor99')
+        self.assertEqual(len(changes), 10)
+
+    def test_deliver(self):
+        """Test concurrent sends and retries of failed contacts."""
+        def notify_batch(notifier_name, hostname, result, destinations,
+                         config, changes):
+            time.sleep(0.2)
+            if destinations == ['3']:
+                raise RuntimeError
+            return [destination != '5' for destination in destinations]
+
+        payload = master_tasks.make_delivery(
+            [('example', Result(False, 1, 'Down.').api_serialised)],
+            self.contacts, self.config_path)
+        started = time.monotonic()
+        with mock.patch('gefion.master_tasks.notify_batch',
+                        side_effect=notify_batch):
+            failed = master_tasks.deliver(payload)
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(failed, [('telegram', '3'), ('telegram', '5')])
+            retry = self.queue.enqueue_in.call_args[0][2]
+            self.assertEqual(retry['contacts'], [['telegram', '3'],
+                                                 ['telegram', '5']])
+            self.assertEqual(retry['attempt'], 2)
+            master_tasks.deliver(retry)
+        self.queue.enqueue_in.assert_called_once()
+
+    def test_batches(self):
+        """Test that contacts of batching notifiers are sent together."""
+        contacts = self.contacts[:2] + [
+            ('postmark', 'ops{}@example.com'.format(index))
+            for index in range(3)]
+        payload = master_tasks.make_delivery(
+            [('example', Result(False, 1, 'Down.').api_serialised)],
+            contacts, self.config_path)
+        with mock.patch('gefion.master_tasks.notify_batch',
+                        side_effect=lambda *args: [True] * len(args[3])) \
+                as notify_batch:
+            self.assertEqual(master_tasks.deliver(payload), list())
+        self.assertEqual(sorted(call[0][3] for call in
+                                notify_batch.call_args_list),
+                         [['0'], ['1'], ['ops0@example.com',
+                                         'ops1@example.com',
+                                         'ops2@example.com']])
+
+    def test_limits(self):
+        """Test that every notification waits for its budgets."""
+        config = {'telegram': {'token': '123456:ABCdef', 'rate': 2}}
+        with mock.patch('gefion.master_tasks.LIMITER') as limiter, \
+                mock.patch('telegram.Bot.sendMessage'):
+            self.assertEqual(master_tasks.notify_batch(
+                'telegram', 'example', Result(False, 1, 'Down.'),
+                ['1', '2'], config), [True, True])
+        self.assertEqual(limiter.acquire.call_count, 2)
+        self.assertEqual(limiter.acquire.call_args[0][0][1],
+                         (('telegram', '123456:ABCdef', '2'), 2, 3))
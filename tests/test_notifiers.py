@@ -1,10 +1,49 @@
 # -*- coding: utf-8 -*-
 """Tests for notifiers."""
 
+import json
+import socket
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+from telegram.error import RetryAfter
 
 from gefion import notifiers
 from gefion.checks import Result
+from gefion.notifiers.clients import CLIENTS, ClientRegistry
+from gefion.notifiers.limits import RateLimiter, TokenBucket
+
+
+class PostmarkHandler(BaseHTTPRequestHandler):
+    """Stands in for the Postmark batch API, rejecting `.invalid` emails."""
+
+    protocol_version = 'HTTP/1.1'
+    batches = list()
+
+    def do_POST(self):
+        """Accept or reject each message of a batch."""
+        messages = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])))['Messages']
+        PostmarkHandler.batches.append(
+            (self.path, self.headers['X-Postmark-Server-Token'], messages))
+        body = json.dumps([
+            {'ErrorCode': 300, 'Message': 'Invalid email request',
+             'To': message['To']} if message['To'].endswith('.invalid')
+            else {'ErrorCode': 0, 'Message': 'OK', 'To': message['To']}
+            for message in messages]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Keep test output quiet."""
+        pass
 
 
 class TestCachetNotifier(unittest.TestCase):
@@ -92,6 +131,20 @@ class TestTelegramNotifier(unittest.TestCase):
         self.assertEqual(down_notifier_with_template.text,
                          '↓Test Machine2016-11-24T15:06:40Z,Msg=Msg.')
 
+    def test_digest(self):
+        """Test digest text of several state changes."""
+        message = notifiers.make_digest([
+            ('One', Result(False, 1, 'Msg.', 1480000000)),
+            ('Two', Result(True, 1, '', 1480000060))])
+        self.assertTrue(message.digest)
+        self.assertEqual(message.hostname, 'Two')
+        notifier = notifiers.TelegramNotifier(message, '-1000')
+        self.assertEqual(notifier.text.splitlines(), [
+            '*2 state changes*, 1 down and 1 up:',
+            '*One* is *DOWN* at 2016-11-24T15:06:40Z. Msg: Msg.',
+            '*Two* is *UP* at 2016-11-24T15:07:40Z.'])
+        self.assertFalse(notifiers.make_digest(message.changes[:1]).digest)
+
 
 class TestPostmarkNotifier(unittest.TestCase):
     """Test PostmarkNotifier."""
@@ -114,6 +167,18 @@ class TestPostmarkNotifier(unittest.TestCase):
                           'time_string': '2016-11-24T15:06:40Z'}
         self.assertEqual(made_model, expected_model)
 
+    def test_digest_model(self):
+        """Test Postmark template model of digests."""
+        message = notifiers.make_digest([
+            ('One', Result(False, 1, '', 1480000000)),
+            ('Test Machine', Result(True, 1, '', 1480000000))])
+        model = notifiers.postmark.make_template_model(message)
+        self.assertEqual(model['name'], 'Test Machine')
+        self.assertEqual(model['count'], 2)
+        self.assertEqual(model['changes'][0],
+                         {'name': 'One', 'availability': 'DOWN',
+                          'time_string': '2016-11-24T15:06:40Z'})
+
     def test_init(self):
         """Test the initialisation of the PostmarkNotifier class."""
         init_notifier = notifiers.PostmarkNotifier(
@@ -132,6 +197,271 @@ class TestPostmarkNotifier(unittest.TestCase):
                           'time_string': '2016-11-24T15:06:40Z'})
 
 
+class CachetHandler(BaseHTTPRequestHandler):
+    """Stands in for the Cachet components API, slow to update."""
+
+    protocol_version = 'HTTP/1.1'
+    statuses = dict()
+    puts = list()
+
+    def reply(self, component_id):
+        """Reply with the status of a component."""
+        body = json.dumps({'data': {
+            'id': component_id,
+            'status': self.statuses.get(component_id, 1)}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Serve component."""
+        self.reply(int(self.path.rsplit('/', 1)[1]))
+
+    def do_PUT(self):
+        """Update component status."""
+        component_id = int(self.path.rsplit('/', 1)[1])
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(0.2)
+        CachetHandler.statuses[component_id] = int(data.decode().split('=')[1])
+        CachetHandler.puts.append(component_id)
+        self.reply(component_id)
+
+    def log_message(self, *args):
+        """Keep test output quiet."""
+        pass
+
+
+class TestCachetStatusCache(unittest.TestCase):
+    """Test CachetNotifier status cache against a local stand-in API."""
+
+    def setUp(self):
+        """Start local Cachet stand-in."""
+        CachetHandler.statuses = {7: 4}
+        CachetHandler.puts = list()
+        notifiers.cachet.COMPONENT_STATUSES.invalidate()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CachetHandler)
+        self.url = 'http://127.0.0.1:{}/api/'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.down = notifiers.Message('Test Machine',
+                                      Result(False, 1, '', 1480000000))
+
+    def tearDown(self):
+        """Stop local Cachet stand-in."""
+        CLIENTS.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def notifier(self, component_id, **kwargs):
+        """Make CachetNotifier of the stand-in."""
+        return notifiers.CachetNotifier(self.down, component_id,
+                                        api_endpoint=self.url, **kwargs)
+
+    def test_transitions(self):
+        """Test that only transitions are sent."""
+        self.assertTrue(self.notifier(1).send())
+        self.assertTrue(self.notifier(1).send())
+        self.assertEqual(CachetHandler.puts, [1])
+        self.assertTrue(self.notifier(7, refresh_on_miss=True).send())
+        self.assertEqual(CachetHandler.puts, [1])
+
+    def test_expiry(self):
+        """Test that expired statuses are sent again."""
+        self.assertTrue(self.notifier(1, status_ttl=0).send())
+        self.assertTrue(self.notifier(1, status_ttl=0).send())
+        self.assertEqual(CachetHandler.puts, [1, 1])
+
+    def test_send_batch(self):
+        """Test that components are updated concurrently."""
+        started = time.monotonic()
+        sent = notifiers.CachetNotifier.send_batch(
+            [self.notifier(component_id) for component_id in (1, 2, 3, 4, 1)])
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(sent, [True] * 5)
+        self.assertEqual(sorted(CachetHandler.puts), [1, 2, 3, 4])
+
+
+class TestPostmarkBatch(unittest.TestCase):
+    """Test PostmarkNotifier batches against a local stand-in API."""
+
+    def setUp(self):
+        """Start local Postmark stand-in."""
+        PostmarkHandler.batches = list()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PostmarkHandler)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def tearDown(self):
+        """Stop local Postmark stand-in."""
+        CLIENTS.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_send_batch(self):
+        """Test batches of at most batch_size, with failures per email."""
+        message = notifiers.Message('Test Machine',
+                                    Result(False, 1, '', 1480000000))
+        destinations = ['ops{}@example.com'.format(index)
+                        for index in range(5)] + ['ops@example.invalid']
+        postmark = [notifiers.PostmarkNotifier(
+            message, destination, server_token='test-token',
+            template_id=111111, api_url=self.url)
+            for destination in destinations]
+        with mock.patch.object(notifiers.PostmarkNotifier, 'batch_size', 4):
+            sent = notifiers.PostmarkNotifier.send_batch(postmark)
+        self.assertEqual(sent, [True] * 5 + [False])
+        self.assertEqual([len(batch[2]) for batch in PostmarkHandler.batches],
+                         [4, 2])
+        path, token, messages = PostmarkHandler.batches[0]
+        self.assertEqual(path, '/email/batchWithTemplates/')
+        self.assertEqual(token, 'test-token')
+        self.assertEqual(messages[0]['TemplateModel']['name'],
+                         'Test Machine')
+
+    def test_unreachable(self):
+        """Test that all emails of a failed request fail."""
+        message = notifiers.Message('Test Machine',
+                                    Result(False, 1, '', 1480000000))
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:{}/'.format(closed.getsockname()[1])
+        closed.close()
+        postmark = [notifiers.PostmarkNotifier(
+            message, destination, server_token='test-token', api_url=url)
+            for destination in ('a@example.com', 'b@example.com')]
+        self.assertEqual(notifiers.PostmarkNotifier.send_batch(postmark),
+                         [False, False])
+
+
+class TestClientRegistry(unittest.TestCase):
+    """Test ClientRegistry."""
+
+    def setUp(self):
+        """Setup ClientRegistry tests."""
+        self.registry = ClientRegistry(idle_timeout=60, pool_size=2)
+
+    def tearDown(self):
+        """Tear down ClientRegistry tests."""
+        self.registry.clear()
+
+    def test_reuse(self):
+        """Test that clients are reused per notifier and credentials."""
+        factory = mock.Mock(side_effect=lambda pool_size: mock.Mock())
+        first = self.registry.get('telegram', ('token', ), factory)
+        self.assertIs(self.registry.get('telegram', ('token', ), factory),
+                      first)
+        self.assertIsNot(self.registry.get('telegram', ('other', ), factory),
+                         first)
+        factory.assert_called_with(2)
+        self.assertEqual(self.registry.api_serialised,
+                         {'clients': 2, 'created': 2, 'reused': 1})
+
+    def test_evict(self):
+        """Test that idle clients are closed and replaced."""
+        factory = mock.Mock(side_effect=lambda pool_size: mock.Mock())
+        with mock.patch('time.monotonic', return_value=0):
+            first = self.registry.get('cachet', ('endpoint', ), factory)
+        with mock.patch('time.monotonic', return_value=61):
+            second = self.registry.get('cachet', ('endpoint', ), factory)
+        self.assertIsNot(second, first)
+        first.close.assert_called_once_with()
+
+    def test_notifiers(self):
+        """Test that notifiers share the client of their credentials."""
+        message = notifiers.Message('Test Machine',
+                                    Result(False, 1, '', 1480000000))
+        with mock.patch('gefion.notifiers.telegram.CLIENTS', self.registry), \
+                mock.patch('telegram.Bot.sendMessage') as send_message:
+            for destination in ('-1000', '-1001'):
+                self.assertTrue(notifiers.TelegramNotifier(
+                    message, destination, token='123456:ABCdef').send())
+        self.assertEqual(send_message.call_count, 2)
+        self.assertEqual(self.registry.api_serialised['created'], 1)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test TokenBucket and RateLimiter."""
+
+    def setUp(self):
+        """Setup RateLimiter tests."""
+        self.limiter = RateLimiter()
+
+    def tearDown(self):
+        """Tear down RateLimiter tests."""
+        self.limiter.clear()
+
+    def test_bucket(self):
+        """Test that bursts are let through and the rest owed in order."""
+        bucket = TokenBucket(rate=10, burst=2)
+        start = bucket.updated
+        self.assertEqual([round(bucket.reserve(now=start), 3)
+                          for _ in range(5)], [0, 0, 0.1, 0.2, 0.3])
+        self.assertEqual(bucket.reserve(now=start + 1), 0)
+        self.assertTrue(bucket.full(now=start + 2))
+
+    def test_acquire(self):
+        """Test that sends beyond budget are released in order."""
+        limits = [(('telegram', 'token'), 50, 10),
+                  (('telegram', 'token', '42'), 20, 2), (('other', ), None, 1)]
+        released = list()
+        lock = threading.Lock()
+
+        def send(index):
+            self.limiter.acquire(limits)
+            with lock:
+                released.append(index)
+
+        started = time.monotonic()
+        threads = list()
+        for index in range(10):
+            threads.append(threading.Thread(target=send, args=(index, )))
+            threads[-1].start()
+            time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        self.assertEqual(released, list(range(10)))
+        self.assertGreater(elapsed, 0.35)
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(self.limiter.api_serialised['acquired'], 10)
+        self.assertEqual(self.limiter.api_serialised['delayed'], 8)
+
+    def test_shared(self):
+        """Test that buckets in Redis are reserved by its script."""
+        redis = mock.Mock()
+        script = redis.register_script.return_value
+        script.side_effect = [b'0', b'0.25', RedisConnectionError()]
+        self.limiter.configure(redis=redis)
+        limits = [(('telegram', 'secret', '42'), 1, 3)]
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(self.limiter.acquire(limits), 0)
+            self.assertEqual(self.limiter.acquire(limits), 0.25)
+            self.assertEqual(self.limiter.acquire(limits), 0)
+        sleep.assert_called_once_with(0.25)
+        redis_key = script.call_args[1]['keys'][0]
+        self.assertTrue(redis_key.startswith('gefion:limit:'))
+        self.assertNotIn('secret', redis_key)
+        self.assertEqual(script.call_args[1]['args'], [1, 3])
+        self.assertTrue(self.limiter.api_serialised['shared'])
+        self.limiter.configure()
+        self.assertFalse(self.limiter.api_serialised['shared'])
+
+    def test_retry_after(self):
+        """Test that messages throttled by Telegram are sent again."""
+        message = notifiers.Message('Test Machine',
+                                    Result(False, 1, '', 1480000000))
+        notifier = notifiers.TelegramNotifier(message, '-1000',
+                                              token='123456:ABCdef')
+        with mock.patch('telegram.Bot.sendMessage',
+                        side_effect=[RetryAfter(0), None]) as send_message:
+            self.assertTrue(notifier.send())
+        self.assertEqual(send_message.call_count, 2)
+        self.assertEqual(len(notifier.limits()), 2)
+
+
 class TestMessage(unittest.TestCase):
     """Test Message class."""
 
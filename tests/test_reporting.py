@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Tests for batched result reporting."""
+
+import unittest
+
+import requests
+
+from gefion.checks import Result
+from gefion.reporting import ResultBuffer
+
+
+class FakeResponse(object):
+    """Duck-types requests.Response."""
+
+    status_code = 200
+
+    def __init__(self, body=None):
+        """Initialise FakeResponse."""
+        self.body = body
+
+    def json(self):
+        """Return response body."""
+        if self.body is not None:
+            raise ValueError('Expecting value: line 1 column 1 (char 0)')
+        return {'accepted': 1, 'rejected': []}
+
+
+class FakeSession(object):
+    """Duck-types requests.Session, recording posts."""
+
+    def __init__(self, fail=False, body=None):
+        """Initialise FakeSession."""
+        self.posts = []
+        self.fail = fail
+        self.body = body
+
+    def post(self, url, json, timeout):
+        """Record post."""
+        if self.fail:
+            raise requests.exceptions.ConnectionError('Unreachable.')
+        self.posts.append((url, json))
+        return FakeResponse(self.body)
+
+    def close(self):
+        """Close session."""
+        pass
+
+
+class TestResultBuffer(unittest.TestCase):
+    """Test ResultBuffer."""
+
+    def setUp(self):
+        """Setup ResultBuffer tests."""
+        self.result = Result(True, 0.1, '', 1480000000)
+
+    def tearDown(self):
+        """Tear down ResultBuffer tests."""
+        pass
+
+    def test_batches(self):
+        """Test that results are submitted in batches."""
+        session = FakeSession()
+        buffer = ResultBuffer('http://master/', batch_size=2, max_delay=60,
+                              session=session)
+        for monitor_id in range(5):
+            buffer.add(monitor_id, 'uuid', self.result)
+        buffer.close()
+        self.assertEqual(session.posts[0][0], 'http://master/results')
+        sizes = [len(body['results']) for _, body in session.posts]
+        self.assertEqual(sum(sizes), 5)
+        self.assertTrue(all(size <= 2 for size in sizes))
+        self.assertEqual(session.posts[0][1]['results'][0],
+                         {'id': 0, 'unique_id': 'uuid',
+                          'result': self.result.api_serialised})
+
+    def test_failure(self):
+        """Test that failed batches are kept, up to max_pending."""
+        buffer = ResultBuffer('http://master/', batch_size=2, max_delay=60,
+                              max_pending=3, session=FakeSession(fail=True))
+        buffer.close()
+        for monitor_id in range(5):
+            buffer.pending.append({'id': monitor_id})
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual([item['id'] for item in buffer.pending], [2, 3, 4])
+
+    def test_invalid_reply(self):
+        """Test that batches answered with invalid JSON are kept."""
+        buffer = ResultBuffer('http://master/', batch_size=2, max_delay=60,
+                              session=FakeSession(body='<html>'))
+        buffer.close()
+        buffer.pending.append({'id': 1})
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending, [{'id': 1}])
+        self.assertTrue(buffer.submit([]) is False)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Tests for scheduling helpers."""
+
+import unittest
+
+from gefion import scheduling
+
+
+class TestPhases(unittest.TestCase):
+    """Test phase-spread scheduling."""
+
+    def setUp(self):
+        """Setup phase tests."""
+        self.monitors = [{'id': monitor_id, 'frequency': 5}
+                         for monitor_id in range(3000)]
+
+    def tearDown(self):
+        """Tear down phase tests."""
+        pass
+
+    def test_phase_offset(self):
+        """Test that phases are stable and within the interval."""
+        offset = scheduling.phase_offset(42, 300)
+        self.assertEqual(offset, scheduling.phase_offset(42, 300))
+        self.assertTrue(0 <= offset < 300)
+        self.assertNotEqual(offset, scheduling.phase_offset(43, 300))
+
+    def test_phase_delay(self):
+        """Test that delays land on the phase of the monitor."""
+        offset = scheduling.phase_offset(42, 300)
+        delay = scheduling.phase_delay(42, 300, 1480000000)
+        self.assertTrue(0 <= delay < 300)
+        self.assertAlmostEqual((1480000000 + delay) % 300, offset)
+
+    def test_next_run_delay(self):
+        """Test that early runs do not fire twice in a row."""
+        offset = scheduling.phase_offset(42, 300)
+        slot = 1480000000 - 1480000000 % 300 + offset
+        self.assertAlmostEqual(
+            scheduling.next_run_delay(42, 300, slot - 0.01), 300.01)
+        self.assertAlmostEqual(
+            scheduling.next_run_delay(42, 300, slot + 0.01), 299.99)
+
+    def test_load_histogram(self):
+        """Test that monitors of the same interval are spread out."""
+        histogram = scheduling.load_histogram(self.monitors)
+        self.assertEqual(len(histogram), 300)
+        self.assertEqual(sum(histogram), 3000)
+        self.assertLess(max(histogram), 30)  # Lockstep would be 3000.
+
+    def test_load_histogram_window(self):
+        """Test that shorter intervals repeat within the window."""
+        histogram = scheduling.load_histogram([{'id': 1, 'frequency': 1}],
+                                              window=300)
+        self.assertEqual(sum(histogram), 5)
+
+
+class TestTimerHeap(unittest.TestCase):
+    """Test TimerHeap."""
+
+    def setUp(self):
+        """Setup TimerHeap tests."""
+        self.timers = scheduling.TimerHeap()
+
+    def tearDown(self):
+        """Tear down TimerHeap tests."""
+        pass
+
+    def test_pop_due(self):
+        """Test that due entries are popped in order."""
+        self.timers.push('b', 2, 'second')
+        self.timers.push('a', 1, 'first')
+        self.timers.push('c', 3)
+        self.assertEqual(self.timers.pop_due(2),
+                         [('a', 1, 'first'), ('b', 2, 'second')])
+        self.assertEqual(len(self.timers), 1)
+        self.assertEqual(self.timers.next_due(), 3)
+
+    def test_supersede(self):
+        """Test that pushing a key again replaces its entry."""
+        self.timers.push('a', 1)
+        self.timers.push('a', 5)
+        self.assertEqual(self.timers.pop_due(4), [])
+        self.assertEqual(self.timers.get('a'), (5, None))
+        self.timers.remove('a')
+        self.assertNotIn('a', self.timers)
+        self.assertIsNone(self.timers.next_due())
+
+    def test_many(self):
+        """Test scheduling many monitors at sub-second precision."""
+        for key in range(50000):
+            self.timers.push(key, key / 1000)
+        self.assertEqual(len(self.timers.pop_due(10)), 10001)
+        self.assertEqual(self.timers.next_due(), 10.001)
+
+
+class TestLagStats(unittest.TestCase):
+    """Test LagStats."""
+
+    def setUp(self):
+        """Setup LagStats tests."""
+        pass
+
+    def tearDown(self):
+        """Tear down LagStats tests."""
+        pass
+
+    def test_record(self):
+        """Test lag statistics."""
+        lag = scheduling.LagStats(window=100)
+        self.assertEqual(lag.percentile(0.99), 0.0)
+        for millisecond in range(1, 201):
+            lag.record(millisecond / 1000)
+        self.assertEqual(lag.runs, 200)
+        self.assertEqual(lag.max_lag, 0.2)
+        self.assertEqual(lag.percentile(0.99), 0.2)
+        self.assertEqual(lag.percentile(0), 0.101)
+        self.assertAlmostEqual(lag.api_serialised['mean_lag'], 0.1005)
+
+
+class TestMonitorInterval(unittest.TestCase):
+    """Test the monitor_interval() method."""
+
+    def setUp(self):
+        """Setup monitor_interval tests."""
+        pass
+
+    def tearDown(self):
+        """Tear down monitor_interval tests."""
+        pass
+
+    def test_interval(self):
+        """Test that seconds take precedence over minutes."""
+        self.assertEqual(scheduling.monitor_interval({'frequency': 5}), 300)
+        self.assertEqual(scheduling.monitor_interval(
+            {'frequency': 5, 'interval': None}), 300)
+        self.assertEqual(scheduling.monitor_interval(
+            {'frequency': 5, 'interval': 10}), 10)
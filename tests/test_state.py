@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Tests for the Monitor state cache."""
+
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from gefion.database import create_schema
+from gefion.checks import Result
+from gefion.models import Monitor, ResultRecord, Rollup
+from gefion.state import StateCache, StateWriter
+
+
+class FakeRedis(object):
+    """Duck-types the redis.Redis commands used by master tasks."""
+
+    def __init__(self):
+        """Initialise FakeRedis."""
+        self.data = dict()
+
+    def get(self, name):
+        """Return value."""
+        return self.data.get(name)
+
+    def set(self, name, value, ex=None):
+        """Set value, ignoring expiry."""
+        self.data[name] = value.encode('utf-8')
+
+    def rpush(self, name, value):
+        """Append to list and return its length."""
+        self.data.setdefault(name, list()).append(value.encode('utf-8'))
+        return len(self.data[name])
+
+    def lrange(self, name, start, end):
+        """Return all of list, ignoring bounds."""
+        return list(self.data.get(name, list()))
+
+    def delete(self, name):
+        """Delete key."""
+        return int(self.data.pop(name, None) is not None)
+
+    def expire(self, name, time):
+        """Ignore expiry."""
+        return name in self.data
+
+    def pipeline(self):
+        """Return pipeline running commands on execute."""
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    """Duck-types redis.client.Pipeline of FakeRedis."""
+
+    def __init__(self, redis):
+        """Initialise FakePipeline."""
+        self.redis = redis
+        self.commands = list()
+
+    def __getattr__(self, name):
+        """Queue command."""
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        """Run queued commands and return their results."""
+        commands, self.commands = self.commands, list()
+        return [getattr(self.redis, name)(*args) for name, args in commands]
+
+
+class TestStateCache(unittest.TestCase):
+    """Test StateCache."""
+
+    def setUp(self):
+        """Setup StateCache tests."""
+        self.cache = StateCache(FakeRedis())
+
+    def tearDown(self):
+        """Tear down StateCache tests."""
+        pass
+
+    def test_get(self):
+        """Test round trip of states."""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, False, 'Down.')
+        self.assertEqual(self.cache.get(1), (False, 'Down.'))
+
+
+class TestStateWriter(unittest.TestCase):
+    """Test StateWriter."""
+
+    def setUp(self):
+        """Setup StateWriter tests."""
+        self.engine = create_engine('sqlite://', poolclass=StaticPool,
+                                    connect_args={'check_same_thread': False})
+        create_schema(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine)
+        session = self.session_factory()
+        session.add_all([Monitor(name='one'), Monitor(name='two')])
+        session.commit()
+        session.close()
+        self.commits = list()
+        event.listen(self.engine, 'commit', self.commits.append)
+        self.writer = StateWriter(self.session_factory, flush_interval=60)
+
+    def tearDown(self):
+        """Tear down StateWriter tests."""
+        self.writer.close()
+        self.engine.dispose()
+
+    def monitors(self):
+        """Return stored Monitors by name."""
+        session = self.session_factory()
+        monitors = {monitor.name: monitor
+                    for monitor in session.query(Monitor)}
+        session.close()
+        return monitors
+
+    def test_deleted(self):
+        """Test that updates of deleted Monitors do not stall the rest."""
+        self.writer.add(1, last_message='Gone.')
+        self.writer.add(2, last_message='Down.')
+        session = self.session_factory()
+        session.query(Monitor).filter(Monitor.id == 1).delete()
+        session.commit()
+        session.close()
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(self.writer.pending, dict())
+        self.assertEqual(self.monitors()['two'].last_message, 'Down.')
+
+    def test_coalesce(self):
+        """Test that updates are merged and written in one commit."""
+        for second in range(100):
+            self.writer.add(1, last_updated=datetime.fromtimestamp(second))
+        self.writer.add(1, last_availability=False, last_message='Down.')
+        self.writer.add(2, last_updated=datetime.fromtimestamp(7))
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(len(self.commits), 1)
+        monitors = self.monitors()
+        self.assertEqual(monitors['one'].last_updated.timestamp(), 99)
+        self.assertEqual(monitors['one'].last_message, 'Down.')
+        self.assertEqual(monitors['two'].last_updated.timestamp(), 7)
+        self.assertEqual(self.writer.api_serialised['updates_per_commit'],
+                         102)
+
+    def test_history(self):
+        """Test that results are appended in the same commit."""
+        self.writer.add(1, last_message='Up.')
+        for second in range(10):
+            self.writer.record(1, Result(True, 0.1, 'Up.', second))
+        self.assertEqual(self.writer.flush(), 11)
+        self.assertEqual(len(self.commits), 1)
+        session = self.session_factory()
+        self.assertEqual(session.query(ResultRecord).count(), 10)
+        self.assertEqual(session.query(Rollup).count(), 3)
+        session.close()
+
+    def test_batch_size(self):
+        """Test that full batches are flushed without waiting."""
+        self.writer.close()
+        self.writer = StateWriter(self.session_factory, flush_interval=60,
+                                  batch_size=2)
+        self.writer.add(1, last_message='One.')
+        self.writer.add(2, last_message='Two.')
+        for _ in range(100):
+            if self.writer.commits:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.writer.rows, 2)
+
+    def test_close(self):
+        """Test that pending updates are written on close."""
+        self.writer.add(2, last_message='Bye.')
+        self.writer.close()
+        self.assertEqual(self.monitors()['two'].last_message, 'Bye.')
+
+    def test_failure(self):
+        """Test that failed updates are kept for the next flush."""
+        self.writer.add(1, last_message='Old.')
+        with mock.patch.object(self.writer, 'session_factory') as factory:
+            factory.return_value.execute.side_effect = RuntimeError
+            self.assertEqual(self.writer.flush(), 0)
+        self.writer.add(1, last_availability=True)
+        self.assertEqual(self.writer.pending,
+                         {1: {'last_message': 'Old.',
+                              'last_availability': True}})
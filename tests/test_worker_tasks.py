@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Tests for worker tasks."""
+
+import json
+import unittest
+from unittest import mock
+
+import requests
+
+from gefion import worker_tasks
+from gefion.checks import Result
+from tests.test_state import FakeRedis
+
+
+class FakeJob(object):
+    """Duck-types rq.job.Job."""
+
+    def __init__(self, meta):
+        """Initialise FakeJob."""
+        self.meta = meta
+
+
+class FakeScheduler(object):
+    """Duck-types rq_scheduler.Scheduler, recording changes."""
+
+    def __init__(self, jobs):
+        """Initialise FakeScheduler."""
+        self.jobs = jobs
+        self.cancelled = []
+        self.scheduled = []
+        self.connection = FakeRedis()
+
+    def get_jobs(self):
+        """Return scheduled jobs."""
+        return self.jobs
+
+    def cancel(self, job):
+        """Record cancellation."""
+        self.cancelled.append(job)
+
+    def schedule(self, **kwargs):
+        """Record scheduling."""
+        self.scheduled.append(kwargs)
+
+
+class TestRetries(unittest.TestCase):
+    """Test retry helpers."""
+
+    def setUp(self):
+        """Setup retry tests."""
+        pass
+
+    def tearDown(self):
+        """Tear down retry tests."""
+        pass
+
+    def test_retry_delay(self):
+        """Test the retry_delay() method."""
+        self.assertTrue(3 <= worker_tasks.retry_delay(1) <= 6)
+        self.assertTrue(40 <= worker_tasks.retry_delay(3, 10) <= 80)
+
+    def test_should_retry(self):
+        """Test the should_retry() method."""
+        down = Result(False, 1, 'Down.')
+        self.assertTrue(worker_tasks.should_retry(down, 1, 3))
+        self.assertFalse(worker_tasks.should_retry(down, 3, 3))
+        self.assertFalse(worker_tasks.should_retry(Result(True, 1, ''), 1))
+
+    def test_deferred_retry(self):
+        """Test that deferred retries name their Monitor for syncs."""
+        with mock.patch('gefion.worker_tasks.run_check',
+                        return_value=Result(False, 1, 'Down.')), \
+                mock.patch('gefion.worker_tasks.get_current_job'), \
+                mock.patch('gefion.worker_tasks.Scheduler') as scheduler:
+            self.assertFalse(worker_tasks.run_monitor(
+                7, 'uuid', 'port', {}, 'http://master/'))
+        kwargs = scheduler.return_value.enqueue_in.call_args[1]
+        self.assertEqual(kwargs['meta'], {'retry_of': 7})
+        self.assertEqual(kwargs['attempt'], 2)
+
+
+class TestDiffMonitors(unittest.TestCase):
+    """Test the diff_monitors() method."""
+
+    def setUp(self):
+        """Setup diff_monitors tests."""
+        pass
+
+    def tearDown(self):
+        """Tear down diff_monitors tests."""
+        pass
+
+    def test_diff(self):
+        """Test detection of added, removed and changed monitors."""
+        current = {1: {'id': 1, 'unique_id': 'a'},
+                   2: {'id': 2, 'unique_id': 'b'},
+                   3: {'id': 3, 'unique_id': 'c'}}
+        fetched = {1: {'id': 1, 'unique_id': 'a'},
+                   3: {'id': 3, 'unique_id': 'd'},
+                   4: {'id': 4, 'unique_id': 'e'}}
+        self.assertEqual(worker_tasks.diff_monitors(current, fetched),
+                         ({4}, {2}, {3}))
+        self.assertEqual(worker_tasks.diff_monitors(current, current),
+                         (set(), set(), set()))
+
+
+class TestFetchMonitors(unittest.TestCase):
+    """Test the fetch_monitors() method."""
+
+    def setUp(self):
+        """Setup fetch_monitors tests."""
+        self.config = {'master': {'endpoint': 'http://master/'}}
+        self.monitor = {'id': 1, 'unique_id': 'a', 'check': 'port',
+                        'arguments': json.dumps({'port': 1}), 'frequency': 5}
+
+    def tearDown(self):
+        """Tear down fetch_monitors tests."""
+        pass
+
+    def test_incremental(self):
+        """Test that unchanged monitors are left scheduled."""
+        removed = dict(self.monitor, id=2)
+        legacy_job = FakeJob({'interval': 300})
+        retry_job = FakeJob({})
+        removed_job = FakeJob({'monitor': removed})
+        kept_retry_job = FakeJob({'retry_of': self.monitor['id']})
+        removed_retry_job = FakeJob({'retry_of': 2})
+        scheduler = FakeScheduler([FakeJob({'monitor': self.monitor}),
+                                   removed_job, legacy_job, retry_job,
+                                   kept_retry_job, removed_retry_job])
+        added = dict(self.monitor, id=3)
+        with mock.patch('gefion.worker_tasks.request_monitors',
+                        return_value=([self.monitor, added], 'etag')):
+            etag = worker_tasks.fetch_monitors(scheduler, self.config)
+        self.assertEqual(etag, 'etag')
+        self.assertEqual(scheduler.cancelled,
+                         [legacy_job, removed_job, removed_retry_job])
+        self.assertEqual(len(scheduler.scheduled), 1)
+        self.assertEqual(scheduler.scheduled[0]['meta'], {'monitor': added})
+        self.assertEqual(scheduler.scheduled[0]['interval'], 300)
+
+    def test_request_error(self):
+        """Test that error replies of master are raised, not decoded."""
+        response = mock.Mock(status_code=401, text='Unauthorized')
+        response.raise_for_status.side_effect = \
+            requests.exceptions.HTTPError('401 Client Error')
+        with mock.patch('requests.get', return_value=response):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                worker_tasks.request_monitors(self.config)
+
+    def test_stored_etag(self):
+        """Test that the ETag of the last run is sent by the next."""
+        scheduler = FakeScheduler([FakeJob({'monitor': self.monitor})])
+        with mock.patch('gefion.worker_tasks.request_monitors',
+                        return_value=([self.monitor], 'etag')):
+            worker_tasks.fetch_monitors(scheduler, self.config)
+        with mock.patch('gefion.worker_tasks.request_monitors',
+                        return_value=(None, 'etag')) as request_monitors:
+            self.assertEqual(
+                worker_tasks.fetch_monitors(scheduler, self.config), 'etag')
+        request_monitors.assert_called_with(self.config, 'etag')
+        scheduler.jobs = list()  # Jobs lost, so the assignment is fetched.
+        with mock.patch('gefion.worker_tasks.request_monitors',
+                        return_value=(None, 'etag')) as request_monitors:
+            worker_tasks.fetch_monitors(scheduler, self.config)
+        request_monitors.assert_called_with(self.config, None)
+
+    def test_not_modified(self):
+        """Test that unchanged assignments touch nothing."""
+        scheduler = FakeScheduler([])
+        with mock.patch('gefion.worker_tasks.request_monitors',
+                        return_value=(None, 'etag')):
+            self.assertEqual(
+                worker_tasks.fetch_monitors(scheduler, self.config, 'etag'),
+                'etag')
+        self.assertEqual(scheduler.scheduled, [])